@@ -0,0 +1,120 @@
+"""Selezione delle dotazioni (servizi) in un solo `page.evaluate`.
+
+Gli step servizi di CaseVacanza (step 14) e Booking (step 7) spuntano una
+ventina di checkbox: con tre strategie di locator per voce, un fallback JS
+che rilegge tutte le checkbox della pagina e una pausa dopo ogni click erano
+decine di round trip. Qui la pagina indicizza una volta sola i controlli
+(checkbox, switch, bottoni con aria-pressed) con le loro etichette, clicca
+quelli richiesti non ancora attivi, aspetta che React aggiorni lo stato e
+verifica `checked` / `aria-checked` / `aria-pressed`.
+
+Per ogni voce, in ordine:
+1. "exact": etichetta del controllo identica;
+2. "partial": etichetta che contiene la voce (vince la più corta, cioè la più
+   specifica: "TV" non prende "TV via cavo" se c'è anche "TV");
+3. "container": testo della label/riga che contiene il controllo (il vecchio
+   fallback JS di casevacanza_uploader);
+4. "text" (solo con `text_fallback`): elemento con esattamente quel testo,
+   per i portali che usano "chip" cliccabili invece di checkbox (Booking).
+   Lo stato di questi non si può verificare: l'esito è "clicked".
+
+Ogni voce del report è {"label", "status", "via", "name"} con status tra
+"ok", "already" (era già attivo, non viene ricliccato), "clicked",
+"unchecked" (cliccato ma lo stato non è cambiato) e "miss".
+"""
+
+from __future__ import annotations
+
+_SELECT_JS = """async ([labels, textFallback, maxMs]) => {
+    const norm = (s) => (s || '').replace(/\\s+/g, ' ').trim();
+    const CONTROLS = 'input[type="checkbox"], [role="checkbox"], [role="switch"], button[aria-pressed]';
+    const isChecked = (el) => el.matches('input')
+        ? el.checked
+        : ['true', 'mixed'].includes(el.getAttribute('aria-checked') || el.getAttribute('aria-pressed'));
+    const namesOf = (el) => {
+        const names = [el.getAttribute('aria-label')];
+        const by = el.getAttribute('aria-labelledby');
+        if (by) names.push(by.split(' ').map(id => (document.getElementById(id) || {}).textContent || '').join(' '));
+        for (const l of (el.labels || [])) names.push(l.textContent);
+        const wrap = el.closest('label');
+        if (wrap) names.push(wrap.textContent);
+        if (!el.matches('input')) names.push(el.textContent);
+        return names.map(norm).filter(Boolean);
+    };
+    const buildIndex = () => Array.from(document.querySelectorAll(CONTROLS)).map(el => ({
+        el,
+        names: namesOf(el),
+        container: norm((el.closest('label') || el.parentElement?.parentElement || {}).textContent),
+    }));
+
+    let index = buildIndex();
+    const used = new Set();
+    const find = (label) => {
+        const free = index.filter(c => !used.has(c.el));
+        const exact = free.find(c => c.names.includes(label));
+        if (exact) return [exact.el, 'exact', label];
+        const low = label.toLowerCase();
+        let best = null, bestName = null;
+        for (const c of free) {
+            for (const n of c.names) {
+                if ((!bestName || n.length < bestName.length) && n.toLowerCase().includes(low)) { best = c; bestName = n; }
+            }
+        }
+        if (best) return [best.el, 'partial', bestName];
+        const inContainer = free.find(c => c.container.includes(label));
+        if (inContainer) return [inContainer.el, 'container', inContainer.names[0] || inContainer.container.substring(0, 60)];
+        if (textFallback) {
+            const hits = Array.from(document.querySelectorAll('label, button, [role="button"], li, span, div, p'))
+                .filter(el => norm(el.textContent) === label && el.getClientRects().length > 0);
+            // Il più interno: i contenitori hanno lo stesso testo ma non sono il chip
+            const inner = hits.filter(el => !hits.some(o => o !== el && el.contains(o)));
+            if (inner.length) return [inner[0], 'text', label];
+        }
+        return null;
+    };
+
+    const report = [];
+    for (const label of labels) {
+        const hit = find(label);
+        if (!hit) { report.push({label, status: 'miss', via: null, name: null}); continue; }
+        const [el, via, name] = hit;
+        used.add(el);
+        const control = via !== 'text';
+        if (control && isChecked(el)) { report.push({label, status: 'already', via, name}); continue; }
+        el.click();
+        report.push({label, status: control ? 'pending' : 'clicked', via, name, el});
+    }
+
+    // React aggiorna lo stato (e a volte ricrea i nodi) dopo il click:
+    // si ricontrolla fino a maxMs, ritrovando per etichetta i nodi staccati
+    const deadline = performance.now() + maxMs;
+    while (true) {
+        let pending = 0;
+        for (const r of report.filter(r => r.status === 'pending')) {
+            if (!r.el.isConnected) {
+                index = buildIndex();
+                const again = index.find(c => c.names.includes(r.name) || c.names.includes(r.label));
+                if (again) r.el = again.el;
+            }
+            if (r.el.isConnected && isChecked(r.el)) r.status = 'ok';
+            else pending++;
+        }
+        if (!pending || performance.now() > deadline) break;
+        await new Promise(resolve => setTimeout(resolve, 50));
+    }
+    return report.map(({el, ...r}) => r.status === 'pending' ? {...r, status: 'unchecked'} : r);
+}"""
+
+
+def select(page, labels, text_fallback: bool = False, max_ms: int = 2000) -> list[dict]:
+    """Spunta tutte le `labels` in un solo evaluate e ritorna il report per voce."""
+    return page.evaluate(_SELECT_JS, [list(labels), text_fallback, max_ms])
+
+
+def summary(report: list[dict]) -> str:
+    """Riga riassuntiva del report: selezionati, già attivi, mancanti."""
+    done = [r for r in report if r["status"] in ("ok", "already", "clicked")]
+    already = sum(1 for r in report if r["status"] == "already")
+    missing = [r["label"] for r in report if r["status"] in ("miss", "unchecked")]
+    line = f"Servizi: {len(done)}/{len(report)} selezionati ({already} già attivi)"
+    return line + (f", mancanti: {', '.join(missing)}" if missing else "")
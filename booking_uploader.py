@@ -8,6 +8,9 @@ import urllib.request
 
 from playwright.sync_api import sync_playwright
 
+import amenity_select
+import page_locate
+
 # Modalità interattiva: se il terminale è un TTY o se INTERACTIVE=1
 INTERACTIVE = sys.stdin.isatty() or os.environ.get("INTERACTIVE", "") == "1"
 
@@ -63,6 +66,7 @@ def human_type(page, selector, text):
 
 
 def try_step(page, step_name, func):
+    page_locate.current_step = step_name
     try:
         func()
         print(f"  OK: {step_name}")
@@ -72,6 +76,29 @@ def try_step(page, step_name, func):
         save_html(page, f"errore_{step_name}")
 
 
+def fill_first(page, field, candidates, value):
+    """Compila il primo campo trovato tra `candidates` (vedi page_locate; il
+    vincente viene ricordato in cache come `field`). Ritorna il candidato
+    usato, oppure None se nessuno è nella pagina."""
+    hit = page_locate.resolve(page, candidates, field=field)
+    if not hit:
+        return None
+    locator, candidate, _ = hit
+    locator.fill(value)
+    return candidate
+
+
+def click_continue(page):
+    """Bottone per passare allo step successivo del wizard (IT o EN)."""
+    btn = page_locate.locate(page, [("text", t, True) for t in ["Continua", "Continue", "Avanti", "Next"]],
+                             field="continua")
+    if btn is not None:
+        try:
+            btn.click()
+        except Exception:
+            pass
+
+
 def download_photos_from_urls(urls, fallback_count=5):
     """Scarica foto dagli URL CDN (es. Krossbooking) in cartella temporanea.
 
@@ -335,15 +362,14 @@ def insert_property(page):
         screenshot(page, "tipo_struttura_pagina")
         save_html(page, "step1_tipo")
         # Booking usa "Apartment" o "Appartamento" a seconda della lingua
-        for label in ["Appartamento", "Apartment", "Appartamenti"]:
+        hit = page_locate.resolve(page, [("text", t, True) for t in ["Appartamento", "Apartment", "Appartamenti"]],
+                                  field="tipo")
+        if hit:
             try:
-                btn = page.get_by_text(label, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    print(f"  Tipo selezionato: {label}")
-                    break
+                hit[0].click()
+                print(f"  Tipo selezionato: {hit[1][1]}")
             except Exception:
-                continue
+                pass
         wait(page)
         screenshot(page, "tipo_selezionato")
 
@@ -353,25 +379,15 @@ def insert_property(page):
     print("Step 2: Numero strutture")
 
     def do_step2():
-        for label in ["Una", "One", "1"]:
+        hit = page_locate.resolve(page, [("text", t, True) for t in ["Una", "One", "1"]], field="numero")
+        if hit:
             try:
-                btn = page.get_by_text(label, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    print(f"  Selezionato: {label}")
-                    break
+                hit[0].click()
+                print(f"  Selezionato: {hit[1][1]}")
             except Exception:
-                continue
+                pass
         wait(page)
-        # Click continua/next
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_numero")
 
@@ -384,30 +400,18 @@ def insert_property(page):
         screenshot(page, "nome_pagina")
         save_html(page, "step3_nome")
         # Prova diversi selettori per il campo nome
-        nome_field = page.get_by_label("Nome della struttura")
-        if nome_field.count() == 0:
-            nome_field = page.get_by_label("Property name")
-        if nome_field.count() == 0:
-            nome_field = page.locator(
-                "input[name*='name'], input[name*='nome'], "
-                "input[placeholder*='nome'], input[placeholder*='name']"
-            )
-        if nome_field.count() > 0:
-            nome_field.first.fill(ident["nome_struttura"])
+        if fill_first(page, "nome", [
+            ("label", "Nome della struttura"),
+            ("label", "Property name"),
+            ("css", "input[name*='name'], input[name*='nome'], "
+                    "input[placeholder*='nome'], input[placeholder*='name']"),
+        ], ident["nome_struttura"]):
             print(f"  Nome: {ident['nome_struttura']}")
         else:
             print("  Campo nome non trovato")
         wait(page)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_nome")
 
@@ -421,52 +425,37 @@ def insert_property(page):
         save_html(page, "step4_indirizzo")
 
         # Indirizzo
-        addr_field = page.get_by_label("Indirizzo")
-        if addr_field.count() == 0:
-            addr_field = page.get_by_label("Street address")
-        if addr_field.count() == 0:
-            addr_field = page.locator("input[name*='address'], input[name*='street']")
-        if addr_field.count() > 0:
-            addr_field.first.fill(ident["indirizzo"])
+        if fill_first(page, "indirizzo", [
+            ("label", "Indirizzo"),
+            ("label", "Street address"),
+            ("css", "input[name*='address'], input[name*='street']"),
+        ], ident["indirizzo"]):
             print(f"  Indirizzo: {ident['indirizzo']}")
 
         wait(page, 1000)
 
         # Città
-        city_field = page.get_by_label("Città")
-        if city_field.count() == 0:
-            city_field = page.get_by_label("City")
-        if city_field.count() == 0:
-            city_field = page.locator("input[name*='city'], input[name*='citta']")
-        if city_field.count() > 0:
-            city_field.first.fill(ident["comune"])
+        if fill_first(page, "citta", [
+            ("label", "Città"),
+            ("label", "City"),
+            ("css", "input[name*='city'], input[name*='citta']"),
+        ], ident["comune"]):
             print(f"  Città: {ident['comune']}")
 
         wait(page, 1000)
 
         # CAP
-        cap_field = page.get_by_label("CAP")
-        if cap_field.count() == 0:
-            cap_field = page.get_by_label("Zip code")
-        if cap_field.count() == 0:
-            cap_field = page.get_by_label("Codice postale")
-        if cap_field.count() == 0:
-            cap_field = page.locator("input[name*='zip'], input[name*='postal']")
-        if cap_field.count() > 0:
-            cap_field.first.fill(ident["cap"])
+        if fill_first(page, "cap", [
+            ("label", "CAP"),
+            ("label", "Zip code"),
+            ("label", "Codice postale"),
+            ("css", "input[name*='zip'], input[name*='postal']"),
+        ], ident["cap"]):
             print(f"  CAP: {ident['cap']}")
 
         wait(page, 1000)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_indirizzo")
 
@@ -480,44 +469,27 @@ def insert_property(page):
         save_html(page, "step5_composizione")
 
         # Ospiti
-        for label in ["Ospiti", "Guests", "Numero massimo di ospiti"]:
-            field = page.get_by_label(label)
-            if field.count() > 0:
-                field.first.fill(str(comp["max_ospiti"]))
-                print(f"  Ospiti: {comp['max_ospiti']}")
-                break
+        if fill_first(page, "ospiti", [("label", l) for l in ["Ospiti", "Guests", "Numero massimo di ospiti"]],
+                      str(comp["max_ospiti"])):
+            print(f"  Ospiti: {comp['max_ospiti']}")
 
         wait(page, 1000)
 
         # Camere da letto
-        for label in ["Camere da letto", "Bedrooms"]:
-            field = page.get_by_label(label)
-            if field.count() > 0:
-                field.first.fill(str(comp["camere"]))
-                print(f"  Camere: {comp['camere']}")
-                break
+        if fill_first(page, "camere", [("label", l) for l in ["Camere da letto", "Bedrooms"]],
+                      str(comp["camere"])):
+            print(f"  Camere: {comp['camere']}")
 
         wait(page, 1000)
 
         # Bagni
-        for label in ["Bagni", "Bathrooms"]:
-            field = page.get_by_label(label)
-            if field.count() > 0:
-                field.first.fill(str(comp["bagni"]))
-                print(f"  Bagni: {comp['bagni']}")
-                break
+        if fill_first(page, "bagni", [("label", l) for l in ["Bagni", "Bathrooms"]],
+                      str(comp["bagni"])):
+            print(f"  Bagni: {comp['bagni']}")
 
         wait(page, 1000)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_composizione")
 
@@ -598,26 +570,15 @@ def insert_property(page):
                     break
             if not found:
                 # Fallback: prova fill() su input con label
-                for label in labels:
-                    field = page.get_by_label(label)
-                    if field.count() > 0:
-                        field.first.fill(str(quantita))
-                        print(f"  {label}: {quantita} via fill (dal JSON)")
-                        found = True
-                        break
+                used = fill_first(page, f"letto_{tipo}", [("label", l) for l in labels], str(quantita))
+                if used:
+                    print(f"  {used[1]}: {quantita} via fill (dal JSON)")
+                    found = True
             if not found:
                 print(f"  Label non trovata per tipo '{tipo}', skip")
             wait(page, 500)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_letti")
 
@@ -630,36 +591,28 @@ def insert_property(page):
         screenshot(page, "servizi_pagina")
         save_html(page, "step7_servizi")
 
-        for servizio in SERVIZI:
-            try:
-                btn = page.get_by_text(servizio, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    page.wait_for_timeout(500)
-                    print(f"  Servizio selezionato: {servizio}")
-                else:
-                    # Prova con checkbox/label
-                    cb = page.locator(f"label:has-text('{servizio}')")
-                    if cb.count() > 0:
-                        cb.first.click()
-                        page.wait_for_timeout(500)
-                        print(f"  Servizio selezionato (label): {servizio}")
-                    else:
-                        print(f"  Servizio non trovato: {servizio}")
-            except Exception as e:
-                print(f"  Errore servizio {servizio}: {e}")
+        # Stesso motore dello step servizi di CaseVacanza; Booking a volte usa
+        # "chip" cliccabili invece di checkbox, da qui il fallback sul testo
+        try:
+            report = amenity_select.select(page, SERVIZI, text_fallback=True)
+        except Exception as e:
+            print(f"  Errore selezione servizi: {e}")
+            report = []
+        for r in report:
+            if r["status"] in ("ok", "clicked"):
+                print(f"  Servizio selezionato: {r['label']}")
+            elif r["status"] == "already":
+                print(f"  Servizio già selezionato: {r['label']}")
+            elif r["status"] == "unchecked":
+                print(f"  Servizio cliccato ma non selezionato: {r['label']}")
+            else:
+                print(f"  Servizio non trovato: {r['label']}")
+        if report:
+            print(f"  {amenity_select.summary(report)}")
 
         wait(page)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_servizi")
 
@@ -702,15 +655,7 @@ def insert_property(page):
             print("  SKIP foto")
             screenshot(page, "foto_skip")
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
 
     try_step(page, "step8_foto", do_step8)
@@ -732,15 +677,7 @@ def insert_property(page):
 
         wait(page, 1000)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_descrizione")
 
@@ -759,12 +696,9 @@ def insert_property(page):
         prezzo = cond.get("prezzo_notte")
         if prezzo is not None:
             prezzo_str = str(prezzo)
-            for label in ["Prezzo per notte", "Price per night", "Prezzo"]:
-                field = page.get_by_label(label)
-                if field.count() > 0:
-                    field.first.fill(prezzo_str)
-                    print(f"  Prezzo: {prezzo_str} EUR/notte (dal JSON)")
-                    break
+            if fill_first(page, "prezzo", [("label", l) for l in ["Prezzo per notte", "Price per night", "Prezzo"]],
+                          prezzo_str):
+                print(f"  Prezzo: {prezzo_str} EUR/notte (dal JSON)")
         else:
             print("  Prezzo non presente nel JSON — lascio vuoto")
 
@@ -774,26 +708,14 @@ def insert_property(page):
         cauzione_val = cond.get("cauzione_euro")
         if cauzione_val is not None:
             cauzione = str(cauzione_val)
-            for label in ["Cauzione", "Deposit", "Damage deposit"]:
-                field = page.get_by_label(label)
-                if field.count() > 0:
-                    field.first.fill(cauzione)
-                    print(f"  Cauzione: {cauzione} EUR (dal JSON)")
-                    break
+            if fill_first(page, "cauzione", [("label", l) for l in ["Cauzione", "Deposit", "Damage deposit"]], cauzione):
+                print(f"  Cauzione: {cauzione} EUR (dal JSON)")
         else:
             print("  Cauzione non presente nel JSON — lascio vuoto")
 
         wait(page, 1000)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_prezzo")
 
@@ -810,42 +732,24 @@ def insert_property(page):
         cir = ident.get("cir", "")
 
         # CIN
-        for label in ["CIN", "Codice Identificativo Nazionale"]:
-            field = page.get_by_label(label)
-            if field.count() > 0:
-                field.first.fill(cin)
-                print(f"  CIN: {cin}")
-                break
-        else:
-            cin_field = page.locator(
-                "input[name*='cin'], input[name*='CIN'], input[placeholder*='CIN']"
-            )
-            if cin_field.count() > 0:
-                cin_field.first.fill(cin)
-                print(f"  CIN (fallback): {cin}")
+        used = fill_first(page, "cin", [
+            ("label", "CIN"),
+            ("label", "Codice Identificativo Nazionale"),
+            ("css", "input[name*='cin'], input[name*='CIN'], input[placeholder*='CIN']"),
+        ], cin)
+        if used:
+            print(f"  CIN{' (fallback)' if used[0] == 'css' else ''}: {cin}")
 
         wait(page, 1000)
 
         # CIR
         if cir:
-            for label in ["CIR", "Codice Identificativo Regionale"]:
-                field = page.get_by_label(label)
-                if field.count() > 0:
-                    field.first.fill(cir)
-                    print(f"  CIR: {cir}")
-                    break
+            if fill_first(page, "cir", [("label", "CIR"), ("label", "Codice Identificativo Regionale")], cir):
+                print(f"  CIR: {cir}")
 
         wait(page, 1000)
 
-        # Continua
-        for txt in ["Continua", "Continue", "Avanti", "Next"]:
-            try:
-                btn = page.get_by_text(txt, exact=True)
-                if btn.count() > 0:
-                    btn.first.click()
-                    break
-            except Exception:
-                continue
+        click_continue(page)
         wait(page)
         screenshot(page, "dopo_codici")
 
@@ -912,6 +816,8 @@ def main():
                 save_html(page, "final_state")
             except Exception:
                 pass
+            if page_locate.summary():
+                print(page_locate.summary())
             browser.close()
 
 
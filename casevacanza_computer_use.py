@@ -5,89 +5,433 @@ Use tool) decida cosa cliccare guardando gli screenshot. Niente selettori CSS
 hardcoded: l'agente legge lo schermo come un umano.
 
 Uso:
-    python casevacanza_computer_use.py [path/al/JSON]
+    python casevacanza_computer_use.py [path/al/JSON] [--resume]
+
+Il loop è anche importabile (attach_page + run_agent): casevacanza_hybrid.py lo
+usa come fallback per i singoli step falliti dell'uploader scriptato.
 
 Env vars richieste:
     CV_EMAIL, CV_PASSWORD       — credenziali CaseVacanza
     ANTHROPIC_API_KEY           — API key Anthropic
 
 Default JSON: Casa_Adelasia_A_DATI.json (override via primo argomento CLI).
-Salva uno screenshot per ogni azione del modello in screenshots/cu_stepNNN.png.
+Salva uno screenshot per ogni azione del modello in screenshots/cu_stepNNN_<azione>.<ext>
+(lo stesso frame inviato al modello, scritto su disco da un thread in background).
 """
 
 from __future__ import annotations
 
 import base64
+import concurrent.futures
+import copy
+import hashlib
+import io
 import json
 import os
+import queue
+import random
+import re
 import sys
+import threading
 import time
 from pathlib import Path
 
-from anthropic import Anthropic
+from anthropic import Anthropic, APIConnectionError, APIStatusError
 from playwright.sync_api import sync_playwright
 
+import casevacanza_photos
+import cu_dom
+import cu_screencast
+import cu_templates
+import cu_trajectory
+import page_wait
+import session_vault
+
+try:
+    from PIL import Image  # opzionale: serve solo per WebP e downscaling
+except ImportError:
+    Image = None
+
 # --- Config ---
 SCREEN_W, SCREEN_H = 1280, 800
 SCREENSHOT_DIR = Path("screenshots")
 MODEL = "claude-sonnet-4-6"  # 'claude-sonnet-4-7' non esiste; questo è l'ultimo Sonnet
-MAX_TURNS = 200  # cintura di sicurezza contro loop costosi
+# Tiering: i turni di routine ("clicca Continua", "scrivi il CAP") girano sul
+# modello piccolo; si passa a MODEL dopo un errore, uno screenshot identico al
+# precedente o uno step fermo da ESCALATE_STALL_TURNS turni, e si torna al
+# piccolo quando il wizard avanza. CU_MODEL_SMALL="" = sempre MODEL.
+# La prompt cache è per modello: ogni cambio riscrive tutto il prefisso. Per
+# questo si resta su un modello almeno TIER_MIN_TURNS turni (salvo errori) e si
+# torna al piccolo solo se il risparmio atteso copre la riscrittura.
+MODEL_SMALL = os.environ.get("CU_MODEL_SMALL", "claude-haiku-4-5")
+ESCALATE_STALL_TURNS = int(os.environ.get("CU_ESCALATE_STALL_TURNS", "4"))
+TIER_MIN_TURNS = int(os.environ.get("CU_TIER_MIN_TURNS", "3"))
+MAX_TURNS = int(os.environ.get("CU_MAX_TURNS", "200"))  # cintura di sicurezza contro loop costosi
+# Rilevamento loop: la stessa azione sulla stessa schermata (hash percettivo,
+# tollera spinner e cursore) ripetuta STALL_REPEATS volte fa scattare un avviso
+# al modello; dopo altre STALL_ABORT ripetizioni il run si ferma con un bundle
+# diagnostico invece di bruciare turni fino a MAX_TURNS.
+STALL_REPEATS = int(os.environ.get("CU_STALL_REPEATS", "3"))
+STALL_ABORT = int(os.environ.get("CU_STALL_ABORT", "2"))
+STALL_HAMMING = 5  # bit diversi (su 64) entro cui due schermate sono "la stessa"
 COMPUTER_BETA = "computer-use-2025-01-24"
+# Prompt caching: system+tool e JSON proprietà sono identici per tutto il run,
+# quindi li marchiamo come breakpoint fissi; un terzo breakpoint "rolling" segue
+# l'ultimo messaggio così ogni turno rilegge dalla cache la history precedente.
+CACHE_CONTROL = {"type": "ephemeral"}
+# Finestra screenshot: nella history restano come immagine solo gli ultimi N,
+# i più vecchi diventano uno stub testuale. Si pota a blocchi di PRUNE_BATCH
+# così il prefisso resta stabile (e in cache) per più turni consecutivi.
+KEEP_SCREENSHOTS = int(os.environ.get("CU_KEEP_SCREENSHOTS", "3"))
+PRUNE_BATCH = int(os.environ.get("CU_PRUNE_BATCH", "5"))
+# Compattazione: quando il wizard passa alla schermata successiva (URL o titolo
+# cambiano, come in click_save_and_verify) i turni della fase conclusa vengono
+# sostituiti da un riassunto di una riga nel primo messaggio.
+COMPACT_PHASES = os.environ.get("CU_COMPACT_PHASES", "1") != "0"
+# Encoding screenshot verso il modello: png | jpeg | webp, qualità 1-100 e fattore
+# di scala (<1 riduce la risoluzione; le coordinate del modello vengono poi
+# riportate alla risoluzione nativa). WebP e scala richiedono Pillow.
+IMAGE_FORMAT = os.environ.get("CU_IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.environ.get("CU_IMAGE_QUALITY", "75"))
+IMAGE_SCALE = float(os.environ.get("CU_IMAGE_SCALE", "1.0"))
+if IMAGE_FORMAT not in ("png", "jpeg", "webp"):
+    raise SystemExit(f"CU_IMAGE_FORMAT non valido: {IMAGE_FORMAT} (png, jpeg, webp)")
+if Image is None and (IMAGE_FORMAT == "webp" or IMAGE_SCALE != 1.0):
+    print("⚠️ Pillow non installato: uso JPEG a risoluzione nativa (pip install Pillow)")
+    IMAGE_FORMAT, IMAGE_SCALE = "jpeg", 1.0
+# Risoluzione vista dal modello (quella dichiarata nel tool computer)
+MODEL_W, MODEL_H = round(SCREEN_W * IMAGE_SCALE), round(SCREEN_H * IMAGE_SCALE)
+# Settle dopo ogni azione: invece di un'attesa fissa confrontiamo frame a bassa
+# risoluzione ogni SETTLE_INTERVAL_MS e usciamo appena lo schermo è fermo per
+# SETTLE_STABLE_FRAMES confronti (e, se attivo, senza XHR/fetch partite da meno
+# di SETTLE_NETWORK_WINDOW_MS ancora in volo).
+SETTLE_MAX_MS = int(os.environ.get("CU_SETTLE_MAX_MS", "3000"))
+SETTLE_INTERVAL_MS = 100
+SETTLE_STABLE_FRAMES = 2
+SETTLE_NETWORK = os.environ.get("CU_SETTLE_NETWORK", "1") == "1"
+SETTLE_NETWORK_WINDOW_MS = int(os.environ.get("CU_SETTLE_NETWORK_WINDOW_MS", str(page_wait.NETWORK_WINDOW_MS)))
+# Backend di cattura: "screencast" tiene in memoria l'ultimo frame spinto da
+# Chromium (Page.startScreencast), "screenshot" fa un page.screenshot() per
+# frame. Lo screencast ripiega su page.screenshot se non ha un frame fresco.
+# Ogni CAPTURE_PROBE_EVERY frame si cronometra anche un page.screenshot di
+# confronto, a turno finito (0 = mai).
+CAPTURE = os.environ.get("CU_CAPTURE", "screencast").lower()
+CAPTURE_PROBE_EVERY = int(os.environ.get("CU_CAPTURE_PROBE_EVERY", "10"))
+
+# Replay delle traiettorie registrate (cu_trajectory.py): con 0 si registra
+# soltanto, ogni azione passa dal modello.
+REPLAY = os.environ.get("CU_REPLAY", "1") == "1"
+# Testi da almeno N caratteri (descrizione, titolo) vengono inseriti in un colpo
+# solo invece che tasto per tasto a 20 ms l'uno; 0 = sempre tasto per tasto.
+FAST_TYPE_MIN_CHARS = int(os.environ.get("CU_FAST_TYPE_MIN_CHARS", "40")) or float("inf")
+# Osservazione testuale: accanto a ogni screenshot l'elenco degli elementi
+# interattivi visibili (id, ruolo, etichetta, valore, box) e il tool
+# click_element(id). Con 0 l'agente vede solo i pixel.
+OBSERVE = os.environ.get("CU_OBSERVE", "1") == "1"
+OBSERVE_MAX_ELEMENTS = int(os.environ.get("CU_OBSERVE_MAX_ELEMENTS", "60"))
+# JSON della proprietà nel primo messaggio: "compact" toglie campi vuoti/false e
+# sostituisce testi e liste lunghe con un rimando a get_property_field; "full"
+# manda il dump completo.
+PROMPT_JSON = os.environ.get("CU_PROMPT_JSON", "compact").lower()
+BRIEF_MAX_CHARS = 200
+# Turni multi-azione: tutte le azioni del turno di fila, un solo screenshot
+# (sull'ultimo tool_result). Con 0 uno screenshot per ogni azione.
+BATCH_ACTIONS = os.environ.get("CU_BATCH_ACTIONS", "1") == "1"
+# Streaming della risposta: ogni tool_use parte appena il suo blocco è completo,
+# mentre il modello genera ancora i successivi. Con 0 si aspetta la risposta intera.
+STREAM = os.environ.get("CU_STREAM", "1") == "1"
+# Budget per inserzione (per processo, anche su più chiamate a run_agent):
+# superato un tetto l'agente si ferma con screenshot e dump dello stato.
+BUDGET_USD = float(os.environ.get("CU_BUDGET_USD", "2.0"))
+BUDGET_TOKENS = int(os.environ.get("CU_BUDGET_TOKENS", "4000000"))  # input+cache+output
+BUDGET_MINUTES = float(os.environ.get("CU_BUDGET_MINUTES", "25"))  # il workflow ha timeout 30
+# Prezzi $/M token (input, output). Cache: scrittura 1.25× input (TTL 5 min),
+# lettura 0.1× input.
+PRICES = {"claude-sonnet-4-6": (3.0, 15.0), "claude-haiku-4-5": (1.0, 5.0)}
+CACHE_WRITE_MULT = 1.25
+CACHE_READ_MULT = 0.1
+USAGE_LOG = Path(os.environ.get("CU_USAGE_LOG", str(SCREENSHOT_DIR / "cu_usage.jsonl")))
+RUN_ID = time.strftime("%Y%m%d-%H%M%S")
+# Checkpoint ogni N turni (conversazione potata + contatori + URL, sessione del
+# browser nel vault cifrato) per riprendere con --resume dopo un crash.
+CHECKPOINT_EVERY = int(os.environ.get("CU_CHECKPOINT_EVERY", "5"))
+CHECKPOINT_DIR = Path("checkpoints")
+# Retry delle chiamate API su 429/529 (e rete): backoff esponenziale con jitter
+API_RETRIES = int(os.environ.get("CU_API_RETRIES", "6"))
+API_BACKOFF_BASE_S = 2.0
+API_BACKOFF_MAX_S = 60.0
 # www.casevacanza.it non risolve dal runner GitHub Actions (vedi BOT_MEMORY 2026-05-05).
 LOGIN_URL = "https://user.casevacanza.it/login"
 
-# --- Carica dati proprietà ---
-data_file = sys.argv[1] if len(sys.argv) > 1 else "Casa_Adelasia_A_DATI.json"
-with open(data_file, encoding="utf-8") as fh:
-    PROP = json.load(fh)
-
-CV_EMAIL = os.environ["CV_EMAIL"]
-CV_PASSWORD = os.environ["CV_PASSWORD"]
+# --- Stato del run ---
+# Impostati da main() oppure da chi importa il modulo (casevacanza_hybrid.py):
+# l'agente lavora sempre sulla `page` agganciata con attach_page().
+page = None
+PROP: dict = {}
+DATA_FILE = ""  # path del JSON: le foto locali in marketing.foto sono relative a lì
+CV_EMAIL = ""  # credenziali: servono a legare/ricostruire i campi login nelle traiettorie
+CV_PASSWORD = ""  # e a mascherare la password nei log
 SCREENSHOT_DIR.mkdir(exist_ok=True)
 
-print(f"=== CaseVacanza Computer Use Agent ===")
-print(f"Proprietà: {PROP['identificativi']['nome_struttura']}")
-print(f"JSON: {data_file}")
-print(f"Modello: {MODEL}")
-print(f"Display: {SCREEN_W}x{SCREEN_H}")
-print(f"Max turni: {MAX_TURNS}")
-print(f"=====================================\n")
-
-# --- Browser via Playwright (solo come display) ---
-playwright = sync_playwright().start()
-browser = playwright.chromium.launch(
-    headless=False,
-    args=[f"--window-size={SCREEN_W},{SCREEN_H}", "--disable-blink-features=AutomationControlled"],
-)
-context = browser.new_context(viewport={"width": SCREEN_W, "height": SCREEN_H})
-page = context.new_page()
-page.set_default_timeout(30_000)
-
-# Pagina di partenza: navighiamo subito alla login per avere un DOM reale
-# (about:blank fa fallire Page.captureScreenshot — visto in run #3 del 05/05/2026).
-print(f"🌐 Navigazione a {LOGIN_URL}...")
-page.goto(LOGIN_URL, wait_until="domcontentloaded", timeout=30_000)
-try:
-    page.wait_for_load_state("networkidle", timeout=10_000)
-except Exception:
-    pass  # networkidle è best-effort, non bloccare se non arriva
-print("✅ Pagina caricata, attendo settling...")
-time.sleep(1.5)
+# Richieste in volo per il settle detector: solo XHR/fetch, come
+# page_wait.until_idle (script, stili e immagini li vede il confronto frame).
+_inflight: dict = {}  # richiesta -> monotonic di partenza
+
+
+def _on_request_start(request) -> None:
+    if request.resource_type in page_wait.NETWORK_TYPES:
+        _inflight[request] = time.monotonic()
+
+
+def _on_request_end(request) -> None:
+    _inflight.pop(request, None)
+
+
+def _network_busy() -> bool:
+    """True se c'è una richiesta XHR/fetch partita da meno di
+    SETTLE_NETWORK_WINDOW_MS: long polling e analytics che non finiscono mai
+    non tengono il settle fino al tetto."""
+    return page_wait.network_busy(_inflight, SETTLE_NETWORK_WINDOW_MS)
+
+
+def attach_page(p) -> None:
+    """Aggancia l'agente a una pagina Playwright già aperta."""
+    global page, _screencast
+    page = p
+    _inflight.clear()
+    page.on("request", _on_request_start)
+    page.on("requestfinished", _on_request_end)
+    page.on("requestfailed", _on_request_end)
+    if _screencast is not None:
+        _screencast.stop()
+        _screencast = None
+    # Lo screencast serve JPEG: png/webp vanno ricodificati, quindi serve Pillow
+    if CAPTURE == "screencast" and (IMAGE_FORMAT == "jpeg" or Image is not None):
+        try:
+            _screencast = cu_screencast.Screencast(page, MODEL_W, MODEL_H, IMAGE_QUALITY)
+        except Exception as exc:
+            print(f"  [WARN] Screencast non disponibile, uso page.screenshot: {exc}")
 
 
 # --- Helper: screenshot e salvataggio ---
+encoded_count = 0
+encoded_bytes = 0
+_screencast: cu_screencast.Screencast | None = None
+capture_ms: dict[str, list[int]] = {}  # backend -> ms per cattura
+_probe_due = [False]  # screenshot di confronto da fare a fine turno (probe_capture)
+
+
+def _timed(backend: str, t0: float) -> None:
+    capture_ms.setdefault(backend, []).append(round((time.monotonic() - t0) * 1000))
+
+
 def screenshot_bytes() -> bytes:
     return page.screenshot(full_page=False)
 
 
-def screenshot_b64() -> str:
-    return base64.standard_b64encode(screenshot_bytes()).decode("ascii")
+def encode_screenshot() -> tuple[bytes, str]:
+    """Frame nel formato/risoluzione inviati al modello: dallo screencast
+    (l'ultimo frame se dopo l'azione non c'è stato repaint), con
+    page.screenshot solo se lo screencast si è fermato. Ritorna (bytes, media_type)."""
+    if _screencast is not None:
+        t0 = time.monotonic()
+        data = _screencast.frame()
+        if data is not None:
+            if IMAGE_FORMAT != "jpeg":
+                # Il frame è già alla risoluzione del modello: solo ricodifica
+                buf = io.BytesIO()
+                img = Image.open(io.BytesIO(data))
+                img.save(buf, IMAGE_FORMAT.upper(), **({"optimize": True} if IMAGE_FORMAT == "png"
+                                                        else {"quality": IMAGE_QUALITY}))
+                data = buf.getvalue()
+            _timed("screencast", t0)
+            if CAPTURE_PROBE_EVERY and len(capture_ms["screencast"]) % CAPTURE_PROBE_EVERY == 0:
+                _probe_due[0] = True
+            return data, f"image/{IMAGE_FORMAT}"
+        print("  [capture] Screencast fermo (navigazione senza frame): page.screenshot")
+        _screencast.restart()
+    t0 = time.monotonic()
+    frame = _capture_screenshot()
+    _timed("screenshot", t0)
+    return frame
+
+
+def probe_capture() -> None:
+    """page.screenshot di confronto chiesto da encode_screenshot. Si chiama a
+    turno finito, fuori dal percorso osservazione → modello, così la misura
+    non aggiunge latenza ai turni che misura."""
+    if not _probe_due[0]:
+        return
+    _probe_due[0] = False
+    t0 = time.monotonic()
+    try:
+        page.screenshot(full_page=False, type="jpeg", quality=IMAGE_QUALITY)
+    except Exception as exc:
+        print(f"  [capture] Screenshot di confronto fallito: {exc}")
+        return
+    _timed("screenshot (confronto)", t0)
+
+
+def _capture_screenshot() -> tuple[bytes, str]:
+    """Cattura con page.screenshot. Senza ridimensionamento PNG e JPEG li
+    produce direttamente Chromium; WebP e downscaling passano da Pillow."""
+    if IMAGE_FORMAT == "png" and IMAGE_SCALE == 1.0:
+        return screenshot_bytes(), "image/png"
+    if IMAGE_FORMAT == "jpeg" and IMAGE_SCALE == 1.0:
+        return page.screenshot(full_page=False, type="jpeg", quality=IMAGE_QUALITY), "image/jpeg"
+    img = Image.open(io.BytesIO(screenshot_bytes()))
+    if IMAGE_SCALE != 1.0:
+        img = img.resize((MODEL_W, MODEL_H), Image.LANCZOS)
+    buf = io.BytesIO()
+    if IMAGE_FORMAT == "png":
+        img.save(buf, "PNG", optimize=True)
+    else:
+        img.convert("RGB").save(buf, IMAGE_FORMAT.upper(), quality=IMAGE_QUALITY)
+    return buf.getvalue(), f"image/{IMAGE_FORMAT}"
+
+
+# Scrittura artifact su disco fuori dal percorso critico: il loop accoda i bytes
+# già catturati e un thread daemon li scrive. La coda è limitata, quindi se il
+# disco non tiene il passo il loop rallenta invece di accumulare frame in RAM.
+_disk_queue: queue.Queue = queue.Queue(maxsize=16)
+
+
+def _disk_writer() -> None:
+    while True:
+        path, data, append = _disk_queue.get()
+        try:
+            if append:
+                with open(path, "ab") as fh:
+                    fh.write(data)
+            else:
+                path.write_bytes(data)
+        except Exception as exc:
+            print(f"  [WARN] Salvataggio {path.name} fallito: {exc}")
+        finally:
+            _disk_queue.task_done()
+
 
+threading.Thread(target=_disk_writer, name="cu-disk-writer", daemon=True).start()
 
-def save_screenshot(step_idx: int, action: str) -> None:
+
+# Lavoro CPU che non serve prima della risposta del modello (firma della
+# schermata per il rilevamento loop, serializzazione dei checkpoint): gira su un
+# thread mentre il main thread aspetta lo stream. Un solo worker, i job restano
+# in ordine; tutto ciò che tocca Playwright resta sul main thread.
+_prep = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="cu-prep")
+prep_s: list[float] = []  # durata di ogni job in background
+
+
+def _in_background(fn, *args) -> concurrent.futures.Future:
+    def job():
+        t0 = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            prep_s.append(time.monotonic() - t0)
+    return _prep.submit(job)
+
+
+def flush_artifacts() -> None:
+    """Attende i job in background e che il writer abbia scritto su disco
+    tutti gli artifact accodati."""
+    _prep.submit(lambda: None).result()
+    _disk_queue.join()
+
+
+def save_screenshot(step_idx: int, action: str, data: bytes, media_type: str) -> None:
+    """Accoda il frame per il salvataggio in screenshots/ (non blocca il loop)."""
     name = action.replace("/", "_")[:40]
-    path = SCREENSHOT_DIR / f"cu_step{step_idx:03d}_{name}.png"
-    page.screenshot(path=str(path))
+    ext = "jpg" if media_type == "image/jpeg" else media_type.split("/")[1]
+    path = SCREENSHOT_DIR / f"cu_step{step_idx:03d}_{name}.{ext}"
+    _last_frame[0] = path
+    _disk_queue.put((path, data, False))
+
+
+def screenshot_b64(step_idx: int, action: str) -> tuple[str, str]:
+    """Unica cattura per step: lo stesso frame va all'API e su disco.
+
+    Ritorna (base64, media_type) pronti per l'image block.
+    """
+    global encoded_count, encoded_bytes
+    data, media_type = encode_screenshot()
+    encoded_count += 1
+    encoded_bytes += len(data)
+    save_screenshot(step_idx, action, data, media_type)
+    return base64.standard_b64encode(data).decode("ascii"), media_type
+
+
+def _to_screen(coord) -> tuple[float, float]:
+    """Riporta una coordinata dello spazio del modello alla risoluzione nativa."""
+    x, y = coord
+    return x * SCREEN_W / MODEL_W, y * SCREEN_H / MODEL_H
+
+
+settle_times_ms: list[int] = []
+
+
+def _settle_frame():
+    """Frame a bassa risoluzione per il confronto: miniatura in scala di grigi
+    con Pillow, altrimenti i bytes del JPEG. Con lo screencast è l'ultimo frame
+    ricevuto (nessuna cattura); la miniatura si ricalcola solo se è cambiato."""
+    if _screencast is not None and _screencast.latest() is not None:
+        if _settle_cache[0] == _screencast.seq:
+            return _settle_cache[1]
+        data = _screencast.data
+    else:
+        data = page.screenshot(full_page=False, type="jpeg", quality=30)
+    frame = data if Image is None else (
+        Image.open(io.BytesIO(data)).convert("L").resize((SCREEN_W // 16, SCREEN_H // 16)))
+    if _screencast is not None:
+        _settle_cache[:] = [_screencast.seq, frame]
+    return frame
+
+
+_settle_cache: list = [-1, None]  # [seq del frame screencast, miniatura]
+
+
+def _frames_differ(a, b) -> bool:
+    if Image is None:
+        return a != b
+    # Differenza media per pixel (0-255): tollera cursore lampeggiante e piccoli spinner
+    diff = sum(abs(p - q) for p, q in zip(a.getdata(), b.getdata()))
+    return diff / (a.width * a.height) > 1.0
+
+
+def wait_for_settle(max_ms: int = SETTLE_MAX_MS) -> int:
+    """Attende che lo schermo smetta di cambiare (max `max_ms`). Ritorna i ms attesi."""
+    start = time.monotonic()
+    deadline = start + max_ms / 1000
+    prev = _settle_frame()
+    stable = 0
+    while time.monotonic() < deadline:
+        page.wait_for_timeout(SETTLE_INTERVAL_MS)
+        cur = _settle_frame()
+        if _frames_differ(prev, cur) or (SETTLE_NETWORK and _network_busy()):
+            stable = 0
+        else:
+            stable += 1
+            # Senza repaint dopo l'azione lo screencast ripropone il frame di
+            # prima: un confronto in più per non uscire prima che arrivi
+            need = SETTLE_STABLE_FRAMES
+            if _screencast is not None and not _screencast.repainted():
+                need += 1
+            if stable >= need:
+                break
+        prev = cur
+    elapsed = round((time.monotonic() - start) * 1000)
+    settle_times_ms.append(elapsed)
+    return elapsed
+
+
+def _percentile(values: list, q: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Stima token di un'immagine secondo la formula Anthropic (w*h/750)."""
+    return (width * height + 749) // 750
 
 
 # --- Mappa key Anthropic computer-use → Playwright ---
@@ -115,47 +459,63 @@ def execute_computer_action(action_input: dict) -> str | None:
     """Esegue l'azione richiesta dal modello. Ritorna eventuale messaggio di errore
     da rimandare al modello (None se tutto ok)."""
     action = action_input.get("action")
+    if _screencast is not None and action not in ("screenshot", "wait", "cursor_position"):
+        _screencast.mark()
     try:
         if action == "screenshot":
             return None  # lo screenshot viene scattato a fine turno comunque
 
         if action in ("left_click", "right_click", "middle_click"):
-            x, y = action_input["coordinate"]
+            x, y = _to_screen(action_input["coordinate"])
             btn = {"left_click": "left", "right_click": "right", "middle_click": "middle"}[action]
             page.mouse.click(x, y, button=btn)
 
         elif action == "double_click":
-            x, y = action_input["coordinate"]
+            x, y = _to_screen(action_input["coordinate"])
             page.mouse.dblclick(x, y)
 
         elif action == "triple_click":
-            x, y = action_input["coordinate"]
+            x, y = _to_screen(action_input["coordinate"])
             page.mouse.click(x, y, click_count=3)
 
         elif action == "mouse_move":
-            x, y = action_input["coordinate"]
+            x, y = _to_screen(action_input["coordinate"])
             page.mouse.move(x, y)
 
         elif action == "left_click_drag":
-            sx, sy = action_input["start_coordinate"]
-            ex, ey = action_input["coordinate"]
+            sx, sy = _to_screen(action_input["start_coordinate"])
+            ex, ey = _to_screen(action_input["coordinate"])
             page.mouse.move(sx, sy)
             page.mouse.down()
             page.mouse.move(ex, ey, steps=10)
             page.mouse.up()
 
         elif action == "type":
-            page.keyboard.type(action_input["text"], delay=20)
+            text = action_input["text"]
+            t0 = time.monotonic()
+            if len(text) >= FAST_TYPE_MIN_CHARS:
+                # Testo lungo in un colpo solo (evento input, che React intercetta);
+                # l'ultimo carattere passa dalla tastiera per i key handler del campo.
+                page.keyboard.insert_text(text[:-1])
+                page.keyboard.type(text[-1])
+                mode = "insert"
+            else:
+                page.keyboard.type(text, delay=20)
+                mode = "tasti"
+            type_times.append((len(text), mode, int((time.monotonic() - t0) * 1000)))
 
         elif action == "key":
             page.keyboard.press(_translate_key(action_input["text"]))
 
         elif action == "wait":
+            # La durata chiesta dal modello diventa il tetto: se lo schermo è già
+            # fermo si riparte subito.
             duration = float(action_input.get("duration", 1))
-            time.sleep(min(duration, 10))
+            wait_for_settle(max_ms=int(min(duration, 10) * 1000))
+            return None
 
         elif action == "scroll":
-            x, y = action_input.get("coordinate", [SCREEN_W // 2, SCREEN_H // 2])
+            x, y = _to_screen(action_input.get("coordinate", [MODEL_W // 2, MODEL_H // 2]))
             direction = action_input["scroll_direction"]
             amount = int(action_input.get("scroll_amount", 3)) * 100
             wheel = {"up": (0, -amount), "down": (0, amount),
@@ -170,13 +530,140 @@ def execute_computer_action(action_input: dict) -> str | None:
             return f"Azione sconosciuta: {action}"
 
         # Lascia che la UI si stabilizzi prima del prossimo screenshot
-        page.wait_for_timeout(500)
+        wait_for_settle()
         return None
 
     except Exception as exc:
         return f"Errore eseguendo {action}: {exc}"
 
 
+# --- Tool ad alto livello (oltre al mouse) ---
+_photo_paths: list | None = None  # scaricate una volta sola per run
+_clicked_at: list = [None]  # centro (coordinate native) dell'ultimo click_element riuscito
+
+
+def _visible_field(label: str):
+    """Primo campo visibile per etichetta, placeholder o nome accessibile."""
+    for loc in (page.get_by_label(label), page.get_by_placeholder(label),
+                page.get_by_role("textbox", name=label)):
+        for i in range(min(loc.count(), 5)):
+            if loc.nth(i).is_visible():
+                return loc.nth(i)
+    return None
+
+
+def _get_property_field(json_path: str) -> tuple[str, bool]:
+    path = json_path.strip().strip(".")
+    if not path:
+        return "Campi di primo livello: " + ", ".join(PROP), False
+    try:
+        value = cu_trajectory.lookup(PROP, path)
+    except (KeyError, IndexError, ValueError, TypeError):
+        return f"Campo '{json_path}' non presente nel JSON", True
+    return json.dumps(value, indent=1, ensure_ascii=False), False
+
+
+def _fill_field(label: str, json_path: str) -> tuple[str, bool]:
+    try:
+        value = cu_trajectory.lookup(PROP, json_path)
+    except (KeyError, IndexError, ValueError, TypeError):
+        return f"Campo '{json_path}' non presente nel JSON", True
+    if isinstance(value, (dict, list)):
+        return f"'{json_path}' non è un valore semplice: scegli un campo foglia", True
+    field = _visible_field(label)
+    if field is None:
+        return f"Nessun campo visibile con etichetta o placeholder '{label}'", True
+    text = str(value)
+    field.fill(text)
+    wait_for_settle()
+    return f"Campo '{label}' compilato con {json_path} ({len(text)} caratteri)", False
+
+
+def _upload_photos() -> tuple[str, bool]:
+    global _photo_paths
+    if _photo_paths is None:
+        _photo_paths = casevacanza_photos.load_photo_paths(PROP, DATA_FILE, placeholder=False)
+    if not _photo_paths:
+        return ("Nessuna foto reale nel JSON (marketing.foto / foto_urls assenti o non "
+                "raggiungibili): non caricare nulla, lascia lo step foto alla revisione manuale"), True
+    if not casevacanza_photos.upload_photos(page, _photo_paths):
+        return ("Né il bottone 'Carica foto' né un input file sono presenti: "
+                "apri prima lo step foto del wizard"), True
+    # Upload e generazione miniature lato portale
+    wait_for_settle(max_ms=10_000)
+    return f"{len(_photo_paths)} foto caricate", False
+
+
+def _click_known(name: str, n: int = 1) -> tuple[str, bool]:
+    point = cu_templates.click_known(page, name, n)
+    if point is None:
+        return f"'{name}' n. {n} non trovato sullo schermo: usa click_element o le coordinate", True
+    wait_for_settle()
+    x, y = point[0] * MODEL_W / SCREEN_W, point[1] * MODEL_H / SCREEN_H
+    return f"Cliccato {name} n. {n} a ({x:.0f},{y:.0f})", False
+
+
+def _learn_known_click(name: str, action_input: dict) -> None:
+    """Annota i click su widget noti (Salva, Ok, +/-) per cu_templates.py learn:
+    solo se il frame salvato è ancora quello su cui il modello ha deciso."""
+    if not _last_frame[1] or not _last_elements:
+        return
+    if name == "click_element":
+        el = _last_elements.get(int(action_input.get("id", 0)))
+    elif action_input.get("action") == "left_click":
+        x, y = action_input["coordinate"]
+        inside = [e for e in _last_elements.values()
+                  if e["box"][0] <= x <= e["box"][0] + e["box"][2] and e["box"][1] <= y <= e["box"][1] + e["box"][3]]
+        el = min(inside, key=lambda e: e["box"][2] * e["box"][3], default=None)
+    else:
+        return
+    if el:
+        cu_templates.log_click(_last_frame[0], el["label"], el["box"], MODEL_W / SCREEN_W)
+
+
+def _click_element(element_id: int) -> tuple[str, bool]:
+    _clicked_at[0] = None
+    center = cu_dom.element_center(page, element_id, _last_elements, MODEL_W / SCREEN_W)
+    if center is None:
+        return f"Elemento {element_id} non presente nell'ultima osservazione", True
+    page.mouse.click(*center)
+    _clicked_at[0] = center
+    wait_for_settle()
+    el = _last_elements.get(int(element_id), {})
+    return f"Cliccato [{element_id}] {el.get('role', '')} \"{el.get('label', '')}\"", False
+
+
+def execute_custom_tool(name: str, tool_input: dict) -> tuple[str, bool]:
+    """Esegue un tool ad alto livello. Ritorna (testo per il modello, is_error)."""
+    if _screencast is not None and name in _PAGE_TOOLS:
+        _screencast.mark()
+    try:
+        if name == "click_element":
+            return _click_element(tool_input["id"])
+        if name == "click_known":
+            return _click_known(tool_input["name"], int(tool_input.get("n") or 1))
+        if name == "get_property_field":
+            return _get_property_field(tool_input.get("json_path", ""))
+        if name == "fill_field":
+            return _fill_field(tool_input["label"], tool_input["json_path"])
+        if name == "upload_photos":
+            return _upload_photos()
+        return f"Tool sconosciuto: {name}", True
+    except Exception as exc:
+        return f"Errore eseguendo {name}: {exc}", True
+
+
+def perform_action(action_input: dict) -> str | None:
+    """Esegue un'azione registrata (computer o tool ad alto livello, con
+    "action" = nome del tool). Ritorna l'eventuale errore, come
+    execute_computer_action."""
+    name = action_input.get("action")
+    if name in CUSTOM_TOOL_NAMES:
+        text, is_error = execute_custom_tool(name, action_input)
+        return text if is_error else None
+    return execute_computer_action(action_input)
+
+
 # --- Prompt per il modello ---
 SYSTEM_PROMPT = """Sei un agente che pubblica una proprietà di affitto breve sul portale CaseVacanza.it.
 
@@ -189,6 +676,17 @@ REGOLE FONDAMENTALI:
 4. NON cliccare il bottone finale "Pubblica/Invia" della proprietà: fermati alla pagina di riepilogo prima della pubblicazione, scatta screenshot e dichiara fatto.
 5. Dopo ogni azione importante (cambio pagina, salvataggio step) scatta screenshot per verificare.
 
+STRUMENTI OLTRE AL MOUSE:
+- upload_photos: scarica e carica TUTTE le foto della proprietà nello step foto del wizard. Il selettore file del sistema operativo non si può usare con il mouse: per le foto usa sempre questo tool.
+- fill_field(label, json_path): compila il campo visibile con quell'etichetta o placeholder con il valore del JSON a json_path. Preferiscilo a type per i testi lunghi (es. marketing.descrizione_lunga) e quando il valore è nel JSON.
+- get_property_field(json_path): legge un campo del JSON. Nel primo messaggio i testi e le liste lunghe sono abbreviati: usalo per leggerli.
+- click_known(name, n): se disponibile, clicca un widget ricorrente (Salva/Continua, Ok dei cookie, + e − dei contatori) riconosciuto in locale nello screenshot. Comodo per i contatori: n=2 è il secondo '+' dall'alto.
+- click_element(id): dopo ogni screenshot ricevi (se disponibile) l'elenco degli elementi interattivi visibili con id, ruolo, etichetta, valore e centro in coordinate schermo. Per cliccare un elemento in elenco usa click_element con il suo id invece di stimare le coordinate.
+
+TURNI MULTI-AZIONE: puoi chiedere più azioni nello stesso turno. Vengono eseguite in ordine e ricevi UN SOLO screenshot, dopo l'ultima (le precedenti rispondono "OK"). Usalo quando il risultato è prevedibile senza guardare: compilare più campi di fila (click sul campo → type → click sul campo successivo → type…), spuntare più checkbox visibili, premere più volte lo stesso contatore +. NON mettere nello stesso turno azioni che dipendono da un cambio pagina o da un menu che deve ancora aprirsi. Se un'azione fallisce, le successive del turno non vengono eseguite.
+
+STORIA COMPATTATA: quando il wizard passa alla schermata successiva, i turni della schermata conclusa vengono tolti dalla conversazione e riassunti in una riga in fondo al primo messaggio ("Fasi del wizard già completate"). Quelle fasi sono fatte: non tornare indietro a rifarle.
+
 LOG: prima di ogni gruppo di azioni scrivi una riga in italiano del tipo "Step X: <cosa sto facendo>" così l'utente capisce dove sei. Esempi: "Step 5: Compilo indirizzo", "Step 12: Carico foto dal CDN".
 
 GESTIONE ERRORI: se trovi un campo in errore (es. validazione rossa), descrivi cosa vedi nello screenshot e prova a correggere. Se non riesci dopo 2 tentativi, scatta screenshot, dichiaralo e fermati.
@@ -197,7 +695,7 @@ OUTPUT FINALE: quando sei alla pagina riepilogo prima della pubblicazione, scriv
 """
 
 
-def _summary_for_log(prop: dict) -> str:
+def summary_for_log(prop: dict) -> str:
     ident = prop.get("identificativi", {})
     comp = prop.get("composizione", {})
     return (
@@ -207,43 +705,60 @@ def _summary_for_log(prop: dict) -> str:
     )
 
 
-initial_screenshot = None
-for _attempt in range(1, 4):
-    try:
-        initial_screenshot = screenshot_b64()
-        break
-    except Exception as exc:
-        print(f"⚠️ Screenshot iniziale tentativo {_attempt}/3 fallito: {exc}")
-        if _attempt == 3:
-            raise RuntimeError(
-                f"❌ Impossibile catturare screenshot iniziale dopo 3 tentativi su URL {LOGIN_URL}"
-            ) from exc
-        time.sleep(2)
-print(f"📸 Screenshot iniziale catturato ({len(initial_screenshot)} bytes base64)")
-initial_text = f"""Devi pubblicare questa proprietà su {LOGIN_URL}.
+def _compact(value, path: str):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            v = _compact(v, f"{path}.{k}" if path else k)
+            if not (v is None or v is False or v in ("", [], {})):
+                out[k] = v
+        return out
+    if isinstance(value, list) and len(json.dumps(value, ensure_ascii=False)) > BRIEF_MAX_CHARS:
+        return f"<{len(value)} elementi: get_property_field('{path}')>"
+    if isinstance(value, str) and len(value) > BRIEF_MAX_CHARS:
+        return f"<testo di {len(value)} caratteri: get_property_field('{path}') o fill_field>"
+    return value
+
+
+def property_json(prop: dict) -> str:
+    """JSON della proprietà per il prompt (vedi CU_PROMPT_JSON)."""
+    data = prop if PROMPT_JSON == "full" else _compact(prop, "")
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def build_initial_text(email: str, password: str, logged_in: bool = False) -> str:
+    """Primo messaggio del run completo: credenziali, JSON e procedura.
+    Con `logged_in` il browser ha già una sessione valida dal vault."""
+    if logged_in:
+        accesso = ("1. Sei GIÀ autenticato (sessione salvata): il browser è sulla dashboard, NON rifare il login.\n"
+                   "2. Solo se compare comunque il form di login, usa le credenziali sopra.")
+    else:
+        accesso = (f"1. Vai su {LOGIN_URL} (digita ESATTAMENTE questo URL nella barra indirizzi del browser — "
+                   f"NON usare www.casevacanza.it perché non risolve dal runner).\n"
+                   f"2. Login con le credenziali sopra.")
+    return f"""Devi pubblicare questa proprietà su {LOGIN_URL}.
 
 CREDENZIALI:
-- Email: {CV_EMAIL}
-- Password: {CV_PASSWORD}
+- Email: {email}
+- Password: {password}
 
-DATI PROPRIETÀ ({_summary_for_log(PROP)}):
+DATI PROPRIETÀ ({summary_for_log(PROP)}) — campi vuoti e false omessi, testi lunghi leggibili con get_property_field:
 
 ```json
-{json.dumps(PROP, indent=2, ensure_ascii=False)}
+{property_json(PROP)}
 ```
 
 PROCEDURA:
-1. Vai su {LOGIN_URL} (digita ESATTAMENTE questo URL nella barra indirizzi del browser — NON usare www.casevacanza.it perché non risolve dal runner).
-2. Login con le credenziali sopra.
+{accesso}
 3. Naviga al wizard "Aggiungi proprietà" / "Aggiungi un alloggio".
 4. Compila ogni step usando SOLO i dati dal JSON:
    - tipo struttura (identificativi.tipo_struttura)
    - indirizzo completo (identificativi.indirizzo + cap + comune + provincia)
    - ospiti, camere, bagni (composizione)
    - letti specifici (composizione.letti — tipo + quantità)
-   - foto: scarica e carica dagli URL in marketing.foto_urls
+   - foto: tool upload_photos (scarica e carica tutte le foto del JSON)
    - servizi/dotazioni: spunta SOLO quelle true in dotazioni
-   - titolo e descrizione (marketing.titolo, marketing.descrizione_lunga)
+   - titolo e descrizione (fill_field con marketing.titolo e marketing.descrizione_lunga)
    - prezzo base (condizioni.prezzo_base) — IGNORA condizioni.listino_prezzi
    - sincronizzazione iCal (condizioni.ical_url)
    - CIN e CIR (identificativi.cin, identificativi.cir) se presenti
@@ -252,38 +767,595 @@ PROCEDURA:
 Inizia con uno screenshot dello stato attuale per orientarti, poi naviga al sito.
 """
 
-messages = [
-    {
-        "role": "user",
-        "content": [
-            {"type": "text", "text": initial_text},
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": initial_screenshot,
-                },
-            },
-        ],
+
+# Image block della conversazione corrente, come [block, step, azione, bytes]:
+# serve per sostituirli con uno stub quando escono dalla finestra.
+_screenshot_blocks: list[list] = []
+omitted_images = 0
+
+
+_last_elements: dict[int, dict] = {}  # id -> elemento dell'ultima osservazione
+_last_frame: list = [None, False]  # [file dell'ultimo frame, nessuna azione eseguita da allora]
+
+
+def _image_block(data_b64: str, media_type: str, step: int, action: str) -> dict:
+    blk = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,
+            "data": data_b64,
+        },
     }
-]
+    _screenshot_blocks.append([blk, step, action, len(data_b64)])
+    return blk
+
+
+def _observation(step: int, action: str, shot: tuple[str, str] | None = None) -> list[dict]:
+    """Blocchi per il modello dopo un'azione: screenshot (già catturato in
+    `shot`, oppure nuovo) e, con CU_OBSERVE, l'elenco degli elementi
+    interattivi (potato insieme allo screenshot)."""
+    shot = shot or screenshot_b64(step, action)
+    # Stesso frame di prima dopo un'azione vera: l'azione non ha avuto effetto
+    digest = hashlib.sha1(shot[0].encode("ascii")).hexdigest()
+    if digest == _tier["shot"] and action not in ("screenshot", "wait", "ripresa"):
+        _tier["repeated"] = True
+    _tier["shot"] = digest
+    blocks = [_image_block(*shot, step, action)]
+    if OBSERVE:
+        try:
+            elements = cu_dom.snapshot(page, MODEL_W / SCREEN_W, OBSERVE_MAX_ELEMENTS)
+        except Exception as exc:
+            elements = None
+            print(f"  [WARN] Elenco elementi non disponibile: {exc}")
+        if elements is not None:
+            _last_elements.clear()
+            _last_elements.update({el["id"]: el for el in elements})
+            text_blk = {"type": "text", "text": cu_dom.format_elements(elements)}
+            _screenshot_blocks[-1].append(text_blk)
+            blocks.append(text_blk)
+    fields = sorted(f"{el['label']}={el.get('value')}" for el in _last_elements.values())
+    _stall["screen"] = _in_background(_screen_signature, shot[0], fields)
+    _last_frame[1] = True
+    return blocks
+
+
+def _prune_old_screenshots() -> tuple[int, int]:
+    """Sostituisce con uno stub testuale gli screenshot fuori dalla finestra.
+
+    Il block viene modificato in place, quindi il tool_result che lo contiene
+    resta al suo posto e l'accoppiamento tool_use/tool_result rimane valido.
+    Ritorna (immagini, bytes) omessi dalla prossima richiesta.
+    """
+    global omitted_images
+    live = [entry for entry in _screenshot_blocks if entry[0]["type"] == "image"]
+    if len(live) > KEEP_SCREENSHOTS + PRUNE_BATCH:
+        for blk, step, action, _size, *elements in live[:len(live) - KEEP_SCREENSHOTS]:
+            omitted_images += 1
+            blk.clear()
+            blk.update({"type": "text", "text": f"[screenshot omesso: step {step}, azione {action}]"})
+            for text_blk in elements:
+                text_blk["text"] = f"[elementi omessi: step {step}]"
+    omitted = [entry for entry in _screenshot_blocks if entry[0]["type"] != "image"]
+    return (len(omitted) + _compacted_images[0],
+            sum(entry[3] for entry in omitted) + _compacted_images[1])
+
+
+# --- Compattazione delle fasi completate ---
+# Fase corrente del wizard: chiave (path + titolo), indice del primo messaggio
+# assistant della fase, turni, campi compilati e testo digitato finora.
+_phase: dict = {}
+_phase_summaries: list[str] = []
+_compacted_images = [0, 0]  # screenshot tolti con le fasi compattate (numero, bytes)
+compacted_phases = 0
+compacted_chars = 0  # testo/tool_use tolti dalla history (caratteri JSON)
+
+_PHASE_HEADER = "[Fasi del wizard già completate — la loro storia è stata compattata]"
+_PHASE_JS = """() => {
+    const h = document.querySelector('h1, h2, h3, [data-test*="title"], [class*="heading"]');
+    return [location.pathname, h ? h.textContent.replace(/\\s+/g, ' ').trim().substring(0, 80) : ''];
+}"""
+
+
+def _phase_reset(start: int) -> None:
+    _phase.clear()
+    _phase.update({"key": None, "title": "", "start": start, "turns": 0, "fields": [], "typed": []})
+
+
+def _phase_fields() -> list[str]:
+    """Campi valorizzati nell'ultima osservazione (password già mascherate da cu_dom)."""
+    out = []
+    for el in _last_elements.values():
+        value = el.get("value")
+        if value in (None, "", "false") or el["role"] in ("button", "link", "tab"):
+            continue
+        label = el["label"][:40] or el["role"]
+        out.append(label if value == "true" else f"{label}={value[:60]}")
+    return out
+
+
+def _phase_note(block) -> None:
+    """Memorizza cosa ha inserito l'agente nella fase corrente (per il riassunto)."""
+    if not _phase:
+        return
+    if block.name == "fill_field":
+        _phase["typed"].append(f"{block.input.get('label', '')}←{block.input.get('json_path', '')}")
+    elif block.name == "upload_photos":
+        _phase["typed"].append("foto caricate")
+    elif block.input.get("action") == "type":
+        text = block.input.get("text", "")
+        _phase["typed"].append("***" if CV_PASSWORD and CV_PASSWORD in text else text[:60])
+
+
+def _phase_summary(n_turns: int) -> str:
+    parts = _phase["fields"] or _phase["typed"]
+    values = ", ".join(dict.fromkeys(parts))  # senza doppioni, in ordine
+    if len(values) > 300:
+        values = values[:297] + "..."
+    title = _phase["title"] or _phase["key"][0]
+    return f"- Step '{title}' completato in {n_turns} turni" + (f": {values}" if values else "")
+
+
+def _update_phase(messages: list) -> bool:
+    """True se il wizard ha cambiato schermata in questo turno.
+
+    Con CU_COMPACT_PHASES i turni della fase conclusa vengono sostituiti da un
+    riassunto. Si tolgono coppie assistant/user intere, quindi ogni tool_use
+    resta accoppiato al suo tool_result; l'ultima coppia (il click che ha fatto
+    avanzare e lo screenshot della nuova schermata) resta."""
+    global compacted_phases, compacted_chars
+    try:
+        key = tuple(page.evaluate(_PHASE_JS))
+    except Exception:
+        return False  # pagina in navigazione: si riprova al turno dopo
+    if not key[1]:
+        return False  # titolo non ancora renderizzato
+    if _phase["key"] is None:
+        _phase.update(key=key, title=key[1])
+    if key == _phase["key"]:
+        _phase["turns"] += 1
+        _phase["fields"] = _phase_fields() or _phase["fields"]
+        return False
+
+    start, end = _phase["start"], len(messages) - 2
+    if COMPACT_PHASES and end > start:
+        removed = messages[start:end]
+        del messages[start:end]
+        ids = {id(blk) for msg in removed for item in msg["content"]
+               for blk in [item, *(item.get("content") or [] if isinstance(item, dict)
+                                   and item.get("type") == "tool_result" else [])]}
+        for entry in [e for e in _screenshot_blocks if id(e[0]) in ids]:
+            _screenshot_blocks.remove(entry)
+            _compacted_images[0] += 1
+            _compacted_images[1] += entry[3]
+        compacted_chars += sum(_text_chars(_jsonable(b)) for msg in removed for b in msg["content"])
+        compacted_phases += 1
+        _phase_summaries.append(_phase_summary(_phase["turns"] + 1))
+        _set_phase_summaries(messages)
+        print(f"  🗜️ Fase '{_phase['title']}' compattata: {len(removed)} messaggi → 1 riga")
+    _phase_reset(len(messages) - 2)
+    _phase.update(key=key, title=key[1])
+    return True
+
+
+def _text_chars(block: dict) -> int:
+    """Caratteri di un block escluse le immagini (già contate dalla potatura)."""
+    if block.get("type") == "image":
+        return 0
+    if block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+        return sum(_text_chars(b) for b in block["content"])
+    return len(json.dumps(block, ensure_ascii=False))
+
+
+def _set_phase_summaries(messages: list) -> None:
+    """Riassunti delle fasi concluse in coda al primo messaggio (dopo il
+    breakpoint fisso del JSON, che resta in cache)."""
+    text = _PHASE_HEADER + "\n" + "\n".join(_phase_summaries)
+    first = messages[0]["content"]
+    if first[-1].get("text", "").startswith(_PHASE_HEADER):
+        first[-1]["text"] = text
+    else:
+        first.append({"type": "text", "text": text})
+
+
+def _phase_start(messages: list) -> None:
+    """Inizio del tracciamento fasi per una conversazione (nuova o ripresa)."""
+    _phase_reset(len(messages))
+    _phase_summaries.clear()
+    last = messages[0]["content"][-1]
+    if last.get("text", "").startswith(_PHASE_HEADER):
+        _phase_summaries.extend(last["text"].splitlines()[1:])
+
+
+# --- Tiering dei modelli ---
+# turns: turni sul modello corrente; advanced: lo step è avanzato da quando si è
+# passati a MODEL; prefix/output: token di prompt dell'ultimo turno e media dei
+# token di risposta, per stimare costo del cambio e risparmio
+_tier = {"model": MODEL, "escalated": True, "repeated": False, "shot": "",
+         "turns": 0, "advanced": False, "held": False, "prefix": 0, "output": 0.0}
+tier_stats: dict[str, list] = {}  # modello -> [turni, secondi di risposta, costo, costo senza cache]
+escalations = 0
+tier_switches = 0
+tier_switch_cost = 0.0  # $ stimati di riscrittura cache causati dai cambi di modello
+small_stints: list[int] = []  # turni consecutivi sul piccolo prima di ogni escalation
+
+
+def _tier_reset(escalated: bool) -> None:
+    """Modello di partenza di una conversazione: il piccolo, salvo `escalated`."""
+    _tier.update(escalated=escalated or not MODEL_SMALL, repeated=False,
+                 turns=0, advanced=False, held=False)
+    _tier["model"] = MODEL if _tier["escalated"] else MODEL_SMALL
+
+
+def _switch_cost(model: str) -> float:
+    """$ per riscrivere in cache su `model` il prefisso dell'ultimo turno."""
+    return _tier["prefix"] * _prices(model)[0] * CACHE_WRITE_MULT / 1_000_000
+
+
+def _small_saving() -> float:
+    """$ risparmiati per turno sul piccolo rispetto a MODEL, prefisso già in cache."""
+    big_in, big_out = _prices(MODEL)
+    small_in, small_out = _prices(MODEL_SMALL)
+    return (_tier["prefix"] * (big_in - small_in) * CACHE_READ_MULT
+            + _tier["output"] * (big_out - small_out)) / 1_000_000
+
+
+def _switch_tier(escalated: bool, reason: str) -> None:
+    global escalations, tier_switches, tier_switch_cost
+    model = MODEL if escalated else MODEL_SMALL
+    cost = _switch_cost(model)
+    if escalated:
+        escalations += 1
+        small_stints.append(_tier["turns"])
+    tier_switches += 1
+    tier_switch_cost += cost
+    _tier.update(escalated=escalated, model=model, turns=0, advanced=False, held=False)
+    print(f"  {'🔼' if escalated else '🔽'} {reason}: passo a {model} (~${cost:.3f} di riscrittura cache)")
+
+
+def _update_tier(errors: int, advanced: bool) -> None:
+    """Sceglie il modello del prossimo turno in base all'esito di questo.
+
+    Un modello si tiene almeno TIER_MIN_TURNS turni: solo un tool_result in
+    errore fa salire prima. Si torna al piccolo dopo che lo step è avanzato e
+    solo se il risparmio atteso (sulla durata media dei periodi sul piccolo,
+    almeno TIER_MIN_TURNS turni) supera la riscrittura del prefisso in cache.
+    """
+    repeated, _tier["repeated"] = _tier["repeated"], False
+    if not MODEL_SMALL:
+        return
+    _tier["turns"] += 1
+    if _tier["escalated"]:
+        _tier["advanced"] = _tier["advanced"] or advanced
+        if not _tier["advanced"] or _tier["turns"] < TIER_MIN_TURNS:
+            return
+        horizon = max(TIER_MIN_TURNS, sum(small_stints) / len(small_stints) if small_stints else 0)
+        saving, cost = _small_saving() * horizon, _switch_cost(MODEL_SMALL)
+        if saving <= cost:
+            if not _tier["held"]:
+                _tier["held"] = True
+                print(f"  ⏸ Resto su {MODEL}: ~${saving:.3f} di risparmio in {horizon:.0f} turni "
+                      f"non coprono ~${cost:.3f} di riscrittura cache")
+            return
+        _switch_tier(False, "Step avanzato")
+        return
+    if errors:
+        reason = f"{errors} tool_result in errore"
+    elif _tier["turns"] < TIER_MIN_TURNS:
+        return
+    elif repeated:
+        reason = "screenshot identico al precedente"
+    elif _phase.get("turns", 0) >= ESCALATE_STALL_TURNS:
+        reason = f"step fermo da {_phase['turns']} turni"
+    else:
+        return
+    _switch_tier(True, reason)
+
+
+def _record_tier(model: str, usage, seconds: float, cost: float) -> None:
+    price_in, price_out = _prices(model)
+    prefix = ((usage.input_tokens or 0) + (getattr(usage, "cache_read_input_tokens", 0) or 0)
+              + (getattr(usage, "cache_creation_input_tokens", 0) or 0))
+    no_cache = (prefix * price_in + (usage.output_tokens or 0) * price_out) / 1_000_000
+    _tier["prefix"] = prefix
+    output = usage.output_tokens or 0
+    _tier["output"] = 0.7 * _tier["output"] + 0.3 * output if _tier["output"] else float(output)
+    stats = tier_stats.setdefault(model, [0, 0.0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] += cost
+    stats[3] += no_cache
+
+
+# --- Rilevamento loop ---
+# Firma dell'ultima schermata osservata e coppie (schermata, azione) recenti
+_stall: dict = {"screen": None, "seen": []}
+stall_turns = 0  # turni che hanno ripetuto un'azione già fatta sulla stessa schermata
+stall_hints = 0
+
+
+def _screen_signature(data_b64: str, fields: list[str]) -> tuple:
+    """(hash percettivo dei pixel, hash dei valori dei campi).
+
+    Il dHash 9x8 ignora spinner e cursore ma non vede un contatore che passa da
+    2 a 3: per questo la firma include anche etichette e valori dell'ultimo
+    elenco elementi (`fields`). Senza Pillow i pixel si confrontano esatti.
+    Gira in background (_in_background) durante la chiamata al modello."""
+    raw = base64.b64decode(data_b64)
+    if Image is None:
+        pixels = hashlib.sha1(raw).hexdigest()
+    else:
+        px = list(Image.open(io.BytesIO(raw)).convert("L").resize((9, 8)).getdata())
+        pixels = sum(1 << (row * 8 + col) for row in range(8) for col in range(8)
+                     if px[row * 9 + col] > px[row * 9 + col + 1])
+    return pixels, hashlib.sha1("|".join(fields).encode("utf-8")).hexdigest()[:12]
+
+
+def _same_screen(a: tuple, b: tuple) -> bool:
+    if a[1] != b[1]:
+        return False
+    if isinstance(a[0], str):
+        return a[0] == b[0]
+    return bin(a[0] ^ b[0]).count("1") <= STALL_HAMMING
+
+
+def _action_signature(block) -> str:
+    """Azione normalizzata: coordinate a passi di 10 px, testo accorciato e mai la password."""
+    inp = dict(block.input)
+    if isinstance(inp.get("coordinate"), list):
+        inp["coordinate"] = [round(c, -1) for c in inp["coordinate"]]
+    if "text" in inp:
+        text = str(inp["text"])
+        inp["text"] = "***" if CV_PASSWORD and CV_PASSWORD in text else text[:40]
+    return f"{block.name} {json.dumps(inp, sort_keys=True, ensure_ascii=False)}"
+
+
+def _stall_check(tool_uses: list, screen) -> tuple[int, str]:
+    """Quante volte la stessa azione è stata chiesta sulla stessa schermata
+    (il massimo tra le azioni del turno) e quale. Un'azione conta una volta per
+    turno: tre click su "+" nello stesso batch non sono un loop. `screen` è la
+    firma (o il Future che la calcola) della schermata su cui il modello ha deciso."""
+    if screen is None:
+        return 0, ""
+    if isinstance(screen, concurrent.futures.Future):
+        screen = screen.result()
+    worst, worst_sig = 0, ""
+    sigs = [_action_signature(b) for b in tool_uses
+            if b.name in _PAGE_TOOLS | CUSTOM_TOOL_NAMES
+            and b.input.get("action") not in ("screenshot", "wait")]
+    for sig in dict.fromkeys(sigs):
+        n = 1 + sum(1 for seen, action in _stall["seen"] if action == sig and _same_screen(seen, screen))
+        _stall["seen"].append((screen, sig))
+        if n > worst:
+            worst, worst_sig = n, sig
+    del _stall["seen"][:-50]
+    return worst, worst_sig
+
 
 # --- Loop agente ---
-client = Anthropic()
+client = Anthropic(max_retries=0)  # i retry li gestisce _call_model, con jitter
 tools = [
     {
         "type": "computer_20250124",
         "name": "computer",
-        "display_width_px": SCREEN_W,
-        "display_height_px": SCREEN_H,
+        "display_width_px": MODEL_W,
+        "display_height_px": MODEL_H,
         "display_number": 1,
     }
 ]
+CUSTOM_TOOLS = [
+    {
+        "name": "upload_photos",
+        "description": "Scarica le foto della proprietà (file locali del JSON o URL in marketing.foto_urls) "
+                       "e le carica nello step foto del wizard, senza selettore file. Usalo quando la "
+                       "pagina mostra il bottone 'Carica foto'.",
+        "input_schema": {"type": "object", "properties": {}},
+    },
+    {
+        "name": "fill_field",
+        "description": "Compila il campo di testo visibile con etichetta o placeholder `label` con il valore "
+                       "del JSON della proprietà a `json_path` (notazione a punti, indici numerici per le "
+                       "liste, es. 'marketing.descrizione_lunga', 'identificativi.cap').",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "label": {"type": "string", "description": "Etichetta o placeholder del campo come appare a schermo"},
+                "json_path": {"type": "string", "description": "Path del valore nel JSON"},
+            },
+            "required": ["label", "json_path"],
+        },
+    },
+    {
+        "name": "get_property_field",
+        "description": "Legge un campo del JSON della proprietà (notazione a punti). Path vuoto = elenco "
+                       "dei campi di primo livello.",
+        "input_schema": {
+            "type": "object",
+            "properties": {"json_path": {"type": "string"}},
+            "required": ["json_path"],
+        },
+    },
+]
+if OBSERVE:
+    CUSTOM_TOOLS.append({
+        "name": "click_element",
+        "description": "Clicca l'elemento con questo id dall'elenco 'elementi interattivi visibili' "
+                       "dell'ultima osservazione. Più preciso delle coordinate: preferiscilo quando "
+                       "l'elemento è in elenco.",
+        "input_schema": {
+            "type": "object",
+            "properties": {"id": {"type": "integer"}},
+            "required": ["id"],
+        },
+    })
+if cu_templates.available():
+    CUSTOM_TOOLS.append({
+        "name": "click_known",
+        "description": "Clicca un widget ricorrente del wizard trovandolo in locale nello schermo "
+                       "(template matching, niente stima di coordinate): "
+                       + ", ".join(cu_templates.names()) + ". `n` = occorrenza in ordine di lettura "
+                       "(es. n=2 per il secondo '+' dall'alto).",
+        "input_schema": {
+            "type": "object",
+            "properties": {"name": {"type": "string", "enum": cu_templates.names()},
+                           "n": {"type": "integer", "minimum": 1}},
+            "required": ["name"],
+        },
+    })
+CUSTOM_TOOL_NAMES = {tool["name"] for tool in CUSTOM_TOOLS}
+# Tool che cambiano la pagina: il loro tool_result porta lo screenshot
+_PAGE_TOOLS = {"computer", "upload_photos", "fill_field", "click_element", "click_known"}
+tools += CUSTOM_TOOLS
+# Breakpoint fisso su system: copre anche `tools`, che precede system nel prefisso.
+system_blocks = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
 
 step_idx = 0
+total_turns = 0
 total_input_tokens = 0
 total_output_tokens = 0
+total_cache_read = 0
+total_cache_write = 0
+# Risparmio cumulato della finestra screenshot, sommato su tutte le richieste
+saved_bytes = 0
+saved_tokens = 0
+batched_screenshots = 0  # screenshot non scattati grazie ai turni multi-azione
+type_times: list[tuple] = []  # (caratteri, modalità, ms) per ogni azione type
+turn_wall_s: list[float] = []  # durata di ogni turno: chiamata + azioni + screenshot
+# Per turno, secondi di azioni eseguite mentre il modello generava ancora: senza
+# streaming (CU_STREAM=0) sarebbero venuti dopo la risposta, quindi
+# turn_wall_s + turn_overlap_s è la durata stimata dello stesso turno senza streaming.
+turn_overlap_s: list[float] = []
+total_cost_usd = 0.0
+_last_turn_cost = 0.0
+_run_started: float | None = None  # monotonic del primo run_agent()
+# Traiettorie: azioni rieseguite senza modello, turni del modello con una
+# registrazione attiva, turni registrati interamente coperti dal replay
+replay_hits = 0
+replay_misses = 0
+replay_turns_saved = 0
+
+
+def _set_rolling_cache_breakpoint(msgs: list) -> None:
+    """Sposta il breakpoint rolling sull'ultimo block dell'ultimo messaggio user.
+
+    L'API accetta al massimo 4 breakpoint: teniamo quello fisso del primo
+    messaggio e togliamo quelli messi nei turni precedenti. Il prefisso del turno
+    prima resta comunque in cache (lookback automatico sui block precedenti).
+    """
+    for msg in msgs[1:]:
+        if msg["role"] != "user" or not isinstance(msg["content"], list):
+            continue
+        for blk in msg["content"]:
+            if isinstance(blk, dict):
+                blk.pop("cache_control", None)
+    last = msgs[-1]
+    if len(msgs) > 1 and last["role"] == "user" and last["content"]:
+        last["content"][-1]["cache_control"] = CACHE_CONTROL
+
+
+def _prices(model: str) -> tuple[float, float]:
+    """$/Mtok (input, output); `model` può avere il suffisso di data (…-20251001)."""
+    for name, prices in PRICES.items():
+        if model.startswith(name):
+            return prices
+    return PRICES[MODEL]
+
+
+def turn_cost(model: str, usage) -> float:
+    """Costo in $ di una risposta, cache inclusa."""
+    price_in, price_out = _prices(model)
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    return ((usage.input_tokens or 0) * price_in
+            + cache_write * price_in * CACHE_WRITE_MULT
+            + cache_read * price_in * CACHE_READ_MULT
+            + (usage.output_tokens or 0) * price_out) / 1_000_000
+
+
+def _elapsed_s() -> float:
+    return time.monotonic() - _run_started if _run_started is not None else 0.0
+
+
+def _budget_exceeded() -> str | None:
+    """Motivo dello stop se il prossimo turno sforerebbe un tetto, altrimenti None.
+    Il costo è proiettato sull'ultimo turno: ci si ferma prima di sforare."""
+    tokens = total_input_tokens + total_output_tokens + total_cache_read + total_cache_write
+    if total_cost_usd + _last_turn_cost > BUDGET_USD:
+        return f"costo ${total_cost_usd:.3f} (+${_last_turn_cost:.3f} previsti) oltre il tetto ${BUDGET_USD:.2f}"
+    if tokens >= BUDGET_TOKENS:
+        return f"{tokens} token oltre il tetto {BUDGET_TOKENS}"
+    if total_turns >= MAX_TURNS:
+        return f"{total_turns} turni, tetto {MAX_TURNS}"
+    if _elapsed_s() > BUDGET_MINUTES * 60:
+        return f"{_elapsed_s() / 60:.1f} minuti oltre il tetto {BUDGET_MINUTES:.0f}"
+    return None
+
+
+def _log_usage(turn: int, model: str, usage, cost: float, stop_reason: str) -> None:
+    """Una riga JSONL per turno: costo per inserzione confrontabile tra run."""
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "run": RUN_ID,
+        "listing": PROP.get("identificativi", {}).get("nome_struttura", ""),
+        "turn": total_turns,
+        "conv_turn": turn,
+        "model": model,
+        "input": usage.input_tokens or 0,
+        "output": usage.output_tokens or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_write": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        "cost_usd": round(cost, 6),
+        "cum_cost_usd": round(total_cost_usd, 6),
+        "elapsed_s": round(_elapsed_s(), 1),
+        "stop_reason": stop_reason,
+    }
+    # Scritto dal writer in background, come gli screenshot
+    USAGE_LOG.parent.mkdir(parents=True, exist_ok=True)
+    _disk_queue.put((USAGE_LOG, (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"), True))
+
+
+def _budget_stop(reason: str, messages: list) -> None:
+    """Stop controllato: screenshot finale + dump dello stato per ripartire a mano."""
+    print(f"\n🛑 Budget esaurito: {reason}. Mi fermo.")
+    _stop_dump("budget", reason, messages)
+
+
+def _stop_dump(kind: str, reason: str, messages: list, extra: dict | None = None) -> None:
+    """Screenshot + screenshots/cu_<kind>_stop.json con lo stato del run."""
+    try:
+        screenshot_b64(step_idx, f"{kind}_stop")
+    except Exception as e:
+        print(f"  ⚠️ Screenshot di stop fallito: {e}")
+    last_texts = [
+        block["text"].strip()
+        for msg in messages if msg["role"] == "assistant"
+        for block in map(_jsonable, msg["content"])
+        if block.get("type") == "text" and block["text"].strip()
+    ]
+    state = {
+        "reason": reason,
+        "run": RUN_ID,
+        "listing": PROP.get("identificativi", {}).get("nome_struttura", ""),
+        "url": page.url if page is not None else None,
+        "turns": total_turns,
+        "steps": step_idx,
+        "tokens": {"input": total_input_tokens, "output": total_output_tokens,
+                   "cache_read": total_cache_read, "cache_write": total_cache_write},
+        "cost_usd": round(total_cost_usd, 4),
+        "elapsed_s": round(_elapsed_s(), 1),
+        "last_model_messages": last_texts[-5:],
+        **(extra or {}),
+    }
+    path = SCREENSHOT_DIR / f"cu_{kind}_stop.json"
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=2, ensure_ascii=False)
+    print(f"  Stato salvato in {path}")
+
+
+def _cache_hit_ratio() -> float:
+    """Quota dei token di input letti dalla cache sul totale dei token di input."""
+    total = total_input_tokens + total_cache_read + total_cache_write
+    return total_cache_read / total if total else 0.0
 
 
 def _describe_block(block) -> str:
@@ -303,8 +1375,414 @@ def _describe_block(block) -> str:
     return str(btype)
 
 
-try:
-    for turn in range(1, MAX_TURNS + 1):
+# --- Checkpoint e ripresa ---
+_CHECKPOINT_COUNTERS = (
+    "step_idx", "total_turns", "total_input_tokens", "total_output_tokens",
+    "total_cache_read", "total_cache_write", "total_cost_usd",
+    "omitted_images", "saved_bytes", "saved_tokens", "compacted_phases", "compacted_chars",
+    "tier_stats", "escalations", "tier_switches", "tier_switch_cost", "small_stints",
+    "stall_turns", "stall_hints",
+)
+_PASSWORD_PLACEHOLDER = "{{CV_PASSWORD}}"
+
+
+def checkpoint_path() -> Path:
+    name = PROP.get("identificativi", {}).get("nome_struttura", "proprieta")
+    slug = re.sub(r"[^\w-]+", "_", name)
+    return CHECKPOINT_DIR / f"cu_{slug}.json"
+
+
+def _jsonable(block):
+    return block if isinstance(block, dict) else block.model_dump(exclude_none=True)
+
+
+def _redacted(block: dict, old: str, new: str) -> dict:
+    """Copia di `block` con `old` sostituito da `new` nei soli campi testuali
+    che possono contenere la password: i text block (il primo messaggio ha le
+    credenziali) e il `text` delle azioni type. I dati base64 degli screenshot
+    non vengono toccati."""
+    kind = block.get("type")
+    if kind == "text" and old in block.get("text", ""):
+        return {**block, "text": block["text"].replace(old, new)}
+    if kind == "tool_use":
+        inp = block.get("input") or {}
+        if inp.get("action") == "type" and isinstance(inp.get("text"), str) and old in inp["text"]:
+            return {**block, "input": {**inp, "text": inp["text"].replace(old, new)}}
+    if kind == "tool_result" and isinstance(block.get("content"), list):
+        return {**block, "content": [_redacted(b, old, new) for b in block["content"]]}
+    return block
+
+
+def _write_checkpoint(state: dict, path: Path) -> None:
+    """Serializza e scrive il checkpoint (in background, vedi save_checkpoint)."""
+    try:
+        CHECKPOINT_DIR.mkdir(exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+    except Exception as exc:
+        print(f"  [WARN] Checkpoint non salvato: {exc}")
+
+
+def save_checkpoint(messages: list) -> None:
+    """Salva conversazione (già potata), contatori e URL. La password non finisce
+    nel file; la sessione del browser va nel vault cifrato. La serializzazione
+    (screenshot base64 compresi) gira in background durante la prossima
+    chiamata al modello, su una copia: il turno dopo pota e modifica i block."""
+    state = {
+        "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "run": RUN_ID,
+        "data_file": DATA_FILE,
+        "url": page.url,
+        "elapsed_s": _elapsed_s(),
+        "counters": {name: globals()[name] for name in _CHECKPOINT_COUNTERS},
+        "messages": [{"role": m["role"],
+                      "content": [_redacted(_jsonable(b), CV_PASSWORD, _PASSWORD_PLACEHOLDER)
+                                  if CV_PASSWORD else _jsonable(b) for b in m["content"]]}
+                     for m in messages],
+    }
+    path = checkpoint_path()
+    _in_background(_write_checkpoint, copy.deepcopy(state), path)
+    try:
+        session_vault.save(page.context, CV_EMAIL)
+    except Exception as exc:
+        print(f"  [vault] Sessione non salvata nel checkpoint: {exc}")
+    print(f"  💾 Checkpoint turno {total_turns}: {path}")
+
+
+def load_checkpoint() -> dict | None:
+    path = checkpoint_path()
+    if not path.exists():
+        return None
+    state = json.loads(path.read_text(encoding="utf-8"))
+    if CV_PASSWORD:
+        for msg in state["messages"]:
+            msg["content"] = [_redacted(b, _PASSWORD_PLACEHOLDER, CV_PASSWORD) for b in msg["content"]]
+    return state
+
+
+def _restore_checkpoint(state: dict) -> list:
+    """Ripristina i contatori e ritorna la conversazione da riprendere."""
+    global _run_started
+    globals().update(state["counters"])
+    _run_started = time.monotonic() - state.get("elapsed_s", 0)
+    messages = state["messages"]
+    _screenshot_blocks.clear()
+    for msg in messages:
+        for blk in msg["content"]:
+            blocks = blk.get("content") if blk.get("type") == "tool_result" else None
+            for sub in blocks if isinstance(blocks, list) else [blk]:
+                if sub.get("type") == "image":
+                    _screenshot_blocks.append([sub, 0, "checkpoint", len(sub["source"]["data"])])
+                elif sub.get("type") == "text" and sub["text"].startswith("[elementi") and _screenshot_blocks:
+                    _screenshot_blocks[-1].append(sub)  # elenco elementi potato insieme all'immagine
+    return messages
+
+
+def _retry_delay(exc: Exception, attempt: int) -> float | None:
+    """Attesa prima del prossimo tentativo, None se l'errore non è da ritentare."""
+    if isinstance(exc, APIStatusError):
+        if exc.status_code not in (429, 529):
+            return None
+        retry_after = exc.response.headers.get("retry-after") if exc.response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), API_BACKOFF_MAX_S) + random.uniform(0, 1)
+            except ValueError:
+                pass
+    elif not isinstance(exc, APIConnectionError):
+        return None
+    # Full jitter: N run in parallelo non riprovano tutti nello stesso istante
+    return random.uniform(0, min(API_BACKOFF_MAX_S, API_BACKOFF_BASE_S * 2 ** attempt))
+
+
+def _call_model(request: dict, on_block):
+    """Chiamata al modello con retry su 429/529. `on_block(block, overlapped)`
+    riceve ogni content block completo; `overlapped` è True se il modello sta
+    ancora generando (streaming). Un tool_use si consegna al primo evento
+    successivo: se quell'evento dice che la risposta è stata troncata
+    (max_tokens) il blocco può essere incompleto e non si esegue. Dopo che un
+    tool_use è stato gestito non si ritenta più: le azioni sono già state eseguite."""
+    for attempt in range(API_RETRIES + 1):
+        handled = False
+        try:
+            if STREAM:
+                with client.beta.messages.stream(**request) as stream:
+                    pending = None
+                    for event in stream:
+                        if pending is not None:
+                            truncated = event.type == "message_delta" and event.delta.stop_reason == "max_tokens"
+                            if not truncated:
+                                handled = True
+                                on_block(pending, event.type == "content_block_start")
+                            pending = None
+                        if event.type == "content_block_stop":
+                            if event.content_block.type == "tool_use":
+                                pending = event.content_block
+                            else:
+                                on_block(event.content_block, True)
+                    response = stream.get_final_message()
+                    if pending is not None and response.stop_reason != "max_tokens":
+                        handled = True
+                        on_block(pending, False)
+                    return response
+            response = client.beta.messages.create(**request)
+            for i, block in enumerate(response.content):
+                if (response.stop_reason == "max_tokens" and block.type == "tool_use"
+                        and i == len(response.content) - 1):
+                    break  # input forse troncato: non si esegue
+                on_block(block, False)
+            return response
+        except (APIStatusError, APIConnectionError) as exc:
+            delay = _retry_delay(exc, attempt)
+            if handled or delay is None or attempt == API_RETRIES:
+                raise
+            status = getattr(exc, "status_code", "rete")
+            print(f"  ⏳ API {status}: nuovo tentativo {attempt + 1}/{API_RETRIES} tra {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _initial_screenshot() -> tuple[str, str]:
+    for attempt in range(1, 4):
+        try:
+            return screenshot_b64(step_idx, "iniziale")
+        except Exception as exc:
+            print(f"⚠️ Screenshot iniziale tentativo {attempt}/3 fallito: {exc}")
+            if attempt == 3:
+                raise RuntimeError(
+                    f"❌ Impossibile catturare screenshot iniziale dopo 3 tentativi su URL {page.url}"
+                ) from exc
+            time.sleep(2)
+
+
+def _open_trajectory(key: str | None) -> dict | None:
+    """Stato di registrazione/replay per `key` (None = traiettorie disattivate)."""
+    if key is None:
+        return None
+    shape = cu_trajectory.prop_shape(PROP)
+    entries = cu_trajectory.load(key, shape) if REPLAY else []
+    if entries:
+        print(f"🎞️ Traiettoria '{key}' ({shape}): {len(entries)} azioni registrate, replay attivo")
+    return {
+        "key": key,
+        "shape": shape,
+        "entries": entries,   # registrazione da rieseguire
+        "cursor": 0,          # prossima voce da rieseguire
+        "recorded": [],       # registrazione di questo run
+        "turn": 0,            # turno logico (modello o turno registrato rieseguito)
+        "prev_fp": None,
+    }
+
+
+def _record_action(traj: dict, fp: str, action_input: dict) -> None:
+    if action_input.get("action") == "click_element":
+        # Gli id data-cu-id esistono solo dopo lo snapshot di un'osservazione,
+        # che il replay non fa: si registra un left_click sul centro risolto
+        # (nello spazio del modello, come le coordinate del tool computer)
+        x, y = _clicked_at[0]
+        action_input = {"action": "left_click",
+                        "coordinate": [round(x * MODEL_W / SCREEN_W), round(y * MODEL_H / SCREEN_H)]}
+    bound = cu_trajectory.bind_input(action_input, PROP, CV_EMAIL, CV_PASSWORD)
+    traj["recorded"].append(cu_trajectory.new_entry(fp, traj["turn"], bound, traj["prev_fp"]))
+    traj["prev_fp"] = fp
+
+
+def _replay_until_divergence(traj: dict | None) -> int:
+    """Riesegue le azioni registrate finché la schermata coincide con la
+    registrazione. Si ferma su divergenza, barriera (testo non legabile) o
+    errore; ritorna il numero di azioni rieseguite."""
+    global step_idx, replay_hits, replay_turns_saved
+    if not traj or not traj["entries"]:
+        return 0
+    entries = traj["entries"]
+    done = 0
+    src_turn = None
+    while traj["cursor"] < len(entries):
+        fp = cu_trajectory.fingerprint(page)
+        entry = entries[traj["cursor"]]
+        if entry["fp"] != fp:
+            # Riaggancio: una schermata registrata più avanti (es. il modello ha
+            # già completato da solo la pagina divergente)
+            later = next((i for i in range(traj["cursor"] + 1, len(entries))
+                          if entries[i]["entry"] and entries[i]["fp"] == fp), None)
+            if later is None:
+                break
+            traj["cursor"] = later
+            entry = entries[later]
+        if entry["input"] is None:
+            break  # barriera: decide il modello
+        if entry["turn"] != src_turn:
+            if src_turn is not None:
+                replay_turns_saved += 1
+            src_turn = entry["turn"]
+            traj["turn"] += 1
+        action_input = cu_trajectory.resolve_input(entry["input"], PROP, CV_EMAIL, CV_PASSWORD)
+        step_idx += 1
+        print(f"  ↻ replay step {step_idx}: {action_input.get('action')}")
+        err = perform_action(action_input)
+        traj["cursor"] += 1
+        if err:
+            print(f"     ❌ {err} — replay interrotto")
+            break
+        _record_action(traj, fp, action_input)
+        replay_hits += 1
+        done += 1
+    # L'ultimo turno conta come risparmiato solo se rieseguito per intero
+    if src_turn is not None and (traj["cursor"] >= len(entries) or entries[traj["cursor"]]["turn"] != src_turn):
+        replay_turns_saved += 1
+    return done
+
+
+def _execute_tool_use(block, traj: dict | None, batch: dict) -> tuple[str | None, str | None, dict | None]:
+    """Esegue un tool_use (`computer` o tool ad alto livello). Ritorna
+    (errore, testo di risposta, blocchi di osservazione): l'osservazione c'è
+    solo fuori dalla modalità batch e per i tool che toccano la pagina.
+    `batch` tiene l'azione fallita e il tempo speso in azioni nel turno."""
+    global step_idx
+    step_idx += 1
+    # I tool ad alto livello viaggiano come azioni {"action": nome, ...}: stesso
+    # log, stessa registrazione nelle traiettorie.
+    action_input = block.input if block.name == "computer" else {"action": block.name, **block.input}
+    action = action_input.get("action", "?")
+    if batch["failed"]:
+        # Il resto del batch presupponeva l'azione fallita: non lo eseguiamo
+        print(f"  ↷ step {step_idx}: {action} saltata")
+        return f"Non eseguita: l'azione precedente ({batch['failed']}) è fallita", None, None
+
+    extra = ""
+    if "coordinate" in action_input:
+        extra = f" @ {action_input['coordinate']}"
+    elif "text" in action_input:
+        # Maschera la password nei log
+        txt = action_input["text"]
+        if CV_PASSWORD and CV_PASSWORD in txt:
+            txt = txt.replace(CV_PASSWORD, "***")
+        extra = f" testo='{txt[:60]}'"
+    elif "json_path" in action_input:
+        label = f" '{action_input['label']}' ←" if "label" in action_input else ""
+        extra = f"{label} {action_input['json_path']}"
+    print(f"  → step {step_idx}: {action}{extra}")
+
+    t0 = time.monotonic()
+    fp = cu_trajectory.fingerprint(page) if traj else ""
+    n_settle = len(settle_times_ms)
+    reply = None
+    if block.name in _PAGE_TOOLS:
+        _learn_known_click(block.name, action_input)
+        _last_frame[1] = False
+    if block.name == "computer":
+        err = execute_computer_action(action_input)
+    else:
+        reply, is_error = execute_custom_tool(block.name, block.input)
+        err = reply if is_error else None
+    if traj and not err and not cu_trajectory.skip_action(action_input):
+        _record_action(traj, fp, action_input)
+    action_ms = int((time.monotonic() - t0) * 1000)
+    settle = f", settle {settle_times_ms[-1]} ms" if len(settle_times_ms) > n_settle else ""
+    typed = f" ({type_times[-1][0]} caratteri, {type_times[-1][1]})" if action == "type" and not err else ""
+    print(f"     {action}{typed} {action_ms} ms{settle}")
+    if err:
+        print(f"     ❌ {err}")
+        if BATCH_ACTIONS:
+            batch["failed"] = action
+    observation = None
+    if not BATCH_ACTIONS and block.name in _PAGE_TOOLS:
+        observation = _observation(step_idx, action)
+    batch["action_s"] += time.monotonic() - t0
+    return err, (None if err else reply), observation
+
+
+def _replay_blocks(n_replayed: int, action: str) -> list[dict]:
+    """Nota + screenshot da accodare al messaggio user dopo un replay."""
+    note = (f"[{n_replayed} azioni già eseguite in automatico da una traiettoria registrata: "
+            f"la schermata qui sotto è lo stato attuale, riparti da qui]")
+    return [{"type": "text", "text": note}, *_observation(step_idx, action)]
+
+
+def run_agent(initial_text: str, max_turns: int = MAX_TURNS, is_done=None,
+              trajectory_key: str | None = None, checkpoint: bool = False,
+              resume: dict | None = None, escalated: bool = False) -> str:
+    """Loop Computer Use sulla pagina agganciata, a partire da `initial_text`.
+
+    `is_done` (opzionale) viene valutata dopo ogni turno: se ritorna True il loop
+    si ferma senza aspettare che il modello dichiari fine. Ritorna il motivo
+    dello stop: "end_turn", "done", "max_turns", "budget", "stall" oppure "stop".
+    Con `trajectory_key` le azioni vengono registrate (salvate solo se il run
+    riesce) e una registrazione precedente con la stessa chiave viene rieseguita
+    senza modello finché la schermata coincide (vedi cu_trajectory.py).
+    Token, costo e metriche si accumulano nei contatori globali del modulo; i
+    tetti di budget (CU_BUDGET_*) valgono per tutte le chiamate del processo.
+    Con `checkpoint` salva un checkpoint ogni CU_CHECKPOINT_EVERY turni; con
+    `resume` (un checkpoint caricato) riprende quella conversazione invece di
+    partire da `initial_text` (niente traiettorie: la registrazione sarebbe parziale).
+    Si parte sul modello piccolo (CU_MODEL_SMALL) salvo `escalated`.
+    """
+    global _run_started
+    resume_messages = _restore_checkpoint(resume) if resume else None
+    if _run_started is None:
+        _run_started = time.monotonic()
+    traj = None if resume else _open_trajectory(trajectory_key)
+    _tier_reset(escalated)
+    reason = _agent_loop(initial_text, max_turns, is_done, traj, checkpoint,
+                         resume_messages, resume["url"] if resume else "")
+    if traj and reason in ("end_turn", "done") and traj["recorded"]:
+        path = cu_trajectory.save(traj["key"], traj["shape"], traj["recorded"])
+        print(f"💾 Traiettoria salvata: {path} ({len(traj['recorded'])} azioni)")
+    return reason
+
+
+def _agent_loop(initial_text: str, max_turns: int, is_done, traj: dict | None,
+                checkpoint: bool, resume_messages: list | None, resume_url: str) -> str:
+    if resume_messages is not None:
+        messages = resume_messages
+        note = (f"[Run ripreso da un checkpoint dopo un'interruzione (turno {total_turns}): la pagina è "
+                f"stata riaperta su {resume_url}. Se vedi il login, accedi con le credenziali del primo "
+                f"messaggio e torna a quell'URL; poi continua da dove eri rimasto guardando lo stato attuale]")
+        messages[-1]["content"].extend([{"type": "text", "text": note}, *_observation(step_idx, "ripresa")])
+        print(f"♻️ Ripresa dal checkpoint: {len(messages)} messaggi, turno {total_turns}, step {step_idx}")
+    else:
+        messages = _initial_messages(initial_text, traj, is_done)
+        if messages is None:
+            return "done"
+    return _turn_loop(messages, max_turns, is_done, traj, checkpoint)
+
+
+def _initial_messages(initial_text: str, traj: dict | None, is_done) -> list | None:
+    """Primo messaggio della conversazione (None se il replay ha già finito il lavoro)."""
+    _screenshot_blocks.clear()
+    n_replayed = _replay_until_divergence(traj)
+    if n_replayed and is_done is not None and is_done():
+        print(f"\n✅ Obiettivo raggiunto dal solo replay ({n_replayed} azioni).")
+        return None
+    initial_shot = _initial_screenshot()
+    print(f"📸 Screenshot iniziale catturato ({len(initial_shot[0])} bytes base64)")
+    initial_content = [
+        # Breakpoint fisso: il primo messaggio (credenziali + JSON) non cambia mai.
+        {"type": "text", "text": initial_text, "cache_control": CACHE_CONTROL},
+        *_observation(step_idx, "iniziale", initial_shot),
+    ]
+    if n_replayed:
+        initial_content.insert(1, {"type": "text", "text": (
+            f"[{n_replayed} azioni già eseguite in automatico da una traiettoria registrata: "
+            f"lo screenshot mostra lo stato attuale, riparti da qui]")})
+    return [{"role": "user", "content": initial_content}]
+
+
+def _turn_loop(messages: list, max_turns: int, is_done, traj: dict | None, checkpoint: bool) -> str:
+    global total_turns, total_input_tokens, total_output_tokens
+    global total_cache_read, total_cache_write, saved_bytes, saved_tokens, replay_misses
+    global total_cost_usd, _last_turn_cost, batched_screenshots, stall_turns, stall_hints
+
+    _phase_start(messages)
+    _stall["seen"].clear()
+    for turn in range(1, max_turns + 1):
+        over_budget = _budget_exceeded()
+        if over_budget:
+            _budget_stop(over_budget, messages)
+            if checkpoint:
+                save_checkpoint(messages)  # si può riprendere con un budget più alto
+            return "budget"
+        total_turns += 1
         # Debug: struttura content blocks dell'ultimo message prima della chiamata API
         if messages:
             _last = messages[-1]
@@ -315,51 +1793,91 @@ try:
                 _structure = [f"raw({type(_content).__name__})"]
             print(f"  [debug] turn {turn} last_msg role={_last.get('role')} blocks={_structure}")
 
-        response = client.beta.messages.create(
-            model=MODEL,
-            max_tokens=4096,
-            tools=tools,
-            messages=messages,
-            system=SYSTEM_PROMPT,
-            betas=[COMPUTER_BETA],
-        )
-
-        # Aggiorna metriche
-        total_input_tokens += response.usage.input_tokens or 0
-        total_output_tokens += response.usage.output_tokens or 0
-        cache_read = getattr(response.usage, "cache_read_input_tokens", 0) or 0
-        cache_write = getattr(response.usage, "cache_creation_input_tokens", 0) or 0
-
-        # Stampa il pensiero/testo del modello (in italiano grazie al system prompt)
-        for block in response.content:
+        n_omitted, bytes_omitted = _prune_old_screenshots()
+        saved_bytes += bytes_omitted
+        saved_tokens += n_omitted * image_tokens(MODEL_W, MODEL_H) + compacted_chars // 4
+        _set_rolling_cache_breakpoint(messages)
+        if traj:
+            traj["turn"] += 1
+            if traj["entries"]:
+                replay_misses += 1
+                # Il modello ha gestito la barriera su cui il replay si era fermato
+                if (traj["cursor"] < len(traj["entries"])
+                        and traj["entries"][traj["cursor"]]["input"] is None):
+                    traj["cursor"] += 1
+        t_turn = time.monotonic()
+        screen_before = _stall["screen"]  # la schermata su cui il modello decide
+        first_tool_s = None
+        overlap_s = 0.0  # azioni eseguite mentre il modello generava ancora
+        batch = {"failed": None, "action_s": 0.0}
+        outcomes: dict[str, tuple] = {}  # tool_use id -> (errore, testo, osservazione)
+        request = dict(model=_tier["model"], max_tokens=4096, tools=tools, messages=messages,
+                       system=system_blocks, betas=[COMPUTER_BETA])
+
+        def on_block(block, overlapped):
+            nonlocal first_tool_s, overlap_s
+            # Stampa il pensiero/testo del modello (in italiano grazie al system prompt)
             if block.type == "text" and block.text.strip():
                 print(f"💬 {block.text.strip()}")
+            elif block.type == "tool_use" and block.name in _PAGE_TOOLS | CUSTOM_TOOL_NAMES:
+                # In streaming il blocco completo si esegue subito, mentre il
+                # resto della risposta continua ad arrivare
+                if first_tool_s is None:
+                    first_tool_s = time.monotonic() - t_turn
+                t_action = time.monotonic()
+                outcomes[block.id] = _execute_tool_use(block, traj, batch)
+                if overlapped:
+                    overlap_s += time.monotonic() - t_action
+
+        response = _call_model(request, on_block)
+        model_s = time.monotonic() - t_turn
+
+        # Aggiorna metriche (input_tokens esclude i token letti/scritti in cache)
+        total_input_tokens += response.usage.input_tokens or 0
+        total_output_tokens += response.usage.output_tokens or 0
+        total_cache_read += getattr(response.usage, "cache_read_input_tokens", 0) or 0
+        total_cache_write += getattr(response.usage, "cache_creation_input_tokens", 0) or 0
+        _last_turn_cost = turn_cost(response.model or _tier["model"], response.usage)
+        total_cost_usd += _last_turn_cost
+        _record_tier(_tier["model"], response.usage, model_s, _last_turn_cost)
+        _log_usage(turn, response.model or _tier["model"], response.usage, _last_turn_cost, response.stop_reason)
 
         if response.stop_reason == "end_turn":
             print(f"\n✅ Agente terminato (end_turn) al turno {turn}.")
-            break
+            return "end_turn"
 
-        if response.stop_reason != "tool_use":
+        # Risposta troncata dopo azioni già eseguite: la pagina è cambiata, quindi
+        # si prosegue con i tool_result raccolti; l'ultimo tool_use (forse
+        # incompleto, mai eseguito) esce dalla history.
+        truncated = response.stop_reason == "max_tokens" and bool(outcomes)
+        if response.stop_reason != "tool_use" and not truncated:
             print(f"\n⚠️ Stop reason inatteso: {response.stop_reason}. Esco.")
-            break
+            return "stop"
+        content = response.content
+        if truncated:
+            print(f"  ✂️ Risposta troncata (max_tokens) dopo {len(outcomes)} azioni: proseguo con i loro risultati")
+            if content and content[-1].type == "tool_use" and content[-1].id not in outcomes:
+                content = content[:-1]
 
         # Re-invia tutto il content come parte della history (preserva tool_use blocks).
         # Filtra i text block vuoti: l'API Anthropic rifiuta {"type":"text","text":""}.
         filtered_content = [
-            block for block in response.content
+            block for block in content
             if not (block.type == "text" and not (block.text or "").strip())
         ]
         if not filtered_content:
             print("⚠️ Agent ha restituito messaggio vuoto, stop loop")
-            break
+            return "stop"
         messages.append({"role": "assistant", "content": filtered_content})
 
-        # Esegui ogni tool_use e raccogli i tool_result
+        # Esegui i tool_use non ancora eseguiti in streaming e raccogli i tool_result.
+        # In modalità batch le azioni del turno girano di fila e solo l'ultimo
+        # tool_result porta lo screenshot: il modello deve vedere lo stato finale.
+        tool_uses = [block for block in filtered_content if block.type == "tool_use"]
+        last_page = max((i for i, b in enumerate(tool_uses) if b.name in _PAGE_TOOLS), default=-1)
         tool_results = []
-        for block in response.content:
-            if block.type != "tool_use":
-                continue
-            if block.name != "computer":
+        for i, block in enumerate(tool_uses):
+            if block.name not in _PAGE_TOOLS | CUSTOM_TOOL_NAMES:
                 tool_results.append({
                     "type": "tool_result",
                     "tool_use_id": block.id,
@@ -367,63 +1885,249 @@ try:
                     "is_error": True,
                 })
                 continue
-
-            step_idx += 1
-            action = block.input.get("action", "?")
-            extra = ""
-            if "coordinate" in block.input:
-                extra = f" @ {block.input['coordinate']}"
-            elif "text" in block.input:
-                # Maschera la password nei log
-                txt = block.input["text"]
-                if CV_PASSWORD and CV_PASSWORD in txt:
-                    txt = txt.replace(CV_PASSWORD, "***")
-                extra = f" testo='{txt[:60]}'"
-            print(f"  → step {step_idx}: {action}{extra}")
-
-            err = execute_computer_action(block.input)
-            save_screenshot(step_idx, action)
-
-            # Risposta al modello: screenshot aggiornato (+ messaggio errore se c'è)
+            if block.id not in outcomes:
+                outcomes[block.id] = _execute_tool_use(block, traj, batch)
+            err, reply, observation = outcomes[block.id]
+            action = block.input.get("action", block.name)
+            if not err:
+                _phase_note(block)
+
+            # Risposta al modello: screenshot aggiornato (+ messaggio errore o
+            # testo del tool se c'è); in batch gli esiti intermedi sono solo testo.
             content_blocks: list[dict] = []
-            if err:
-                content_blocks.append({"type": "text", "text": err})
-                print(f"     ❌ {err}")
-            content_blocks.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": screenshot_b64(),
-                },
-            })
+            if err or reply:
+                content_blocks.append({"type": "text", "text": err or reply})
+            if observation is None and i == last_page:
+                observation = _observation(step_idx, action)
+            if observation is not None:
+                content_blocks.extend(observation)
+            elif block.name in _PAGE_TOOLS:
+                batched_screenshots += 1
+                if not content_blocks:
+                    content_blocks.append({"type": "text", "text": f"OK: {action} eseguita"})
             tool_results.append({
                 "type": "tool_result",
                 "tool_use_id": block.id,
                 "content": content_blocks,
                 "is_error": bool(err),
             })
-
+        if BATCH_ACTIONS and last_page > 0:
+            print(f"     batch di {last_page + 1} tool_use, 1 screenshot")
+        if truncated:
+            tool_results.append({"type": "text", "text": (
+                "[La tua risposta è stata troncata (max_tokens): le azioni qui sopra sono state eseguite, "
+                "l'ultima richiesta no. Riparti dallo screenshot con risposte più brevi]")})
+
+        wall_s = time.monotonic() - t_turn
+        turn_wall_s.append(wall_s)
+        turn_overlap_s.append(overlap_s)
+        first = f", primo tool a {first_tool_s:.1f}s" if first_tool_s is not None else ""
+        overlap = f", {overlap_s:.1f}s durante la risposta" if overlap_s else ""
+        print(f"  ⏱ turno {turn}: {wall_s:.1f}s (risposta {model_s:.1f}s{first}, "
+              f"azioni {batch['action_s']:.1f}s{overlap})")
+        probe_capture()
+
+        # Dopo la mossa del modello il replay può riagganciarsi alla registrazione
+        n_replayed = _replay_until_divergence(traj)
+        if n_replayed:
+            tool_results.extend(_replay_blocks(n_replayed, "replay"))
+
+        repeats, action_sig = _stall_check(tool_uses, screen_before) if STALL_REPEATS else (0, "")
+        if repeats >= 2:
+            stall_turns += 1
+        if STALL_ABORT and repeats >= STALL_REPEATS + STALL_ABORT:
+            messages.append({"role": "user", "content": tool_results})
+            print(f"\n🛑 Loop: «{action_sig}» ripetuta {repeats} volte sulla stessa schermata. Mi fermo.")
+            _stop_dump("stall", f"azione ripetuta {repeats} volte", messages, {"stall": {
+                "action": action_sig,
+                "repeats": repeats,
+                "hints": stall_hints,
+                "phase": _phase.get("title", ""),
+                "phase_turns": _phase.get("turns", 0),
+                "recent_actions": [action for _, action in _stall["seen"][-15:]],
+                "elements": cu_dom.format_elements(list(_last_elements.values())),
+            }})
+            return "stall"
+        if repeats >= STALL_REPEATS:
+            stall_hints += 1
+            print(f"  🔁 «{action_sig}» ripetuta {repeats} volte sulla stessa schermata: avviso il modello")
+            tool_results.append({"type": "text", "text": (
+                f"[ATTENZIONE — possibile loop: hai chiesto {repeats} volte «{action_sig}» su questa stessa "
+                f"schermata e non è cambiato nulla. Non ripeterla: rileggi lo screenshot, cerca messaggi di "
+                f"errore o campi obbligatori vuoti, scrolla per trovare il controllo giusto, usa click_element "
+                f"con un id dell'elenco oppure prova un'azione diversa. Se davvero non si può procedere, "
+                f"dichiaralo e fermati.]")})
         messages.append({"role": "user", "content": tool_results})
+        advanced = _update_phase(messages)
+        _update_tier(sum(1 for r in tool_results if r.get("is_error")), advanced)
+
+        if checkpoint and CHECKPOINT_EVERY and total_turns % CHECKPOINT_EVERY == 0:
+            save_checkpoint(messages)
 
         # Diagnostica token ogni 10 turni
         if turn % 10 == 0:
             print(f"  [token cumulati] input={total_input_tokens} output={total_output_tokens} "
-                  f"cache_read={cache_read} cache_write={cache_write}")
+                  f"cache_read={total_cache_read} cache_write={total_cache_write} "
+                  f"hit={_cache_hit_ratio():.0%}")
 
-    else:
-        print(f"\n⚠️ Limite di {MAX_TURNS} turni raggiunto. Esco.")
+        if is_done is not None and is_done():
+            print(f"\n✅ Obiettivo raggiunto al turno {turn}.")
+            return "done"
+
+    print(f"\n⚠️ Limite di {max_turns} turni raggiunto. Esco.")
+    return "max_turns"
 
-finally:
-    print(f"\n=== Riassunto run ===")
-    print(f"Turni eseguiti: {turn}")
+
+def print_summary() -> None:
+    """Stampa il riassunto cumulato di tutte le chiamate a run_agent()."""
+    print("\n=== Riassunto run ===")
+    print(f"Turni eseguiti: {total_turns}")
     print(f"Step eseguiti: {step_idx}")
     print(f"Token input cumulati: {total_input_tokens}")
     print(f"Token output cumulati: {total_output_tokens}")
-    # Costo Sonnet 4.6: $3/M input, $15/M output (cache read/write a parte)
-    cost = total_input_tokens * 3 / 1_000_000 + total_output_tokens * 15 / 1_000_000
-    print(f"Costo stimato (no cache): ~${cost:.3f}")
-    page.screenshot(path=str(SCREENSHOT_DIR / "cu_FINAL.png"))
-    context.close()
-    browser.close()
-    playwright.stop()
+    print(f"Token cache letti/scritti: {total_cache_read}/{total_cache_write}")
+    print(f"Cache hit ratio: {_cache_hit_ratio():.1%}")
+    for backend, times in capture_ms.items():
+        print(f"Cattura {backend}: {len(times)} frame, p50={_percentile(times, 0.5)} ms "
+              f"p90={_percentile(times, 0.9)} ms max={max(times)} ms")
+    if encoded_count:
+        print(f"Screenshot inviati: {encoded_count} ({IMAGE_FORMAT} {MODEL_W}x{MODEL_H}"
+              f"{'' if IMAGE_FORMAT == 'png' else f' q{IMAGE_QUALITY}'}), "
+              f"media {encoded_bytes / encoded_count / 1024:.0f} KB e "
+              f"~{image_tokens(MODEL_W, MODEL_H)} token per screenshot")
+    if settle_times_ms:
+        print(f"Settle post-azione: {len(settle_times_ms)} attese, p50={_percentile(settle_times_ms, 0.5)} ms "
+              f"p90={_percentile(settle_times_ms, 0.9)} ms max={max(settle_times_ms)} ms "
+              f"(tetto {SETTLE_MAX_MS} ms)")
+    for mode in ("tasti", "insert"):
+        entries = [(n, ms) for n, m, ms in type_times if m == mode]
+        if entries:
+            chars = sum(n for n, _ in entries)
+            ms = sum(ms for _, ms in entries)
+            print(f"Digitazione {mode}: {len(entries)} campi, {chars} caratteri in {ms / 1000:.1f}s "
+                  f"({ms / max(chars, 1):.1f} ms/carattere)")
+    if turn_wall_s:
+        print(f"Durata turno ({'streaming' if STREAM else 'sequenziale'}): "
+              f"p50={_percentile(turn_wall_s, 0.5):.1f}s p90={_percentile(turn_wall_s, 0.9):.1f}s "
+              f"totale {sum(turn_wall_s):.0f}s")
+    if STREAM and turn_wall_s:
+        before = [w + o for w, o in zip(turn_wall_s, turn_overlap_s)]
+        print(f"  senza streaming (stima: azioni dopo la risposta): p50={_percentile(before, 0.5):.1f}s "
+              f"p90={_percentile(before, 0.9):.1f}s totale {sum(before):.0f}s — "
+              f"{sum(turn_overlap_s):.1f}s di azioni sovrapposte alla generazione")
+    if prep_s:
+        print(f"Lavoro in background durante le chiamate (firme schermata, checkpoint): "
+              f"{len(prep_s)} job, {sum(prep_s):.1f}s tolti dal percorso critico")
+    if batched_screenshots:
+        print(f"Screenshot evitati dai turni multi-azione: {batched_screenshots}")
+    print(f"Screenshot omessi dalla history: {omitted_images} "
+          f"(finestra {KEEP_SCREENSHOTS}, risparmiati ~{saved_bytes / 1_000_000:.1f} MB "
+          f"e ~{saved_tokens} token di input sul run)")
+    if compacted_phases:
+        print(f"Fasi compattate: {compacted_phases} (~{compacted_chars // 4} token di testo "
+              f"in meno per ogni turno successivo)")
+    if cu_templates.summary():
+        print(cu_templates.summary())
+    if stall_turns or stall_hints:
+        print(f"Loop: {stall_turns} turni sprecati ripetendo un'azione sulla stessa schermata, "
+              f"{stall_hints} avvisi al modello")
+    if replay_hits or replay_misses:
+        print(f"Traiettorie: {replay_hits} azioni rieseguite senza modello, "
+              f"{replay_turns_saved} turni modello risparmiati, {replay_misses} turni con modello")
+    for model, (n, seconds, cost, _no_cache) in tier_stats.items():
+        print(f"Modello {model}: {n} turni, risposta media {seconds / n:.1f}s, ${cost:.3f}")
+    if MODEL_SMALL:
+        print(f"Escalation a {MODEL}: {escalations} (fermo dopo {ESCALATE_STALL_TURNS} turni)")
+        print(f"Cambi di modello: {tier_switches}, ~${tier_switch_cost:.3f} di riscrittura cache "
+              f"(almeno {TIER_MIN_TURNS} turni per modello)")
+    no_cache = sum(stats[3] for stats in tier_stats.values())
+    print(f"Costo effettivo (cache inclusa): ${total_cost_usd:.3f} "
+          f"(senza cache sarebbe ~${no_cache:.3f}) — tetto ${BUDGET_USD:.2f}")
+    print(f"Tempo agente: {_elapsed_s() / 60:.1f} min (tetto {BUDGET_MINUTES:.0f}) — usage per turno in {USAGE_LOG}")
+
+
+def main() -> None:
+    global PROP, DATA_FILE, CV_EMAIL, CV_PASSWORD
+    # --- Carica dati proprietà ---
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    data_file = DATA_FILE = args[0] if args else "Casa_Adelasia_A_DATI.json"
+    with open(data_file, encoding="utf-8") as fh:
+        PROP = json.load(fh)
+
+    CV_EMAIL = os.environ["CV_EMAIL"]
+    CV_PASSWORD = os.environ["CV_PASSWORD"]
+
+    # --resume: riprende la conversazione dall'ultimo checkpoint di questa proprietà
+    checkpoint = load_checkpoint() if "--resume" in sys.argv else None
+    if "--resume" in sys.argv and checkpoint is None:
+        print(f"⚠️ Nessun checkpoint in {checkpoint_path()}: run da zero")
+
+    print("=== CaseVacanza Computer Use Agent ===")
+    print(f"Proprietà: {PROP['identificativi']['nome_struttura']}")
+    print(f"JSON: {data_file}")
+    print(f"Modello: {MODEL_SMALL + ' → ' + MODEL if MODEL_SMALL else MODEL}")
+    print(f"Display: {SCREEN_W}x{SCREEN_H} (modello: {MODEL_W}x{MODEL_H} {IMAGE_FORMAT}"
+          f"{'' if IMAGE_FORMAT == 'png' else f' q{IMAGE_QUALITY}'})")
+    print(f"Budget: ${BUDGET_USD:.2f}, {BUDGET_TOKENS} token, {MAX_TURNS} turni, {BUDGET_MINUTES:.0f} min")
+    if checkpoint:
+        print(f"Ripresa: checkpoint del {checkpoint['saved_at']} (turno {checkpoint['counters']['total_turns']})")
+    print("=====================================\n")
+
+    # --- Browser via Playwright (solo come display) ---
+    playwright = sync_playwright().start()
+    browser = playwright.chromium.launch(
+        headless=False,
+        args=[f"--window-size={SCREEN_W},{SCREEN_H}", "--disable-blink-features=AutomationControlled"],
+    )
+    context = session_vault.new_context(browser, CV_EMAIL, viewport={"width": SCREEN_W, "height": SCREEN_H})
+    attach_page(context.new_page())
+    page.set_default_timeout(30_000)
+
+    reason = None
+    try:
+        # Con una sessione valida nel vault si parte dalla dashboard, login saltato
+        logged_in = session_vault.restore_session(page, CV_EMAIL)
+        if not logged_in:
+            # Pagina di partenza: navighiamo subito alla login per avere un DOM reale
+            # (about:blank fa fallire Page.captureScreenshot — visto in run #3 del 05/05/2026).
+            print(f"🌐 Navigazione a {LOGIN_URL}...")
+            page.goto(LOGIN_URL, wait_until="domcontentloaded", timeout=30_000)
+            try:
+                page.wait_for_load_state("networkidle", timeout=10_000)
+            except Exception:
+                pass  # networkidle è best-effort, non bloccare se non arriva
+            print("✅ Pagina caricata, attendo settling...")
+            time.sleep(1.5)
+        if checkpoint and logged_in:
+            # Il draft è già a metà: si torna dove il run precedente si era fermato
+            page.goto(checkpoint["url"], wait_until="domcontentloaded", timeout=30_000)
+            time.sleep(1.5)
+
+        reason = run_agent(build_initial_text(CV_EMAIL, CV_PASSWORD, logged_in), trajectory_key="wizard",
+                           checkpoint=True, resume=checkpoint)
+        if reason in ("end_turn", "done"):
+            flush_artifacts()  # un checkpoint ancora in scrittura non deve ricomparire
+            checkpoint_path().unlink(missing_ok=True)
+    finally:
+        print_summary()
+        try:
+            if not session_vault.on_login_form(page):
+                session_vault.save(context, CV_EMAIL)
+        except Exception as e:
+            print(f"  [vault] Sessione non salvata: {e}")
+        page.screenshot(path=str(SCREENSHOT_DIR / "cu_FINAL.png"))
+        flush_artifacts()
+        context.close()
+        browser.close()
+        playwright.stop()
+
+    if reason == "budget":
+        print(f"\n❌ RUN INTERROTTO PER BUDGET — stato in {SCREENSHOT_DIR / 'cu_budget_stop.json'}")
+        raise SystemExit(1)
+    if reason == "stall":
+        print(f"\n❌ RUN INTERROTTO PER LOOP — diagnostica in {SCREENSHOT_DIR / 'cu_stall_stop.json'}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Modalità ibrida per CaseVacanza.it: Playwright scriptato + fallback Computer Use.
+
+Esegue il flusso di casevacanza_uploader.py (login, wizard step by step). Quando
+uno step scriptato fallisce — eccezione dentro `try_step` oppure wizard che non
+avanza dopo Salva — la stessa `page` passa all'agente Computer Use con un
+obiettivo limitato a quello step. Appena il wizard avanza (URL o heading
+cambiano) l'agente si ferma e lo script riprende dallo step successivo.
+
+Così gli step che lo script sa fare costano secondi e zero token, e il modello
+interviene solo dove il portale ha cambiato HTML.
+
+Uso:
+    python casevacanza_hybrid.py [path/al/JSON]
+
+Env vars richieste:
+    CASEVACANZA_EMAIL, CASEVACANZA_PASSWORD   — credenziali (accetta anche CV_EMAIL, CV_PASSWORD)
+    ANTHROPIC_API_KEY                         — API key Anthropic
+"""
+
+import os
+import sys
+
+# casevacanza_uploader legge JSON e credenziali all'import: prepariamo l'ambiente prima.
+if len(sys.argv) > 1:
+    os.environ["PROPERTY_DATA"] = sys.argv[1]
+for _cv_var, _uploader_var in (("CV_EMAIL", "CASEVACANZA_EMAIL"), ("CV_PASSWORD", "CASEVACANZA_PASSWORD")):
+    if _cv_var in os.environ:
+        os.environ.setdefault(_uploader_var, os.environ[_cv_var])
+
+from playwright.sync_api import sync_playwright
+
+import casevacanza_computer_use as cu
+import casevacanza_uploader as cvu
+import page_wait
+import session_vault
+
+# Turni massimi dell'agente per un singolo step: oltre, lo step è considerato fallito.
+FALLBACK_MAX_TURNS = int(os.environ.get("HYBRID_FALLBACK_MAX_TURNS", "25"))
+
+# Step che valgono come recuperati solo se la pagina cambia davvero
+# (per gli altri basta che l'agente dichiari lo step completato).
+_MUST_ADVANCE = ("login", "navigazione_wizard")
+
+fallback_log = []  # (step_name, stop_reason, turni, wizard_avanzato)
+
+
+def _step_goal(step_name):
+    """Obiettivo in italiano per l'agente, limitato allo step fallito."""
+    ident = cvu.PROP["identificativi"]
+    comp = cvu.PROP["composizione"]
+    if step_name.startswith("salva_"):
+        return (f"Il wizard non avanza dopo Salva/Continua sulla pagina '{step_name[6:]}'. "
+                f"Leggi gli errori di validazione, correggi i campi usando il JSON e clicca "
+                f"di nuovo Salva/Continua.")
+    goals = {
+        "login": (f"Fai login su CaseVacanza con email {cvu.EMAIL} e password {cvu.PASSWORD}. "
+                  f"Fermati appena sei nella dashboard."),
+        "navigazione_wizard": ("Apri il wizard 'Aggiungi una proprietà' "
+                               "(https://my.casevacanza.it/listing/add-property) e fermati alla prima pagina."),
+        "step1_unità_singola": "Scegli 'Proprietà a unità singola'.",
+        "step2_tipo_struttura": f"Seleziona il tipo di struttura '{ident['tipo_struttura']}'.",
+        "step3_intero_alloggio": "Seleziona 'Intero alloggio'.",
+        "step5_indirizzo": (f"Scegli 'Inseriscilo manualmente' e compila l'indirizzo: regione {ident['regione']}, "
+                            f"comune {ident['comune']}, via e civico '{ident['indirizzo']}', CAP {ident['cap']}."),
+        "step7_mappa": "Conferma la posizione sulla mappa.",
+        "step8_ospiti_camere": (f"Con i contatori +/- imposta {comp['max_ospiti']} ospiti, {comp['camere']} camere, "
+                                f"{comp['bagni']} bagni e 1 cucina."),
+        "step10_letti": f"Configura i letti per camera secondo composizione.letti: {comp.get('letti', [])}.",
+        "step12_foto": "Carica le foto della proprietà con il tool upload_photos.",
+        "step14_servizi": f"Spunta SOLO questi servizi: {', '.join(cvu.SERVIZI) or 'nessuno'}.",
+        "step16_li_scrivo_io": "Scegli 'Li scrivo io' per titolo e descrizione.",
+        "step17_titolo_desc": "Compila titolo (marketing.titolo) e descrizione (marketing.descrizione_lunga).",
+        "step19_prezzo": (f"Imposta il prezzo base per notte a {cvu.calculate_base_price()} EUR e i costi extra "
+                          f"(pulizia, asciugamani, lenzuola) presenti in condizioni."),
+        "step20b_stagioni": "Inserisci i prezzi stagionali di condizioni.listino_prezzi, se il wizard li prevede.",
+        "step26_calendario": ("Sincronizzazione calendario: se c'è condizioni.ical_url scegli che usi altre "
+                              "piattaforme e incolla l'URL, altrimenti scegli che gestisci le prenotazioni solo qui."),
+        "step27_requisiti": f"Inserisci CIN ({ident.get('cin') or '-'}) e CIR ({ident.get('cir') or '-'}).",
+    }
+    return goals.get(step_name, f"Completa lo step '{step_name}' del wizard usando il JSON.")
+
+
+def _step_text(step_name, exc):
+    errore = exc if exc is not None else "il wizard non è avanzato dopo Salva/Continua"
+    return f"""Il browser è già aperto sul portale CaseVacanza. Uno script automatico sta compilando il wizard "Aggiungi proprietà" e si è bloccato: completa tu SOLO questo step.
+
+STEP: {step_name}
+OBIETTIVO: {_step_goal(step_name)}
+ERRORE DELLO SCRIPT: {errore}
+
+DATI PROPRIETÀ ({cu.summary_for_log(cvu.PROP)}) — campi vuoti e false omessi, testi lunghi leggibili con get_property_field:
+
+```json
+{cu.property_json(cvu.PROP)}
+```
+
+Lavora solo su questo step. Per gli step del wizard, quando hai finito clicca "Salva"/"Continua": appena il wizard avanza lo script riprende da solo, quindi NON compilare gli step successivi. Se non riesci dopo 2 tentativi, dichiaralo e fermati.
+"""
+
+
+def computer_use_fallback(page, step_name, exc):
+    """STEP_FALLBACK per casevacanza_uploader: affida lo step all'agente."""
+    url_before = page.url
+    heading_before = cvu.current_heading(page)
+
+    def wizard_advanced():
+        try:
+            return page.url != url_before or cvu.current_heading(page) != heading_before
+        except Exception:
+            return False  # navigazione in corso: lo rivalutiamo al turno dopo
+
+    print(f"\n  🤖 Fallback Computer Use per {step_name} (max {FALLBACK_MAX_TURNS} turni)")
+    turns_before = cu.total_turns
+    try:
+        # Lo step scriptato è già fallito: si parte direttamente dal modello grande
+        reason = cu.run_agent(_step_text(step_name, exc), max_turns=FALLBACK_MAX_TURNS,
+                              is_done=wizard_advanced, trajectory_key=step_name, escalated=True)
+    except Exception as e:
+        print(f"  ❌ Fallback Computer Use fallito: {e}")
+        reason = "errore"
+    advanced = wizard_advanced()
+    fallback_log.append((step_name, reason, cu.total_turns - turns_before, advanced))
+    if advanced:
+        cvu.fallback_advanced = True
+        return True
+    if step_name.startswith("salva_") or step_name in _MUST_ADVANCE:
+        return False
+    return reason == "end_turn"
+
+
+def main():
+    os.makedirs(cvu.SCREENSHOT_DIR, exist_ok=True)
+    cvu.STEP_FALLBACK = computer_use_fallback
+    cu.PROP = cvu.PROP
+    cu.DATA_FILE = cvu.DATA_FILE
+    cu.CV_EMAIL = cvu.EMAIL
+    cu.CV_PASSWORD = cvu.PASSWORD
+
+    with sync_playwright() as p:
+        # Viewport fisso alla risoluzione che l'agente dichiara al modello
+        browser = p.chromium.launch(
+            headless=False,
+            args=[f"--window-size={cu.SCREEN_W},{cu.SCREEN_H}"],
+        )
+        context = session_vault.new_context(
+            browser, cvu.EMAIL,
+            user_agent=cvu.USER_AGENT,
+            viewport={"width": cu.SCREEN_W, "height": cu.SCREEN_H},
+        )
+        page = context.new_page()
+        page.set_default_timeout(30_000)
+        cu.attach_page(page)
+        page_wait.track(page)
+        try:
+            cvu.try_step(page, "login", lambda: cvu.login(page))
+            cvu.try_step(page, "navigazione_wizard", lambda: cvu.navigate_to_add_property(page))
+            cvu.insert_property(page)
+            if cvu.PROP.get("condizioni", {}).get("listino_prezzi"):
+                try:
+                    cvu.add_seasonal_prices(page)
+                except Exception as e:
+                    print(f"\n[ERRORE] Tariffe stagionali: {e}")
+                    cvu.step_errors.append(("tariffe_stagionali", str(e)))
+        finally:
+            try:
+                # sys.exc_info() è valorizzato se usciamo per un'eccezione
+                cvu.final_state(page, failed=sys.exc_info()[0] is not None)
+            except Exception:
+                pass
+            print("\n=== Riassunto ibrido ===")
+            print(f"Step passati al Computer Use: {len(fallback_log)}")
+            for name, reason, turns, advanced in fallback_log:
+                esito = "avanzato" if advanced else reason
+                print(f"  - {name}: {turns} turni ({esito})")
+            if cu.total_turns:
+                cu.print_summary()
+            if page_wait.summary():
+                print(page_wait.summary())
+            if cvu.diagnostics_summary():
+                print(cvu.diagnostics_summary())
+            if cvu.step_errors:
+                print(f"\nERRORI: {len(cvu.step_errors)} step falliti:")
+                for name, err in cvu.step_errors:
+                    print(f"  - {name}: {err}")
+            cu.flush_artifacts()
+            context.close()
+            browser.close()
+
+    if cvu.step_errors:
+        print(f"\n❌ RUN FALLITO: {len(cvu.step_errors)} step in errore — uscita con codice 1")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Foto delle proprietà CaseVacanza: recupero dei file e upload nel wizard.
+
+Condiviso da casevacanza_uploader.py (step 12) e dall'agente Computer Use
+(tool `upload_photos`): il selettore file nativo del sistema operativo non si
+pilota a pixel, quindi l'upload passa sempre da Playwright.
+"""
+
+import os
+import tempfile
+import urllib.request
+
+
+def download_photos_from_urls(urls):
+    """Scarica foto dagli URL CDN (es. Krossbooking) in cartella temporanea.
+
+    Ritorna la lista dei path locali scaricati con successo, oppure [] se
+    nessun URL è disponibile / tutti i download falliscono.
+    """
+    if not urls:
+        return []
+    tmp_dir = tempfile.mkdtemp()
+    paths = []
+    for i, url in enumerate(urls):
+        ext = os.path.splitext(url.split("?")[0])[1] or ".jpg"
+        path = os.path.join(tmp_dir, f"photo_{i+1}{ext}")
+        try:
+            urllib.request.urlretrieve(url, path)
+            paths.append(path)
+            print(f"  Foto scaricata: {path} <- {url}")
+        except Exception as e:
+            print(f"  ATTENZIONE: download fallito per {url}: {e}")
+    return paths
+
+
+def load_photo_paths(prop, data_file, placeholder=True):
+    """Path locali delle foto della proprietà, nell'ordine: file del JSON
+    (relativi alla cartella del JSON), download dagli URL CDN, placeholder.
+
+    Con `placeholder=False` niente immagini finte: [] se il JSON non ha foto
+    reali raggiungibili (l'agente non deve pubblicare riquadri colorati).
+    """
+    # 1) Foto locali già presenti nel JSON
+    foto_json = prop.get("marketing", {}).get("foto", [])
+    if foto_json:
+        json_dir = os.path.dirname(os.path.abspath(data_file))
+        paths = []
+        for f in foto_json:
+            p = f if os.path.isabs(f) else os.path.join(json_dir, f)
+            if os.path.isfile(p):
+                paths.append(p)
+        if paths:
+            return paths
+
+    # 2) URL CDN Krossbooking (foto_urls)
+    foto_urls = prop.get("marketing", {}).get("foto_urls", []) or prop.get("foto_urls", [])
+    if foto_urls:
+        print(f"  Scarico {len(foto_urls)} foto dagli URL CDN forniti nel JSON...")
+        cdn_paths = download_photos_from_urls(foto_urls)
+        if cdn_paths:
+            return cdn_paths
+
+    # 3) Fallback: placeholder locali
+    if not placeholder:
+        return []
+    print("  Genero 5 foto placeholder locali (1024x768)...")
+    paths = []
+    tmp_dir = tempfile.mkdtemp()
+    for i in range(5):
+        path = os.path.join(tmp_dir, f"photo_{i+1}.jpg")
+        _generate_placeholder_jpeg(path, 1024, 768, color_index=i)
+        paths.append(path)
+    return paths
+
+
+def _generate_placeholder_jpeg(path, width, height, color_index=0):
+    try:
+        from PIL import Image
+        colors = [(70, 130, 180), (60, 179, 113), (255, 165, 0), (147, 112, 219), (220, 20, 60)]
+        color = colors[color_index % len(colors)]
+        img = Image.new("RGB", (width, height), color)
+        img.save(path, "JPEG", quality=85)
+    except ImportError:
+        urllib.request.urlretrieve(f"https://picsum.photos/{width}/{height}?random={color_index + 1}", path)
+
+
+def upload_photos(page, photo_paths):
+    """Carica `photo_paths` nello step foto del wizard. Prima il file chooser
+    aperto da "Carica foto", poi l'input[type=file] nascosto. True se riuscito."""
+    try:
+        with page.expect_file_chooser(timeout=5000) as fc_info:
+            btn = page.get_by_text("Carica foto")
+            if btn.count() > 0:
+                btn.first.click()
+        fc_info.value.set_files(photo_paths)
+        print(f"  Upload {len(photo_paths)} foto via file chooser")
+        return True
+    except Exception as e:
+        print(f"  File chooser fallito: {e}")
+    try:
+        fi = page.locator("input[type='file']")
+        if fi.count() > 0:
+            fi.set_input_files(photo_paths)
+            print(f"  Upload {len(photo_paths)} foto via input[type=file]")
+            return True
+    except Exception:
+        pass
+    return False
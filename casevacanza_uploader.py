@@ -1,11 +1,19 @@
 import json
 import os
 import re
-import tempfile
-import urllib.request
+import sys
+import time
+from collections import deque
 
 from playwright.sync_api import sync_playwright
 
+import amenity_select
+import casevacanza_photos
+import cu_templates
+import page_locate
+import page_wait
+import session_vault
+
 # --- Carica dati proprietà dal file JSON ---
 DATA_FILE = os.environ.get(
     "PROPERTY_DATA", os.path.join(os.path.dirname(__file__), "Il_Faro_Badesi_DATI.json")
@@ -90,6 +98,14 @@ SERVIZI = _build_servizi()
 
 SCREENSHOT_DIR = "screenshots"
 
+# Diagnostica degli step:
+#   off         nessuna cattura
+#   on-failure  (default) ultimi DIAG_FRAMES screenshot del viewport + HTML in
+#               memoria, scritti in screenshots/ solo quando uno step fallisce
+#   full        come prima: screenshot full-page + HTML su disco a ogni step
+DIAGNOSTICS = os.environ.get("CV_DIAGNOSTICS", "on-failure")
+DIAG_FRAMES = int(os.environ.get("CV_DIAG_FRAMES", "8"))
+
 LETTO_LABEL = {
     "matrimoniale": "Letto matrimoniale (ca. 140 x 200 cm)",
     "singolo": "Letto singolo (ca. 90 x 200 cm)",
@@ -103,22 +119,52 @@ LETTO_LABEL = {
 
 step_counter = 0
 step_errors = []
+# (nome file senza estensione, jpeg, html) degli ultimi step, per on-failure
+diag_ring = deque(maxlen=DIAG_FRAMES)
+# (nome, ms) di ogni cattura, per vedere quanto costa la diagnostica
+capture_ms = []
+
+# Modalità ibrida (casevacanza_hybrid.py): se impostato, viene chiamato come
+# STEP_FALLBACK(page, step_name, exc) quando uno step scriptato fallisce e deve
+# ritornare True se ha recuperato lo step al posto dello script.
+STEP_FALLBACK = None
+# Messo a True dal fallback quando ha già fatto avanzare il wizard: il
+# click_save_and_verify successivo non deve cliccare Salva una seconda volta.
+fallback_advanced = False
 
 
 def screenshot(page, name):
     global step_counter
+    if DIAGNOSTICS == "off":
+        return
     step_counter += 1
-    path = f"{SCREENSHOT_DIR}/step{step_counter:02d}_{name}.png"
+    if DIAGNOSTICS == "full":
+        _write_screenshot(page, f"step{step_counter:02d}_{name}")
+    else:
+        _ring_capture(page, f"step{step_counter:02d}_{name}")
+
+
+def save_html(page, name):
+    # In on-failure l'HTML è già nel ring insieme allo screenshot
+    if DIAGNOSTICS == "full":
+        _write_html(page, name)
+
+
+def _write_screenshot(page, stem):
+    path = f"{SCREENSHOT_DIR}/{stem}.png"
+    t0 = time.monotonic()
     try:
         page.wait_for_load_state("load", timeout=10_000)
         page.screenshot(path=path, full_page=True)
         print(f"  Screenshot: {path}")
     except Exception as e:
-        print(f"  [WARN] Screenshot fallita ({name}): {e}")
+        print(f"  [WARN] Screenshot fallita ({stem}): {e}")
+    capture_ms.append((stem, int((time.monotonic() - t0) * 1000)))
 
 
-def save_html(page, name):
+def _write_html(page, name):
     path = f"{SCREENSHOT_DIR}/{name}.html"
+    t0 = time.monotonic()
     try:
         html = page.content()
         with open(path, "w", encoding="utf-8") as f:
@@ -126,6 +172,63 @@ def save_html(page, name):
         print(f"  HTML salvato: {path}")
     except Exception as e:
         print(f"  [WARN] HTML save fallito ({name}): {e}")
+    capture_ms.append((f"{name}.html", int((time.monotonic() - t0) * 1000)))
+
+
+def _ring_capture(page, stem):
+    """Screenshot del solo viewport (JPEG) + HTML in memoria: niente disco e
+    niente full-page, lento sulle pagine lunghe come quella della descrizione."""
+    t0 = time.monotonic()
+    try:
+        image = page.screenshot(type="jpeg", quality=70)
+        html = page.content()
+    except Exception as e:
+        print(f"  [WARN] Cattura diagnostica fallita ({stem}): {e}")
+        return
+    diag_ring.append((stem, image, html))
+    capture_ms.append((stem, int((time.monotonic() - t0) * 1000)))
+
+
+def dump_failure(page, name):
+    """Stato della pagina quando qualcosa fallisce: scrive su disco i frame
+    del ring e uno screenshot full-page + HTML del momento."""
+    global step_counter
+    if DIAGNOSTICS == "off":
+        return
+    if diag_ring:
+        print(f"  Diagnostica: scrivo gli ultimi {len(diag_ring)} step in {SCREENSHOT_DIR}/")
+    while diag_ring:
+        stem, image, html = diag_ring.popleft()
+        try:
+            with open(f"{SCREENSHOT_DIR}/{stem}.jpg", "wb") as f:
+                f.write(image)
+            with open(f"{SCREENSHOT_DIR}/{stem}.html", "w", encoding="utf-8") as f:
+                f.write(html)
+        except OSError as e:
+            print(f"  [WARN] Scrittura diagnostica fallita ({stem}): {e}")
+    step_counter += 1
+    _write_screenshot(page, f"step{step_counter:02d}_{name}")
+    _write_html(page, name)
+
+
+def final_state(page, failed=False):
+    """Cattura finale: sempre in full, altrimenti solo se il run è fallito."""
+    if DIAGNOSTICS == "full":
+        screenshot(page, "final_state")
+        save_html(page, "final_state")
+    elif failed or step_errors:
+        dump_failure(page, "final_state")
+
+
+def diagnostics_summary():
+    """Riga di riassunto del costo delle catture (None se non ce ne sono state)."""
+    if not capture_ms:
+        return None
+    total = sum(ms for _, ms in capture_ms)
+    slowest = sorted(capture_ms, key=lambda c: -c[1])[:3]
+    worst = ", ".join(f"{name} {ms} ms" for name, ms in slowest)
+    return (f"Diagnostica ({DIAGNOSTICS}): {len(capture_ms)} catture, {total / 1000:.1f}s "
+            f"totali, media {total // len(capture_ms)} ms — più lente: {worst}")
 
 
 def step_done(page, name):
@@ -133,14 +236,14 @@ def step_done(page, name):
         page.wait_for_load_state("domcontentloaded", timeout=10_000)
     except Exception:
         pass
-    page.wait_for_timeout(400)
+    page_wait.until_quiet(page, quiet_ms=150, max_ms=2000)
     screenshot(page, name)
     save_html(page, name)
 
 
 def dismiss_overlay(page):
     page.keyboard.press("Escape")
-    page.wait_for_timeout(200)
+    page_wait.until_quiet(page, max_ms=500)
     for selector in [".react-modal-portal-v2", ".ReactModal__Overlay"]:
         try:
             modal = page.locator(selector)
@@ -148,7 +251,7 @@ def dismiss_overlay(page):
                 close_btn = modal.locator("button").first
                 if close_btn.count() > 0:
                     close_btn.click()
-                    page.wait_for_timeout(200)
+                    page_wait.until_hidden(modal.first, max_ms=1000)
                     return
         except Exception:
             pass
@@ -156,7 +259,7 @@ def dismiss_overlay(page):
         ok_btn = page.locator("button", has_text="Ok")
         if ok_btn.count() > 0 and ok_btn.first.is_visible():
             ok_btn.first.click()
-            page.wait_for_timeout(200)
+            page_wait.until_hidden(ok_btn.first, max_ms=1000)
     except Exception:
         pass
     hidden = page.evaluate("""() => {
@@ -172,7 +275,7 @@ def dismiss_overlay(page):
         return count;
     }""")
     if hidden:
-        page.wait_for_timeout(200)
+        page_wait.until_quiet(page, max_ms=500)
 
 
 def dismiss_cookie(page):
@@ -180,10 +283,15 @@ def dismiss_cookie(page):
         btn = page.locator('[data-test="accept-button"]:visible').first
         if btn.is_visible(timeout=2000):
             btn.click()
-            page.wait_for_timeout(500)
+            page_wait.until_hidden(btn, max_ms=2000)
             print("  Cookie banner chiuso")
+            return
     except Exception:
         pass
+    # Banner senza il data-test atteso (o in un iframe): lo cerchiamo a vista
+    if cu_templates.available() and cu_templates.click_known(page, "cookie_ok"):
+        page_wait.until_quiet(page, max_ms=1000)
+        print("  Cookie banner chiuso (template)")
 
 
 def try_step(page, step_name, func, critical=False, optional=False):
@@ -197,31 +305,46 @@ def try_step(page, step_name, func, critical=False, optional=False):
     `critical` è mantenuto per retrocompatibilità ma non cambia più il
     comportamento (tutti gli step non opzionali sono ora 'critici').
     """
+    global fallback_advanced
     print(f"\n--- {step_name} ---")
+    fallback_advanced = False
+    page_locate.current_step = step_name
     dismiss_overlay(page)
     try:
         func()
         print(f"  OK: {step_name}")
     except Exception as e:
-        step_errors.append((step_name, str(e)))
         print(f"  ❌ STEP FALLITO ({step_name}): {e}")
-        screenshot(page, f"errore_{step_name}")
-        save_html(page, f"errore_{step_name}")
+        dump_failure(page, f"errore_{step_name}")
+        if STEP_FALLBACK is not None and STEP_FALLBACK(page, step_name, e):
+            print(f"  OK (fallback): {step_name}")
+            return
+        step_errors.append((step_name, str(e)))
         if optional:
             print(f"  (step marcato optional, il run prosegue)")
             return
         raise
 
 
+def current_heading(page):
+    """Testo del titolo dello step corrente (usato per capire se il wizard avanza)."""
+    return page.evaluate("""(selector) => {
+        const h = document.querySelector(selector);
+        return h ? h.textContent.trim() : '';
+    }""", page_wait.HEADING_SELECTOR)
+
+
 def click_save_and_verify(page, step_name):
+    global fallback_advanced
+    if fallback_advanced:
+        fallback_advanced = False
+        print(f"  Wizard già avanzato dal fallback: {step_name}")
+        return True
     dismiss_overlay(page)
     url_before = page.url
-    heading_before = page.evaluate("""() => {
-        const h = document.querySelector('h1, h2, h3, [data-test*="title"], [class*="heading"]');
-        return h ? h.textContent.trim() : '';
-    }""")
+    heading_before = current_heading(page)
     page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-    page.wait_for_timeout(200)
+    page_wait.until_quiet(page, max_ms=500)
     save_exists = page.evaluate("""() => {
         const btn = document.querySelector('[data-test="save-button"]');
         if (!btn) return 'not in DOM';
@@ -240,16 +363,18 @@ def click_save_and_verify(page, step_name):
             page.locator('[data-test="save-button"]').click(force=True, timeout=5000)
         except Exception:
             clicked = False
-            for btn_text in ["Continua", "Avanti", "Salva e continua", "Save", "Salva"]:
+            btn = page_locate.locate(page, [("button", t) for t in
+                                            ["Continua", "Avanti", "Salva e continua", "Save", "Salva"]],
+                                     field="salva")
+            if btn is not None:
                 try:
-                    btn = page.get_by_role("button", name=btn_text)
-                    if btn.count() > 0:
-                        btn.first.scroll_into_view_if_needed()
-                        btn.first.click()
-                        clicked = True
-                        break
+                    btn.scroll_into_view_if_needed()
+                    btn.click()
+                    clicked = True
                 except Exception:
-                    continue
+                    pass
+            if not clicked and cu_templates.available():
+                clicked = cu_templates.click_known(page, "salva") is not None
             if not clicked:
                 page.evaluate("""() => {
                     const selectors = ['[data-test="save-button"]','button[type="submit"]','button.bg-primary-normal-gradient'];
@@ -266,14 +391,16 @@ def click_save_and_verify(page, step_name):
                     }
                     return false;
                 }""")
-    page.wait_for_load_state("domcontentloaded")
-    page.wait_for_timeout(200)
+    # Il click parte subito ma il wizard salva via XHR e poi ridisegna: si
+    # aspetta il cambio di step invece di una pausa che a volte non bastava
+    page_wait.until_changed(page, url_before, heading_before, max_ms=8000)
     url_after = page.url
-    heading_after = page.evaluate("""() => {
-        const h = document.querySelector('h1, h2, h3, [data-test*="title"], [class*="heading"]');
-        return h ? h.textContent.trim() : '';
-    }""")
+    heading_after = current_heading(page)
     advanced = (url_after != url_before) or (heading_after != heading_before)
+    if not advanced and STEP_FALLBACK is not None:
+        print("  [WARN] Wizard non avanzato, passo al fallback")
+        advanced = bool(STEP_FALLBACK(page, f"salva_{step_name}", None))
+        fallback_advanced = False
     if not advanced:
         print(f"  [WARN] Wizard potrebbe non essere avanzato")
     else:
@@ -282,69 +409,8 @@ def click_save_and_verify(page, step_name):
     return advanced
 
 
-def download_photos_from_urls(urls):
-    """Scarica foto dagli URL CDN (es. Krossbooking) in cartella temporanea.
-
-    Ritorna la lista dei path locali scaricati con successo, oppure [] se
-    nessun URL è disponibile / tutti i download falliscono.
-    """
-    if not urls:
-        return []
-    tmp_dir = tempfile.mkdtemp()
-    paths = []
-    for i, url in enumerate(urls):
-        ext = os.path.splitext(url.split("?")[0])[1] or ".jpg"
-        path = os.path.join(tmp_dir, f"photo_{i+1}{ext}")
-        try:
-            urllib.request.urlretrieve(url, path)
-            paths.append(path)
-            print(f"  Foto scaricata: {path} <- {url}")
-        except Exception as e:
-            print(f"  ATTENZIONE: download fallito per {url}: {e}")
-    return paths
-
-
 def load_photo_paths():
-    # 1) Foto locali già presenti nel JSON
-    foto_json = PROP.get("marketing", {}).get("foto", [])
-    if foto_json:
-        json_dir = os.path.dirname(os.path.abspath(DATA_FILE))
-        paths = []
-        for f in foto_json:
-            p = f if os.path.isabs(f) else os.path.join(json_dir, f)
-            if os.path.isfile(p):
-                paths.append(p)
-        if paths:
-            return paths
-
-    # 2) URL CDN Krossbooking (foto_urls)
-    foto_urls = PROP.get("marketing", {}).get("foto_urls", []) or PROP.get("foto_urls", [])
-    if foto_urls:
-        print(f"  Scarico {len(foto_urls)} foto dagli URL CDN forniti nel JSON...")
-        cdn_paths = download_photos_from_urls(foto_urls)
-        if cdn_paths:
-            return cdn_paths
-
-    # 3) Fallback: placeholder locali
-    print("  Genero 5 foto placeholder locali (1024x768)...")
-    paths = []
-    tmp_dir = tempfile.mkdtemp()
-    for i in range(5):
-        path = os.path.join(tmp_dir, f"photo_{i+1}.jpg")
-        _generate_placeholder_jpeg(path, 1024, 768, color_index=i)
-        paths.append(path)
-    return paths
-
-
-def _generate_placeholder_jpeg(path, width, height, color_index=0):
-    try:
-        from PIL import Image
-        colors = [(70, 130, 180), (60, 179, 113), (255, 165, 0), (147, 112, 219), (220, 20, 60)]
-        color = colors[color_index % len(colors)]
-        img = Image.new("RGB", (width, height), color)
-        img.save(path, "JPEG", quality=85)
-    except ImportError:
-        urllib.request.urlretrieve(f"https://picsum.photos/{width}/{height}?random={color_index + 1}", path)
+    return casevacanza_photos.load_photo_paths(PROP, DATA_FILE)
 
 
 def calculate_base_price():
@@ -405,41 +471,23 @@ def fill_field(page, value, labels, css_selectors, field_name):
         return False
     val = str(value)
     filled = False
-    for lbl in labels:
+    # Etichette e selettori in un solo round trip, nell'ordine di priorità
+    hit = page_locate.resolve(page, [("label", l) for l in labels] + [("css", c) for c in css_selectors],
+                              field=field_name)
+    if hit:
+        f, (by, what), info = hit
         try:
-            f = page.get_by_label(lbl)
-            if f.count() > 0:
-                tag = f.first.evaluate("el => el.tagName")
-                if tag == "SELECT":
-                    try:
-                        f.first.select_option(label=val)
-                    except Exception:
-                        f.first.select_option(value=val)
-                else:
-                    f.first.fill(val)
-                filled = True
-                print(f"  {field_name}: {val} (label '{lbl}')")
-                break
+            if info["tag"] == "SELECT":
+                try:
+                    f.select_option(label=val)
+                except Exception:
+                    f.select_option(value=val)
+            else:
+                f.fill(val)
+            filled = True
+            print(f"  {field_name}: {val} ({'label' if by == 'label' else 'CSS'} '{what}')")
         except Exception:
-            continue
-    if not filled:
-        for sel in css_selectors:
-            try:
-                f = page.locator(sel)
-                if f.count() > 0:
-                    tag = f.first.evaluate("el => el.tagName")
-                    if tag == "SELECT":
-                        try:
-                            f.first.select_option(label=val)
-                        except Exception:
-                            f.first.select_option(value=val)
-                    else:
-                        f.first.fill(val)
-                    filled = True
-                    print(f"  {field_name}: {val} (CSS '{sel}')")
-                    break
-            except Exception:
-                continue
+            pass
     if not filled:
         keywords = [l.lower() for l in labels]
         filled = page.evaluate("""({val, keywords}) => {
@@ -472,9 +520,30 @@ def fill_field(page, value, labels, css_selectors, field_name):
     return filled
 
 
+def _counter_plus_by_template(page, label_text):
+    """Centro del "+" (template matching) più vicino all'etichetta del contatore."""
+    if not cu_templates.available():
+        return None
+    try:
+        box = page.get_by_text(label_text, exact=True).first.bounding_box(timeout=2000)
+    except Exception:
+        box = None
+    if not box:
+        return None
+    label_y = box["y"] + box["height"] / 2
+    hits = [h for h in cu_templates.locate(page, "piu")
+            if h[0] > box["x"] and abs(h[1] - label_y) < 40]
+    if not hits:
+        return None
+    x, y, _score = min(hits, key=lambda h: abs(h[1] - label_y))
+    print(f"  [template] {label_text}: + trovato a ({x:.0f},{y:.0f})")
+    return x, y
+
+
 def click_room_counter(page, label_text, clicks):
     if clicks <= 0:
         return True
+    value = None
     for click_idx in range(clicks):
         btn_info = page.evaluate("""(label) => {
             function findCounterRow(startEl) {
@@ -516,25 +585,38 @@ def click_room_counter(page, label_text, clicks):
             return {found: false};
         }""", label_text)
         if not btn_info.get("found"):
-            print(f"  [WARN] {label_text}: + button non trovato")
-            return False
-        page.mouse.click(btn_info["x"], btn_info["y"])
-        page.wait_for_timeout(250)
+            # Ultima spiaggia: il "+" a vista sulla stessa riga dell'etichetta
+            point = _counter_plus_by_template(page, label_text)
+            if point is None:
+                print(f"  [WARN] {label_text}: + button non trovato")
+                return False
+            btn_info = {"x": point[0], "y": point[1]}
+        plus = (btn_info["x"], btn_info["y"])
+        if click_idx == 0:
+            value = page_wait.counter_value(page, plus)
+        page.mouse.click(*plus)
+        if value is not None:
+            value += 1
+        page_wait.until_counter(page, plus, value)
     print(f"  {label_text}: +{clicks} click completati")
     return True
 
 
 def login(page):
     print("Login CaseVacanza.it...")
+    page_locate.current_step = "login"
+    if session_vault.restore_session(page, EMAIL):
+        step_done(page, "dopo_login")
+        return
     page.goto("https://my.casevacanza.it", timeout=60_000)
     page.wait_for_load_state("domcontentloaded")
-    page.wait_for_timeout(2000)
+    page_wait.until_idle(page, max_ms=5000)
     screenshot(page, "login_page")
     try:
         ok_btn = page.locator("button", has_text="Ok")
         if ok_btn.count() > 0 and ok_btn.first.is_visible():
             ok_btn.first.click()
-            page.wait_for_timeout(500)
+            page_wait.until_hidden(ok_btn.first, max_ms=1000)
     except Exception:
         pass
     login_frame = page
@@ -551,38 +633,32 @@ def login(page):
         login_frame.wait_for_selector(INPUT_SELECTOR, timeout=30_000)
     except Exception:
         raise RuntimeError("Campi login non trovati")
-    page.wait_for_timeout(1000)
-    email_field = None
-    for sel in ["#username", "#email", "input[name='username']", "input[type='email']", "input[type='text']"]:
-        loc = login_frame.locator(sel)
-        if loc.count() > 0:
-            email_field = loc.first
-            break
+    page_wait.until_quiet(page, quiet_ms=200, max_ms=2000)
+    email_field = page_locate.locate(login_frame, [("css", c) for c in [
+        "#username", "#email", "input[name='username']", "input[type='email']", "input[type='text']",
+    ]], field="email")
     if email_field is None:
         raise RuntimeError("Campo email non trovato")
     email_field.fill(EMAIL)
-    pw_field = None
-    for sel in ["#password", "input[name='password']", "input[type='password']"]:
-        loc = login_frame.locator(sel)
-        if loc.count() > 0:
-            pw_field = loc.first
-            break
+    pw_field = page_locate.locate(login_frame, [("css", c) for c in [
+        "#password", "input[name='password']", "input[type='password']",
+    ]], field="password")
     if pw_field is None:
         raise RuntimeError("Campo password non trovato")
     pw_field.fill(PASSWORD)
     screenshot(page, "login_credenziali")
-    login_btn = None
-    for sel in ["#kc-login", "button[type='submit']", "input[type='submit']"]:
-        loc = login_frame.locator(sel)
-        if loc.count() > 0:
-            login_btn = loc.first
-            break
+    login_btn = page_locate.locate(login_frame, [("css", c) for c in [
+        "#kc-login", "button[type='submit']", "input[type='submit']",
+    ]], field="login")
     if login_btn is None:
         raise RuntimeError("Bottone login non trovato")
+    url_before = page.url
     login_btn.click()
-    page.wait_for_load_state("domcontentloaded")
-    page.wait_for_timeout(3000)
+    # Redirect dal form di login alla dashboard, poi le sue chiamate API
+    page_wait.until_changed(page, url_before, max_ms=15_000)
+    page_wait.until_idle(page, max_ms=5000)
     step_done(page, "dopo_login")
+    session_vault.save(page.context, EMAIL)
     print("Login effettuato.")
 
 
@@ -591,7 +667,7 @@ def navigate_to_add_property(page):
     page.goto("https://my.casevacanza.it/listing/add-property", timeout=30_000)
     page.wait_for_load_state("domcontentloaded")
     dismiss_overlay(page)
-    page.wait_for_timeout(1500)
+    page_wait.until_idle(page, max_ms=5000)
     step_done(page, "pagina_iniziale")
     print("Pagina wizard raggiunta.")
 
@@ -605,7 +681,7 @@ def insert_property(page):
 
     def do_step1():
         dismiss_cookie(page)
-        page.wait_for_timeout(500)
+        page_wait.until_quiet(page, max_ms=1000)
         single = page.locator('[data-test="single"]')
         if single.count() > 0:
             single.click(force=True)
@@ -645,21 +721,21 @@ def insert_property(page):
     def do_step5():
         page.get_by_text("Inseriscilo manualmente").click()
         page.wait_for_load_state("domcontentloaded")
-        page.wait_for_timeout(400)
+        page_wait.until_visible(page.locator('[data-test="stateOrProvince"]'), max_ms=10_000)
         ident = PROP["identificativi"]
         addr_parts = ident["indirizzo"].rsplit(" ", 1)
         via = addr_parts[0] if len(addr_parts) > 1 else ident["indirizzo"]
         civico = addr_parts[1] if len(addr_parts) > 1 else ""
         page.locator('[data-test="stateOrProvince"]').fill(ident["regione"])
-        page.wait_for_timeout(200)
+        page_wait.until_quiet(page, max_ms=1000)
         page.locator('[data-test="city"]').fill(ident["comune"])
-        page.wait_for_timeout(200)
+        page_wait.until_quiet(page, max_ms=1000)
         page.locator('[data-test="street"]').fill(via)
-        page.wait_for_timeout(200)
+        page_wait.until_quiet(page, max_ms=1000)
         page.locator('[data-test="houseNumberOrName"]').fill(civico)
-        page.wait_for_timeout(200)
+        page_wait.until_quiet(page, max_ms=1000)
         page.locator('[data-test="postalCode"]').fill(ident["cap"])
-        page.wait_for_timeout(200)
+        page_wait.until_quiet(page, max_ms=1000)
         step_done(page, "indirizzo_compilato")
 
     try_step(page, "step5_indirizzo", do_step5)
@@ -675,23 +751,26 @@ def insert_property(page):
     def do_step8():
         screenshot(page, "step8_BEFORE_clicks")
         dismiss_cookie(page)
-        page.wait_for_timeout(500)
+        page_wait.until_quiet(page, max_ms=1000)
         add = page.locator('[data-test="counter-add-btn"]')
         guest_add = page.locator('[data-test="guest-count"] [data-test="counter-add-btn"]')
-        for _ in range(max(0, ospiti - 1)):
-            guest_add.click()
-            page.wait_for_timeout(300)
+
+        def click_counter(plus, clicks):
+            # Ogni click aspetta che il contatore salga, non una pausa fissa
+            value = page_wait.counter_value(page, plus) if clicks > 0 else None
+            for _ in range(clicks):
+                plus.click()
+                if value is not None:
+                    value += 1
+                page_wait.until_counter(page, plus, value)
+
+        click_counter(guest_add, max(0, ospiti - 1))
         print(f"  Ospiti → {ospiti}")
-        for _ in range(max(0, camere - 1)):
-            add.nth(1).click()
-            page.wait_for_timeout(300)
+        click_counter(add.nth(1), max(0, camere - 1))
         print(f"  Camere → {camere}")
-        for _ in range(max(0, bagni)):
-            add.nth(3).click()
-            page.wait_for_timeout(300)
+        click_counter(add.nth(3), max(0, bagni))
         print(f"  Bagni → {bagni}")
-        add.nth(4).click()
-        page.wait_for_timeout(300)
+        click_counter(add.nth(4), 1)
         print("  Cucina → 1")
         try:
             bambini_cb = page.locator('[data-test="children-allowed"]')
@@ -707,7 +786,7 @@ def insert_property(page):
 
     def do_step10():
         dismiss_cookie(page)
-        page.wait_for_timeout(500)
+        page_wait.until_quiet(page, max_ms=1000)
         letti = comp.get("letti", [])
         if not letti:
             print("  Nessun dato letti nel JSON, skip")
@@ -783,12 +862,12 @@ def insert_property(page):
                 cnt = expand_btns.count()
                 if cnt > room_idx:
                     expand_btns.nth(room_idx).click()
-                    page.wait_for_timeout(800)
+                    page_wait.until_quiet(page, max_ms=2000)
                     print(f"    Camera {room_idx + 1}: espansa")
                 elif cnt > 0:
                     # Fallback: clicca l'ultima espansione disponibile
                     expand_btns.last.click()
-                    page.wait_for_timeout(800)
+                    page_wait.until_quiet(page, max_ms=2000)
                     print(f"    Camera {room_idx + 1}: espansa (fallback)")
             except Exception as e:
                 print(f"    [WARN] Espansione camera {room_idx + 1} fallita: {e}")
@@ -808,9 +887,11 @@ def insert_property(page):
             start_value = initial.get("value") or 0
             print(f"    Trovato '{label}' (valore iniziale: {start_value})")
 
+            plus = (initial["x"], initial["y"])
             for i in range(quantita):
-                page.mouse.click(initial["x"], initial["y"])
-                page.wait_for_timeout(350)
+                page.mouse.click(*plus)
+                expected = start_value + i + 1 if initial.get("value") is not None else None
+                page_wait.until_counter(page, plus, expected)
 
             # Verifica post-click: il counter deve essere salito di `quantita`
             final = locate_letto_counter(label)
@@ -867,27 +948,10 @@ def insert_property(page):
         if not photo_paths:
             step_done(page, "foto_skip")
             return
-        uploaded = False
-        try:
-            with page.expect_file_chooser(timeout=5000) as fc_info:
-                btn = page.get_by_text("Carica foto")
-                if btn.count() > 0:
-                    btn.first.click()
-            fc_info.value.set_files(photo_paths)
-            uploaded = True
-            print(f"  Upload {len(photo_paths)} foto via file chooser")
-        except Exception as e:
-            print(f"  File chooser fallito: {e}")
-        if not uploaded:
-            try:
-                fi = page.locator("input[type='file']")
-                if fi.count() > 0:
-                    fi.set_input_files(photo_paths)
-                    uploaded = True
-            except Exception:
-                pass
+        uploaded = casevacanza_photos.upload_photos(page, photo_paths)
         if uploaded:
-            page.wait_for_timeout(6000)
+            # Un POST per foto più le anteprime: si aspetta che finiscano tutti
+            page_wait.until_idle(page, quiet_ms=800, max_ms=60_000)
         step_done(page, "foto_caricate" if uploaded else "foto_skip")
 
     try_step(page, "step12_foto", do_step12)
@@ -898,46 +962,21 @@ def insert_property(page):
             tab = page.get_by_text("Tutti", exact=True)
             if tab.count() > 0:
                 tab.first.click()
-                page.wait_for_timeout(800)
+                page_wait.until_quiet(page, max_ms=2000)
         except Exception:
             pass
-        for servizio in SERVIZI:
-            selected = False
-            for strategy in [
-                lambda s: page.get_by_role("checkbox", name=s, exact=True),
-                lambda s: page.get_by_role("checkbox", name=s, exact=False),
-                lambda s: page.get_by_label(s, exact=True),
-            ]:
-                try:
-                    cb = strategy(servizio)
-                    if cb.count() > 0:
-                        cb.first.check()
-                        page.wait_for_timeout(200)
-                        print(f"  [OK] {servizio}")
-                        selected = True
-                        break
-                except Exception:
-                    continue
-            if not selected:
-                try:
-                    result = page.evaluate("""(label) => {
-                        const checkboxes = document.querySelectorAll('input[type="checkbox"], [role="checkbox"]');
-                        for (const cb of checkboxes) {
-                            const container = cb.closest('label') || cb.parentElement?.parentElement;
-                            if ((container?.textContent || '').includes(label)) {
-                                cb.click();
-                                return true;
-                            }
-                        }
-                        return false;
-                    }""", servizio)
-                    if result:
-                        selected = True
-                        print(f"  [OK] {servizio} (JS)")
-                except Exception:
-                    pass
-            if not selected:
-                print(f"  [MISS] {servizio}")
+        # Tutte le dotazioni in un solo evaluate, con verifica dello stato
+        report = amenity_select.select(page, SERVIZI)
+        for r in report:
+            if r["status"] == "ok":
+                print(f"  [OK] {r['label']}" + ("" if r["via"] == "exact" else f" ({r['via']})"))
+            elif r["status"] == "already":
+                print(f"  [OK] {r['label']} (già attivo)")
+            elif r["status"] == "unchecked":
+                print(f"  [WARN] {r['label']}: cliccato ma non risulta selezionato")
+            else:
+                print(f"  [MISS] {r['label']}")
+        print(f"  {amenity_select.summary(report)}")
         step_done(page, "servizi_selezionati")
 
     try_step(page, "step14_servizi", do_step14)
@@ -953,18 +992,19 @@ def insert_property(page):
     def do_step17():
         titolo = PROP.get("marketing", {}).get("titolo") or PROP["identificativi"]["nome_struttura"]
         descrizione = PROP["marketing"]["descrizione_lunga"]
-        titolo_field = page.get_by_label("Titolo")
-        if titolo_field.count() > 0:
-            titolo_field.fill(titolo)
-        else:
-            page.locator("input[name*='titolo'], input[name*='title'], input[placeholder*='Titolo']").first.fill(titolo)
-        page.wait_for_timeout(200)
-        desc_field = page.get_by_label("Descrizione")
-        if desc_field.count() > 0:
-            desc_field.fill(descrizione)
-        else:
-            page.locator("textarea").first.fill(descrizione)
-        page.wait_for_timeout(200)
+        titolo_field = page_locate.locate(page, [
+            ("label", "Titolo"),
+            ("css", "input[name*='titolo'], input[name*='title'], input[placeholder*='Titolo']"),
+        ], field="titolo")
+        if titolo_field is None:
+            raise RuntimeError("Campo titolo non trovato")
+        titolo_field.fill(titolo)
+        page_wait.until_quiet(page, max_ms=500)
+        desc_field = page_locate.locate(page, [("label", "Descrizione"), ("css", "textarea")], field="descrizione")
+        if desc_field is None:
+            raise RuntimeError("Campo descrizione non trovato")
+        desc_field.fill(descrizione)
+        page_wait.until_quiet(page, max_ms=500)
         step_done(page, "titolo_descrizione")
 
     try_step(page, "step17_titolo_desc", do_step17)
@@ -980,30 +1020,23 @@ def insert_property(page):
                 page.get_by_text("Impostiamo il prezzo", exact=False).wait_for(timeout=8000)
             except Exception:
                 pass
-            page.wait_for_timeout(800)
-            for ph in ["Prezzo per notte", "€ Prezzo per notte", "Prezzo", "notte"]:
+            page_wait.until_quiet(page, quiet_ms=200, max_ms=2000)
+            # Placeholder noti, poi il primo input testuale visibile
+            hit = page_locate.resolve(page, [
+                ("placeholder", "Prezzo per notte"), ("placeholder", "€ Prezzo per notte"),
+                ("placeholder", "Prezzo"), ("placeholder", "notte"),
+                ("css", "input[type='text'], input[type='number'], input[type='tel'], input:not([type])"),
+            ], field="prezzo")
+            if hit:
+                f, (by, _), _ = hit
                 try:
-                    f = page.get_by_placeholder(ph, exact=False)
-                    if f.count() > 0:
-                        f.first.scroll_into_view_if_needed()
-                        f.first.click()
-                        page.wait_for_timeout(200)
-                        f.first.fill(prezzo_str)
-                        filled = True
-                        print(f"  Prezzo: {prezzo_str} EUR/notte")
-                        break
-                except Exception:
-                    continue
-            if not filled:
-                try:
-                    visible_inputs = page.locator("input:visible").all()
-                    for inp in visible_inputs:
-                        inp_type = inp.get_attribute("type") or "text"
-                        if inp_type in ("text", "number", "tel", ""):
-                            inp.fill(prezzo_str)
-                            filled = True
-                            print(f"  Prezzo: {prezzo_str} EUR/notte (visible input)")
-                            break
+                    f.scroll_into_view_if_needed()
+                    f.click()
+                    page_wait.until_quiet(page, max_ms=500)
+                    f.fill(prezzo_str)
+                    filled = True
+                    suffix = "" if by == "placeholder" else " (visible input)"
+                    print(f"  Prezzo: {prezzo_str} EUR/notte{suffix}")
                 except Exception:
                     pass
             if not filled:
@@ -1017,28 +1050,22 @@ def insert_property(page):
                 return
             amount = match.group(1)
             try:
-                btn = page.get_by_text(button_label, exact=False)
-                if btn.count() > 0:
-                    btn.first.click()
-                    page.wait_for_timeout(800)
-                    for ph in ["Prezzo", "Costo", "Importo", "EUR", "€", "0"]:
-                        try:
-                            f = page.get_by_placeholder(ph, exact=False)
-                            if f.count() > 0:
-                                f.last.fill(amount)
-                                break
-                        except Exception:
-                            continue
-                    for confirm_text in ["Salva", "Conferma", "Aggiungi", "OK", "Ok"]:
-                        try:
-                            confirm = page.get_by_role("button", name=confirm_text)
-                            if confirm.count() > 0 and confirm.last.is_visible():
-                                confirm.last.click()
-                                page.wait_for_timeout(1500)
-                                print(f"  {button_label}: €{amount} aggiunto")
-                                break
-                        except Exception:
-                            continue
+                btn = page_locate.locate(page, [("text", button_label)])
+                if btn is not None:
+                    btn.click()
+                    page_wait.until_quiet(page, max_ms=2000)
+                    f = page_locate.locate(page, [("placeholder", ph) for ph in
+                                                  ["Prezzo", "Costo", "Importo", "EUR", "€", "0"]],
+                                           last=True, field="extra_importo")
+                    if f is not None:
+                        f.fill(amount)
+                    confirm = page_locate.locate(page, [("button", t) for t in
+                                                        ["Salva", "Conferma", "Aggiungi", "OK", "Ok"]],
+                                                 last=True, field="extra_conferma")
+                    if confirm is not None:
+                        confirm.click()
+                        page_wait.until_idle(page, max_ms=5000)
+                        print(f"  {button_label}: €{amount} aggiunto")
                     dismiss_overlay(page)
             except Exception as e:
                 print(f"  [WARN] Extra cost '{button_label}': {e}")
@@ -1048,10 +1075,10 @@ def insert_property(page):
         add_extra_cost("Biancheria da letto", cond.get("lenzuola"))
 
         try:
-            modifica_btn = page.get_by_text("Modifica", exact=False)
-            if modifica_btn.count() > 0 and modifica_btn.first.is_visible():
-                modifica_btn.first.click()
-                page.wait_for_timeout(1500)
+            modifica_btn = page_locate.locate(page, [("text", "Modifica")])
+            if modifica_btn is not None:
+                modifica_btn.click()
+                page_wait.until_idle(page, max_ms=5000)
                 sog_bassa = cond.get("soggiorno_minimo_bassa", {})
                 notti = str(sog_bassa.get("notti", ""))
                 if notti:
@@ -1065,15 +1092,12 @@ def insert_property(page):
                 if check_out_raw:
                     fill_field(page, check_out_raw, ["Check-out", "Check out"],
                                ["select[name*='check_out']", "select[name*='checkout']"], "Check-out")
-                for save_text in ["Salva", "Conferma", "Save", "OK"]:
-                    try:
-                        save_btn = page.get_by_role("button", name=save_text)
-                        if save_btn.count() > 0 and save_btn.last.is_visible():
-                            save_btn.last.click()
-                            page.wait_for_timeout(800)
-                            break
-                    except Exception:
-                        continue
+                save_btn = page_locate.locate(page, [("button", t) for t in
+                                                     ["Salva", "Conferma", "Save", "OK"]],
+                                              last=True, field="impostazioni_salva")
+                if save_btn is not None:
+                    save_btn.click()
+                    page_wait.until_idle(page, max_ms=5000)
                 dismiss_overlay(page)
         except Exception as e:
             print(f"  [WARN] Impostazioni predefinite: {e}")
@@ -1102,24 +1126,22 @@ def insert_property(page):
 
             # Clicca Aggiungi prezzo stagionale
             clicked = False
-            for btn_text in ["Aggiungi prezzo stagionale", "Aggiungi stagione", "Aggiungi prezzo"]:
+            btn = page_locate.locate(page, [("text", t) for t in
+                                            ["Aggiungi prezzo stagionale", "Aggiungi stagione", "Aggiungi prezzo"]],
+                                     field="aggiungi_stagione")
+            if btn is not None:
                 try:
-                    btn = page.get_by_text(btn_text, exact=False)
-                    if btn.count() > 0 and btn.first.is_visible():
-                        btn.first.click()
-                        page.wait_for_timeout(1000)
-                        clicked = True
-                        break
+                    btn.click()
+                    page_wait.until_quiet(page, quiet_ms=200, max_ms=3000)
+                    clicked = True
                 except Exception:
-                    continue
+                    pass
 
             if not clicked:
                 print(f"  [WARN] Bottone aggiungi stagione non trovato")
                 continue
 
             # Compila date con date picker
-            page.wait_for_timeout(500)
-
             # Data inizio — cerca dropdown/input Da
             try:
                 da_input = page.locator("[data-test='season-start-date']")
@@ -1145,33 +1167,30 @@ def insert_property(page):
 
             # Prezzo per notte
             try:
-                for ph in ["Prezzo per notte", "Prezzo", "notte"]:
-                    f = page.get_by_placeholder(ph, exact=False)
-                    if f.count() > 0:
-                        f.last.fill(prezzo)
-                        print(f"    Prezzo: €{prezzo}")
-                        break
-                else:
-                    # Fallback: input number visibile
-                    num_inputs = page.locator("input[type='number']")
-                    if num_inputs.count() > 0:
-                        num_inputs.last.fill(prezzo)
-                        print(f"    Prezzo: €{prezzo} (number input)")
+                # Placeholder noti, poi l'ultimo input number (fallback)
+                hit = page_locate.resolve(page, [
+                    ("placeholder", "Prezzo per notte"), ("placeholder", "Prezzo"),
+                    ("placeholder", "notte"), ("css", "input[type='number']"),
+                ], last=True, field="prezzo_stagione")
+                if hit:
+                    f, (by, _), _ = hit
+                    f.fill(prezzo)
+                    print(f"    Prezzo: €{prezzo}" + ("" if by == "placeholder" else " (number input)"))
             except Exception as e:
                 print(f"    [WARN] Prezzo stagione: {e}")
 
             # Salva stagione
-            page.wait_for_timeout(300)
-            for save_text in ["Salva", "Conferma", "Aggiungi", "OK"]:
+            page_wait.until_quiet(page, max_ms=1000)
+            save_btn = page_locate.locate(page, [("button", t) for t in
+                                                 ["Salva", "Conferma", "Aggiungi", "OK"]],
+                                          last=True, field="salva_stagione")
+            if save_btn is not None:
                 try:
-                    save_btn = page.get_by_role("button", name=save_text)
-                    if save_btn.count() > 0 and save_btn.last.is_visible():
-                        save_btn.last.click()
-                        page.wait_for_timeout(1000)
-                        print(f"    Stagione {i+1} salvata")
-                        break
+                    save_btn.click()
+                    page_wait.until_idle(page, max_ms=5000)
+                    print(f"    Stagione {i+1} salvata")
                 except Exception:
-                    continue
+                    pass
 
         step_done(page, "stagioni_wizard")
 
@@ -1180,29 +1199,29 @@ def insert_property(page):
     def do_step26():
         ical_url = PROP.get("condizioni", {}).get("ical_url")
         if ical_url:
-            for radio_text in ["Si, utilizzo altre piattaforme", "Sì, utilizzo altre piattaforme", "utilizzo altre piattaforme"]:
+            radio = page_locate.locate(page, [("text", t) for t in [
+                "Si, utilizzo altre piattaforme", "Sì, utilizzo altre piattaforme", "utilizzo altre piattaforme",
+            ]], field="altre_piattaforme")
+            if radio is not None:
                 try:
-                    radio = page.get_by_text(radio_text, exact=False)
-                    if radio.count() > 0:
-                        radio.first.click()
-                        page.wait_for_timeout(800)
-                        break
+                    radio.click()
+                    page_wait.until_quiet(page, max_ms=2000)
                 except Exception:
-                    continue
-            for sel in ["input[type='url']", "input[name*='ical']", "input[type='text']"]:
+                    pass
+            f = page_locate.locate(page, [("css", c) for c in
+                                          ["input[type='url']", "input[name*='ical']", "input[type='text']"]],
+                                   last=True, field="ical")
+            if f is not None:
                 try:
-                    f = page.locator(sel)
-                    if f.count() > 0:
-                        f.last.fill(ical_url)
-                        break
+                    f.fill(ical_url)
                 except Exception:
-                    continue
+                    pass
         else:
             try:
                 radio = page.get_by_text("No, gestisco solo le prenotazioni qui", exact=False)
                 if radio.count() > 0:
                     radio.first.click()
-                    page.wait_for_timeout(400)
+                    page_wait.until_quiet(page, max_ms=1000)
             except Exception:
                 pass
         step_done(page, "dopo_calendario")
@@ -1216,26 +1235,18 @@ def insert_property(page):
         if not cin and not cir:
             step_done(page, "dopo_requisiti_skip")
             return
-        if cin:
-            for ph in ["Inserisci il numero CIN", "CIN", "numero CIN"]:
-                try:
-                    f = page.get_by_placeholder(ph, exact=False)
-                    if f.count() > 0:
-                        f.first.fill(cin)
-                        print(f"  CIN: {cin}")
-                        break
-                except Exception:
-                    continue
-        if cir:
-            for ph in ["Inserisci il numero CIR", "CIR", "numero CIR"]:
+        for name, code in (("CIN", cin), ("CIR", cir)):
+            if not code:
+                continue
+            f = page_locate.locate(page, [("placeholder", ph) for ph in
+                                          [f"Inserisci il numero {name}", name, f"numero {name}"]],
+                                   field=name.lower())
+            if f is not None:
                 try:
-                    f = page.get_by_placeholder(ph, exact=False)
-                    if f.count() > 0:
-                        f.first.fill(cir)
-                        print(f"  CIR: {cir}")
-                        break
+                    f.fill(code)
+                    print(f"  {name}: {code}")
                 except Exception:
-                    continue
+                    pass
         step_done(page, "dopo_requisiti")
 
     try_step(page, "step27_requisiti", do_step27)
@@ -1243,7 +1254,7 @@ def insert_property(page):
 
     print("\nStep 28: Pagina finale")
     page.wait_for_load_state("domcontentloaded")
-    page.wait_for_timeout(400)
+    page_wait.until_idle(page, max_ms=5000)
     step_done(page, "pagina_finale")
     print("Flusso completato!")
 
@@ -1258,7 +1269,7 @@ def add_seasonal_prices(page):
         print(f"  {s['da']} → {s['a']}: €{s['prezzo_notte']}/notte")
     page.goto("https://my.casevacanza.it/listing/properties", timeout=30_000)
     page.wait_for_load_state("domcontentloaded")
-    page.wait_for_timeout(1500)
+    page_wait.until_idle(page, max_ms=5000)
     step_done(page, "lista_proprietà")
     nome = PROP["identificativi"]["nome_struttura"]
     found = False
@@ -1267,7 +1278,7 @@ def add_seasonal_prices(page):
         if link.count() > 0:
             link.first.click()
             page.wait_for_load_state("domcontentloaded")
-            page.wait_for_timeout(800)
+            page_wait.until_idle(page, max_ms=5000)
             found = True
     except Exception:
         pass
@@ -1275,41 +1286,40 @@ def add_seasonal_prices(page):
         print("  Proprietà non trovata — skip tariffe stagionali")
         step_done(page, "proprietà_non_trovata")
         return
-    for tab_text in ["Tariffe e disponibilità", "Tariffe", "Prezzi"]:
+    page_locate.current_step = "tariffe_stagionali"
+    tab = page_locate.locate(page, [("text", t) for t in ["Tariffe e disponibilità", "Tariffe", "Prezzi"]],
+                             field="tab_tariffe")
+    if tab is not None:
         try:
-            tab = page.get_by_text(tab_text, exact=False)
-            if tab.count() > 0:
-                tab.first.click()
-                page.wait_for_load_state("domcontentloaded")
-                page.wait_for_timeout(800)
-                break
+            tab.click()
+            page.wait_for_load_state("domcontentloaded")
+            page_wait.until_idle(page, max_ms=5000)
         except Exception:
-            continue
+            pass
     for i, season in enumerate(seasons):
         da_date = _parse_date_it(season["da"])
         a_date = _parse_date_it(season["a"])
         print(f"  Stagione {i+1}: {da_date} → {a_date} = €{season['prezzo_notte']}")
-        for btn_text in ["Aggiungi prezzo stagionale", "Aggiungi stagione", "Aggiungi prezzo"]:
+        btn = page_locate.locate(page, [("text", t) for t in
+                                        ["Aggiungi prezzo stagionale", "Aggiungi stagione", "Aggiungi prezzo"]],
+                                 field="aggiungi_stagione")
+        if btn is not None:
             try:
-                btn = page.get_by_text(btn_text, exact=False)
-                if btn.count() > 0:
-                    btn.first.click()
-                    page.wait_for_timeout(800)
-                    break
+                btn.click()
+                page_wait.until_quiet(page, quiet_ms=200, max_ms=2000)
             except Exception:
-                continue
+                pass
         fill_field(page, da_date, ["Da", "Dal", "Data inizio"], [], f"Data inizio {i+1}")
         fill_field(page, a_date, ["A", "Al", "Data fine"], [], f"Data fine {i+1}")
         fill_field(page, str(season["prezzo_notte"]), ["Prezzo", "Prezzo a notte"], ["input[type='number']"], f"Prezzo {i+1}")
-        for save_text in ["Salva", "Conferma", "Aggiungi", "OK"]:
+        save_btn = page_locate.locate(page, [("button", t) for t in ["Salva", "Conferma", "Aggiungi", "OK"]],
+                                      field="salva_stagione")
+        if save_btn is not None:
             try:
-                save_btn = page.get_by_role("button", name=save_text)
-                if save_btn.count() > 0:
-                    save_btn.first.click()
-                    page.wait_for_timeout(800)
-                    break
+                save_btn.click()
+                page_wait.until_idle(page, max_ms=5000)
             except Exception:
-                continue
+                pass
     print(f"Tariffe stagionali completate")
 
 
@@ -1317,9 +1327,10 @@ def main():
     os.makedirs(SCREENSHOT_DIR, exist_ok=True)
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
-        context = browser.new_context(user_agent=USER_AGENT)
+        context = session_vault.new_context(browser, EMAIL, user_agent=USER_AGENT)
         page = context.new_page()
         page.set_default_timeout(30_000)
+        page_wait.track(page)
         try:
             login(page)
             navigate_to_add_property(page)
@@ -1332,8 +1343,8 @@ def main():
                     step_errors.append(("tariffe_stagionali", str(e)))
         finally:
             try:
-                screenshot(page, "final_state")
-                save_html(page, "final_state")
+                # sys.exc_info() è valorizzato se usciamo per un'eccezione
+                final_state(page, failed=sys.exc_info()[0] is not None)
             except Exception:
                 pass
             if step_errors:
@@ -1342,6 +1353,14 @@ def main():
                     print(f"  - {name}: {err}")
             else:
                 print("\nTutti gli step completati con successo!")
+            if cu_templates.summary():
+                print(cu_templates.summary())
+            if page_wait.summary():
+                print(page_wait.summary())
+            if diagnostics_summary():
+                print(diagnostics_summary())
+            if page_locate.summary():
+                print(page_locate.summary())
             context.close()
             browser.close()
 
@@ -0,0 +1,137 @@
+"""Osservazione testuale della pagina per l'agente Computer Use.
+
+Accanto a ogni screenshot l'agente riceve l'elenco compatto degli elementi
+interattivi visibili (id, ruolo, etichetta, valore, box), estratto in un solo
+`page.evaluate` come fa explore_wizard.extract_form_elements. Con l'azione
+`click_element(id)` il modello clicca un elemento per id invece di stimare le
+coordinate dai pixel: il box viene risolto in locale al momento del click.
+
+Gli id vengono scritti nel DOM come attributo `data-cu-id`, così un click
+successivo ritrova l'elemento anche se nel frattempo la pagina è scrollata.
+"""
+
+from __future__ import annotations
+
+_SELECTOR = (
+    "input, select, textarea, button, a[href], [role='button'], [role='checkbox'], "
+    "[role='switch'], [role='radio'], [role='tab'], [role='option'], [role='combobox'], "
+    "[role='menuitem'], [role='link'], [contenteditable='true']"
+)
+
+_ELEMENTS_JS = """([selector, scale, maxElements]) => {
+    document.querySelectorAll('[data-cu-id]').forEach(el => el.removeAttribute('data-cu-id'));
+    const vw = window.innerWidth, vh = window.innerHeight;
+    const kept = new Set();
+    const out = [];
+
+    const labelOf = (el) => {
+        const aria = el.getAttribute('aria-label');
+        if (aria) return aria;
+        const by = el.getAttribute('aria-labelledby');
+        if (by) {
+            const txt = by.split(' ').map(id => (document.getElementById(id) || {}).textContent || '').join(' ').trim();
+            if (txt) return txt;
+        }
+        if (el.id) {
+            const lbl = document.querySelector('label[for="' + CSS.escape(el.id) + '"]');
+            if (lbl && lbl.textContent.trim()) return lbl.textContent;
+        }
+        const closest = el.closest('label');
+        if (closest && closest.textContent.trim()) return closest.textContent;
+        if (el.placeholder) return el.placeholder;
+        const text = el.tagName === 'SELECT' ? '' : (el.innerText || el.textContent || '');
+        if (text.trim()) return text;
+        return el.title || el.name || el.getAttribute('data-test') || '';
+    };
+
+    const roleOf = (el) => {
+        const role = el.getAttribute('role');
+        if (role) return role;
+        const tag = el.tagName.toLowerCase();
+        if (tag === 'input') {
+            const t = (el.type || 'text').toLowerCase();
+            if (t === 'checkbox' || t === 'radio') return t;
+            if (t === 'submit' || t === 'button') return 'button';
+            return 'textbox(' + t + ')';
+        }
+        if (tag === 'a') return 'link';
+        if (tag === 'textarea' || el.isContentEditable) return 'textbox';
+        return tag;
+    };
+
+    const valueOf = (el) => {
+        if (el.type === 'password') return el.value ? '***' : '';
+        if (el.type === 'checkbox' || el.type === 'radio') return String(el.checked);
+        const aria = el.getAttribute('aria-checked') || el.getAttribute('aria-selected') || el.getAttribute('aria-pressed');
+        if (aria) return aria;
+        if (el.tagName === 'SELECT') return (el.selectedOptions[0] || {}).text || '';
+        if ('value' in el && el.tagName !== 'BUTTON') return String(el.value || '');
+        return null;
+    };
+
+    for (const el of document.querySelectorAll(selector)) {
+        if (out.length >= maxElements) break;
+        const isField = ['INPUT', 'SELECT', 'TEXTAREA'].includes(el.tagName);
+        // Elemento dentro un altro già elencato (es. span in un button): basta il contenitore
+        let parent = el.parentElement && el.parentElement.closest(selector);
+        if (!isField && parent && kept.has(parent)) continue;
+        if (el.disabled || (el.type || '') === 'hidden') continue;
+        const r = el.getBoundingClientRect();
+        if (r.width < 1 || r.height < 1 || r.bottom < 0 || r.right < 0 || r.top > vh || r.left > vw) continue;
+        const style = getComputedStyle(el);
+        if (style.visibility === 'hidden' || style.display === 'none') continue;
+        // Coperto da un overlay/modal? Conta ciò che sta davvero sotto il centro
+        const cx = Math.min(Math.max(r.left + r.width / 2, 0), vw - 1);
+        const cy = Math.min(Math.max(r.top + r.height / 2, 0), vh - 1);
+        const hit = document.elementFromPoint(cx, cy);
+        const hitLabel = hit && hit.closest('label');
+        if (!hit || !(el.contains(hit) || hit.contains(el) || (hitLabel && hitLabel.contains(el)))) continue;
+
+        kept.add(el);
+        const id = out.length + 1;
+        el.setAttribute('data-cu-id', String(id));
+        out.push({
+            id,
+            role: roleOf(el),
+            label: labelOf(el).replace(/\\s+/g, ' ').trim().substring(0, 80),
+            value: valueOf(el),
+            box: [Math.round(r.left * scale), Math.round(r.top * scale),
+                  Math.round(r.width * scale), Math.round(r.height * scale)],
+        });
+    }
+    return out;
+}"""
+
+
+def snapshot(page, scale: float, max_elements: int) -> list[dict]:
+    """Elementi interattivi visibili nel viewport. `scale` porta i box nello
+    spazio di coordinate del modello (MODEL_W / SCREEN_W)."""
+    return page.evaluate(_ELEMENTS_JS, [_SELECTOR, scale, max_elements])
+
+
+def format_elements(elements: list[dict]) -> str:
+    """Una riga per elemento: [id] ruolo "etichetta" = valore @ centro (l×a)."""
+    if not elements:
+        return "[elementi interattivi: nessuno visibile]"
+    lines = ["[elementi interattivi visibili — usa click_element(id) per cliccarli]"]
+    for el in elements:
+        x, y, w, h = el["box"]
+        value = f" = {el['value'][:40]!r}" if el.get("value") not in (None, "") else ""
+        lines.append(f"[{el['id']}] {el['role']} \"{el['label']}\"{value} @ ({x + w // 2},{y + h // 2}) {w}x{h}")
+    return "\n".join(lines)
+
+
+def element_center(page, element_id: int, last: dict[int, dict], scale: float) -> tuple[float, float] | None:
+    """Centro dell'elemento in coordinate native: box aggiornato dal DOM se
+    l'elemento c'è ancora, altrimenti quello dell'ultima osservazione."""
+    loc = page.locator(f"[data-cu-id='{int(element_id)}']")
+    if loc.count() == 1:
+        loc.scroll_into_view_if_needed(timeout=2000)
+        box = loc.bounding_box()
+        if box:
+            return box["x"] + box["width"] / 2, box["y"] + box["height"] / 2
+    el = last.get(int(element_id))
+    if el is None:
+        return None
+    x, y, w, h = el["box"]
+    return (x + w / 2) / scale, (y + h / 2) / scale
@@ -0,0 +1,96 @@
+"""Cattura frame via CDP `Page.startScreencast` per l'agente Computer Use.
+
+Ogni `page.screenshot()` è un round trip CDP completo, compresa l'attesa dei
+font che nell'incidente del 05/05/2026 bloccava la cattura. Con lo screencast
+Chromium spinge un JPEG a ogni repaint: teniamo in memoria l'ultimo e
+osservazione, settle e artifact lo leggono già pronto.
+
+Un repaint arriva solo se la pagina cambia. Dopo un'azione (`mark()`)
+`frame()` aspetta un frame nuovo per poco: se non arriva lo schermo è fermo
+(click a vuoto, pagina bloccata) e l'ultimo frame è ancora quello giusto.
+Ritorna None, e il chiamante ripiega su `page.screenshot()` riavviando lo
+screencast, solo se lo screencast si è fermato: nessun frame mai ricevuto, o
+una navigazione del main frame senza frame successivi.
+"""
+
+from __future__ import annotations
+
+import base64
+import time
+
+
+class Screencast:
+    """Ultimo frame JPEG dello screencast di una pagina Playwright (API sync)."""
+
+    def __init__(self, page, width: int, height: int, quality: int):
+        self.page = page
+        self.params = {"format": "jpeg", "quality": quality, "maxWidth": width,
+                       "maxHeight": height, "everyNthFrame": 1}
+        self.data: bytes | None = None
+        self.seq = 0  # frame ricevuti
+        self._mark_seq = 0
+        self._mark_time = 0.0
+        self._navs = 0  # navigazioni del main frame
+        self._mark_navs = 0
+        page.on("framenavigated", self._on_navigated)
+        self.cdp = page.context.new_cdp_session(page)
+        self.cdp.on("Page.screencastFrame", self._on_frame)
+        self.cdp.send("Page.startScreencast", self.params)
+
+    def _on_frame(self, params: dict) -> None:
+        # Senza ack Chromium smette di mandare frame
+        try:
+            self.cdp.send("Page.screencastFrameAck", {"sessionId": params["sessionId"]})
+        except Exception:
+            pass
+        self.data = base64.b64decode(params["data"])
+        self.seq += 1
+
+    def _on_navigated(self, frame) -> None:
+        if frame == self.page.main_frame:
+            self._navs += 1
+
+    def mark(self) -> None:
+        """Da chiamare prima di un'azione: i frame precedenti diventano vecchi."""
+        self._mark_seq = self.seq
+        self._mark_navs = self._navs
+        self._mark_time = time.monotonic()
+
+    def repainted(self) -> bool:
+        """True se dopo mark() è arrivato almeno un frame."""
+        return self.seq > self._mark_seq
+
+    def latest(self) -> bytes | None:
+        """Ultimo frame ricevuto, anche se precedente all'ultima azione (per il settle)."""
+        self.page.wait_for_timeout(1)  # smaltisce gli eventi CDP già arrivati
+        return self.data
+
+    def frame(self, wait_ms: int = 150) -> bytes | None:
+        """Frame dello stato dopo l'ultima azione: un repaint arrivato dopo
+        mark() (aspettato fino a `wait_ms` dall'azione), altrimenti l'ultimo
+        frame, perché lo schermo non è cambiato. None se lo screencast è fermo."""
+        self.page.wait_for_timeout(1)  # smaltisce gli eventi CDP già arrivati
+        deadline = self._mark_time + wait_ms / 1000
+        while not self.repainted() and time.monotonic() < deadline:
+            self.page.wait_for_timeout(20)
+        if self.repainted():
+            return self.data
+        if self.data is None or self._navs > self._mark_navs:
+            return None
+        return self.data
+
+    def restart(self) -> None:
+        try:
+            self.cdp.send("Page.stopScreencast")
+            self.cdp.send("Page.startScreencast", self.params)
+        except Exception as exc:
+            print(f"  [WARN] Riavvio screencast fallito: {exc}")
+        self._mark_seq = self.seq
+        self._mark_navs = self._navs
+
+    def stop(self) -> None:
+        try:
+            self.cdp.send("Page.stopScreencast")
+            self.cdp.detach()
+        except Exception:
+            pass
@@ -0,0 +1,317 @@
+"""Template matching locale per i widget ricorrenti del wizard CaseVacanza.
+
+Il bottone Salva/Continua, l'"Ok" del banner cookie e i contatori +/- dei letti
+compaiono identici in molte schermate. Invece di chiedere al modello (o a un
+selettore CSS che si è rotto) dove sono, li cerchiamo nello screenshot corrente
+con una correlazione normalizzata (NCC) via FFT in NumPy: pochi millisecondi.
+
+I template si imparano dagli artifact dei run Computer Use: ogni click su un
+elemento riconosciuto (etichetta "Salva", "Ok", "+"…) viene annotato in
+screenshots/cu_known_clicks.jsonl con il frame e il box dell'elemento, e
+
+    python cu_templates.py learn
+
+ritaglia i box dai frame screenshots/cu_step*.{png,jpg} e salva le varianti più
+frequenti in templates/. Altri comandi:
+
+    python cu_templates.py add <nome> <frame> x y w h   — ritaglio manuale
+    python cu_templates.py test <frame>                 — match e tempi su un frame
+    python cu_templates.py list
+
+Richiede numpy e Pillow (opzionali): senza, il fast path è spento.
+
+Env vars:
+    CU_TEMPLATE_DIR         — cartella dei template (default templates)
+    CU_TEMPLATE_THRESHOLD   — soglia NCC per un match (default 0.85)
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+TEMPLATE_DIR = Path(os.environ.get("CU_TEMPLATE_DIR", "templates"))
+THRESHOLD = float(os.environ.get("CU_TEMPLATE_THRESHOLD", "0.85"))
+CLICK_LOG = Path("screenshots") / "cu_known_clicks.jsonl"
+MATCH_SCALE = 0.5  # si cerca a metà risoluzione: 4x meno pixel, stessa precisione utile per un click
+SCREEN_W = 1280  # larghezza nativa dei frame salvati dall'agente
+MAX_VARIANTS = 3
+
+# Nome del widget -> etichette (aria-label / testo) che lo identificano
+KNOWN = {
+    "salva": re.compile(r"^(salva( e continua)?|continua|avanti)$", re.I),
+    "cookie_ok": re.compile(r"^(ok|accetta( tutti)?|accetto)$", re.I),
+    "piu": re.compile(r"^(\+|aumenta|incrementa|increase|add)$", re.I),
+    "meno": re.compile(r"^([-−–]|diminuisci|decrementa|decrease|remove)$", re.I),
+}
+
+# Contatori del run: lookup, match trovati, ms per ogni ricerca
+stats = {"lookups": 0, "hits": 0, "ms": []}
+
+_cache: dict[str, list] = {}  # nome -> [array float32 a MATCH_SCALE]
+
+
+def _index_path() -> Path:
+    return TEMPLATE_DIR / "index.json"
+
+
+def _load_index() -> dict:
+    if not _index_path().exists():
+        return {}
+    with open(_index_path(), encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def available() -> bool:
+    """True se numpy e Pillow ci sono e almeno un template è stato imparato."""
+    return np is not None and Image is not None and bool(_load_index())
+
+
+def names() -> list[str]:
+    return sorted(_load_index())
+
+
+def known_name(label: str) -> str | None:
+    """Nome del widget noto per un'etichetta, oppure None."""
+    label = (label or "").strip()
+    for name, pattern in KNOWN.items():
+        if pattern.match(label):
+            return name
+    return None
+
+
+def _gray(image, scale: float = 1.0):
+    """Immagine PIL -> array float32 in scala di grigi, ridimensionata di `scale`."""
+    image = image.convert("L")
+    if scale != 1.0:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+    return np.asarray(image, dtype=np.float32)
+
+
+def _templates(name: str) -> list:
+    if name not in _cache:
+        _cache[name] = [_gray(Image.open(TEMPLATE_DIR / variant["file"]), MATCH_SCALE)
+                        for variant in _load_index().get(name, [])]
+    return _cache[name]
+
+
+def _fast_len(n: int) -> int:
+    """Prima lunghezza >= n con soli fattori 2, 3, 5: la FFT è molto più veloce."""
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def _ncc(image, tpl):
+    """Mappa NCC di `tpl` su tutte le posizioni valide di `image` (FFT + immagini integrali)."""
+    ih, iw = image.shape
+    th, tw = tpl.shape
+    if th > ih or tw > iw:
+        return None
+    t = tpl - tpl.mean()
+    t_norm = float(np.sqrt((t * t).sum()))
+    if t_norm == 0:
+        return None
+    shape = (_fast_len(ih + th - 1), _fast_len(iw + tw - 1))
+    corr = np.fft.irfft2(np.fft.rfft2(image, shape) * np.fft.rfft2(t[::-1, ::-1], shape), shape)
+    corr = corr[th - 1:ih, tw - 1:iw]
+
+    def window_sums(a):
+        s = np.pad(a.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        return s[th:, tw:] - s[:-th, tw:] - s[th:, :-tw] + s[:-th, :-tw]
+
+    n = th * tw
+    win = window_sums(image)
+    var = window_sums(image * image) - win * win / n
+    denom = np.sqrt(np.maximum(var, 0)) * t_norm
+    return np.where(denom > 1e-3 * t_norm, corr / np.maximum(denom, 1e-6), 0.0)
+
+
+def match(image, name: str, max_hits: int = 8) -> list[tuple[float, float, float]]:
+    """Occorrenze di `name` in `image` (PIL, risoluzione nativa) come
+    (x, y, score) del centro in pixel nativi, in ordine di lettura."""
+    gray = _gray(image, MATCH_SCALE)
+    hits = []
+    for tpl in _templates(name):
+        scores = _ncc(gray, tpl)
+        if scores is None:
+            continue
+        th, tw = tpl.shape
+        for _ in range(max_hits):
+            y, x = np.unravel_index(int(scores.argmax()), scores.shape)
+            score = float(scores[y, x])
+            if score < THRESHOLD:
+                break
+            hits.append((float(x + tw / 2) / MATCH_SCALE, float(y + th / 2) / MATCH_SCALE, score))
+            # Soppressione dei non-massimi: niente doppioni dello stesso widget
+            scores[max(0, y - th // 2):y + th // 2 + 1, max(0, x - tw // 2):x + tw // 2 + 1] = -1
+    # Varianti diverse possono trovare lo stesso widget: tiene il punteggio migliore
+    unique = []
+    for hit in sorted(hits, key=lambda h: -h[2]):
+        if all(abs(hit[0] - u[0]) > 8 or abs(hit[1] - u[1]) > 8 for u in unique):
+            unique.append(hit)
+    return sorted(unique, key=lambda h: (round(h[1] / 10), h[0]))
+
+
+def locate(page, name: str) -> list[tuple[float, float, float]]:
+    """match() sullo screenshot corrente della pagina, con statistiche."""
+    if np is None or Image is None:
+        return []
+    t0 = time.monotonic()
+    image = Image.open(io.BytesIO(page.screenshot(type="jpeg", quality=85)))
+    hits = match(image, name)
+    stats["lookups"] += 1
+    stats["hits"] += bool(hits)
+    stats["ms"].append(int((time.monotonic() - t0) * 1000))
+    return hits
+
+
+def click_known(page, name: str, n: int = 1) -> tuple[float, float] | None:
+    """Clicca l'n-esima occorrenza (ordine di lettura) del widget. Ritorna il
+    punto cliccato o None."""
+    hits = locate(page, name)
+    if len(hits) < n:
+        return None
+    x, y, score = hits[n - 1]
+    page.mouse.click(x, y)
+    print(f"  [template] {name} #{n} cliccato a ({x:.0f},{y:.0f}) score {score:.2f} in {stats['ms'][-1]} ms")
+    return x, y
+
+
+def summary() -> str | None:
+    """Riga di riassunto per i log finali (None se il fast path non è stato usato)."""
+    if not stats["lookups"]:
+        return None
+    ms = sorted(stats["ms"])
+    return (f"Template matching: {stats['hits']}/{stats['lookups']} trovati "
+            f"({stats['hits'] / stats['lookups']:.0%}), p50={ms[len(ms) // 2]} ms max={ms[-1]} ms")
+
+
+def log_click(frame: Path | str | None, label: str, box, scale: float) -> None:
+    """Annota un click su un widget noto: materiale per `learn`. `box` è in
+    pixel del frame (spazio del modello), `scale` = larghezza frame / nativa."""
+    name = known_name(label)
+    if not name or not frame:
+        return
+    CLICK_LOG.parent.mkdir(exist_ok=True)
+    with open(CLICK_LOG, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps({"name": name, "label": label, "frame": str(frame),
+                             "box": list(box), "scale": scale}, ensure_ascii=False) + "\n")
+
+
+def _crop(frame: Path, box, scale: float):
+    """Ritaglio del box dal frame, riportato alla risoluzione nativa."""
+    x, y, w, h = box
+    image = Image.open(frame).convert("L").crop((x, y, x + w, y + h))
+    if scale != 1.0:
+        image = image.resize((max(1, round(w / scale)), max(1, round(h / scale))))
+    return image
+
+
+def _similar(a, b) -> float:
+    """NCC tra due ritagli della stessa dimensione (b viene riportato ad a)."""
+    if abs(a.width - b.width) > 3 or abs(a.height - b.height) > 3:
+        return 0.0
+    x = np.asarray(a, dtype=np.float32)
+    y = np.asarray(b.resize(a.size), dtype=np.float32)
+    x, y = x - x.mean(), y - y.mean()
+    denom = float(np.sqrt((x * x).sum() * (y * y).sum()))
+    return float((x * y).sum()) / denom if denom else 0.0
+
+
+def _save_variants(name: str, variants: list[list], index: dict) -> None:
+    """variants: [[immagine, occorrenze]]; salva le più frequenti."""
+    TEMPLATE_DIR.mkdir(exist_ok=True)
+    index[name] = []
+    for k, (image, count) in enumerate(sorted(variants, key=lambda v: -v[1])[:MAX_VARIANTS]):
+        file = f"{name}_{k}.png"
+        image.save(TEMPLATE_DIR / file)
+        index[name].append({"file": file, "count": count, "size": list(image.size)})
+
+
+def learn(log: Path = CLICK_LOG) -> dict:
+    """Costruisce i template dai click annotati nei run precedenti."""
+    if not log.exists():
+        print(f"Nessun click annotato in {log}: serve almeno un run Computer Use con CU_OBSERVE=1")
+        return {}
+    by_name: dict[str, list[list]] = {}
+    with open(log, encoding="utf-8") as fh:
+        for line in fh:
+            entry = json.loads(line)
+            frame = Path(entry["frame"])
+            if not frame.exists():
+                continue
+            crop = _crop(frame, entry["box"], entry["scale"])
+            variants = by_name.setdefault(entry["name"], [])
+            for variant in variants:
+                if _similar(variant[0], crop) >= 0.95:
+                    variant[1] += 1
+                    break
+            else:
+                variants.append([crop, 1])
+    index = _load_index()
+    for name, variants in by_name.items():
+        _save_variants(name, variants, index)
+        print(f"  {name}: {sum(v[1] for v in variants)} ritagli, {len(index[name])} varianti salvate")
+    with open(_index_path(), "w", encoding="utf-8") as fh:
+        json.dump(index, fh, indent=2)
+    _cache.clear()
+    return index
+
+
+def main() -> None:
+    if np is None or Image is None:
+        raise SystemExit("Servono numpy e Pillow: pip install numpy Pillow")
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if cmd == "learn":
+        learn()
+    elif cmd == "add":
+        name, frame = sys.argv[2], Path(sys.argv[3])
+        box = [int(v) for v in sys.argv[4:8]]
+        scale = Image.open(frame).width / SCREEN_W
+        index = _load_index()
+        variants = [[Image.open(TEMPLATE_DIR / v["file"]), v["count"]] for v in index.get(name, [])]
+        # Il ritaglio manuale passa davanti alle varianti imparate
+        top = max((v[1] for v in variants), default=0) + 1
+        _save_variants(name, [[_crop(frame, box, scale), top], *variants], index)
+        with open(_index_path(), "w", encoding="utf-8") as fh:
+            json.dump(index, fh, indent=2)
+        print(f"  {name}: template aggiunto da {frame}")
+    elif cmd == "test":
+        frame = Image.open(sys.argv[2])
+        scale = frame.width / SCREEN_W
+        if scale != 1.0:
+            frame = frame.resize((SCREEN_W, round(frame.height / scale)))
+        for name in names():
+            t0 = time.monotonic()
+            hits = match(frame, name)
+            ms = (time.monotonic() - t0) * 1000
+            found = ", ".join(f"({x:.0f},{y:.0f}) {s:.2f}" for x, y, s in hits) or "nessuno"
+            print(f"  {name}: {found} — {ms:.1f} ms")
+    else:
+        for name, variants in _load_index().items():
+            print(f"  {name}: " + ", ".join(f"{v['file']} {v['size'][0]}x{v['size'][1]} ×{v['count']}"
+                                           for v in variants))
+
+
+if __name__ == "__main__":
+    main()
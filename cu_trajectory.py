@@ -0,0 +1,182 @@
+"""Registrazione e replay delle traiettorie dell'agente Computer Use.
+
+Ogni inserzione CaseVacanza percorre lo stesso wizard: invece di far riscoprire
+al modello ogni click, un run riuscito viene salvato come sequenza di
+(fingerprint schermata, azione, parametri). Al run successivo, finché la
+schermata corrente coincide con quella registrata, l'azione viene rieseguita in
+locale; il modello viene chiamato solo quando la schermata diverge.
+
+Regole di sicurezza:
+- Il testo digitato è legato ai campi del JSON (`{"$prop": "identificativi.cap"}`)
+  o alle credenziali (`{"$cred": "password"}`), mai salvato in chiaro se
+  contiene dati della proprietà o la password. Un testo che non si riesce a
+  legare in modo univoco diventa una "barriera": a quel punto decide il modello.
+- Le registrazioni sono separate per "forma" della proprietà (tipo, ospiti,
+  camere, letti, dotazioni…): il numero di click sui contatori dipende da quei
+  valori, quindi una traiettoria non viene mai riusata per una forma diversa.
+- Un `click_element(id)` si registra come `left_click` sul centro risolto:
+  gli id dell'elenco elementi valgono solo per l'osservazione in cui sono nati.
+
+Le traiettorie vivono in trajectories/<chiave>_<forma>.json.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+
+TRAJECTORY_DIR = Path("trajectories")
+
+# Azioni senza effetti sulla pagina: non vengono registrate
+_SKIP_ACTIONS = {"screenshot", "cursor_position", "wait", "get_property_field"}
+
+# Firma della schermata dal DOM (non dai pixel): URL senza query, heading,
+# struttura dei campi visibili e scroll. I valori dei campi sono esclusi, così
+# la stessa pagina del wizard ha la stessa firma per proprietà diverse.
+_FINGERPRINT_JS = """() => {
+    const h = (document.querySelector('h1, h2, h3') || {}).textContent || '';
+    const fields = Array.from(document.querySelectorAll('input, select, textarea, button, [role="checkbox"]'))
+        .filter(el => el.offsetParent !== null)
+        .map(el => el.tagName + ':' + (el.getAttribute('data-test') || el.name || el.type || ''));
+    return [
+        location.origin + location.pathname,
+        h.trim().substring(0, 200),
+        fields.join(','),
+        Math.round(window.scrollY / 50),
+    ].join('|');
+}"""
+
+
+def fingerprint(page) -> str:
+    """Hash breve della schermata corrente (vuoto se la pagina sta navigando)."""
+    try:
+        raw = page.evaluate(_FINGERPRINT_JS)
+    except Exception:
+        return ""
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def prop_shape(prop: dict) -> str:
+    """Hash dei campi del JSON che cambiano la sequenza di azioni nel wizard."""
+    ident = prop.get("identificativi", {})
+    comp = prop.get("composizione", {})
+    dot = prop.get("dotazioni", {}) if isinstance(prop.get("dotazioni"), dict) else {}
+    cond = prop.get("condizioni", {})
+    marketing = prop.get("marketing", {})
+    shape = {
+        "tipo": ident.get("tipo_struttura"),
+        "ospiti": comp.get("max_ospiti"),
+        "camere": comp.get("camere"),
+        "bagni": comp.get("bagni"),
+        "letti": comp.get("letti", []),
+        "dotazioni": sorted(k for k, v in dot.items() if v is True),
+        "piscina_tipo": dot.get("piscina_tipo", ""),
+        "cin": bool(ident.get("cin")),
+        "cir": bool(ident.get("cir")),
+        "ical": bool(cond.get("ical_url")),
+        "foto": bool(marketing.get("foto") or marketing.get("foto_urls")),
+        "extra": [k for k in ("pulizia_finale", "asciugamani", "lenzuola") if cond.get(k)],
+    }
+    return hashlib.sha1(json.dumps(shape, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+
+
+def _flatten(obj, prefix=""):
+    """Foglie testuali/numeriche del JSON come {path: stringa}."""
+    out = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            out.update(_flatten(v, f"{prefix}{k}."))
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            out.update(_flatten(v, f"{prefix}{i}."))
+    elif isinstance(obj, (str, int, float)) and not isinstance(obj, bool):
+        out[prefix[:-1]] = str(obj)
+    return out
+
+
+def lookup(prop: dict, path: str):
+    """Valore del JSON al path puntato (es. "composizione.letti.0.tipo")."""
+    cur = prop
+    for part in path.split("."):
+        cur = cur[int(part)] if isinstance(cur, list) else cur[part]
+    return cur
+
+
+def bind_input(action_input: dict, prop: dict, email: str, password: str) -> dict | None:
+    """Versione registrabile di `action_input`, oppure None se è una barriera."""
+    bound = dict(action_input)
+    text = action_input.get("text")
+    if action_input.get("action") != "type" or text is None:
+        return bound  # click, tasti, scroll: nessun dato da legare
+    if password and password in text:
+        # La password non finisce mai su disco: o è il campo intero, o barriera
+        return bound | {"text": {"$cred": "password"}} if text == password else None
+    if email and text == email:
+        return bound | {"text": {"$cred": "email"}}
+    leaves = _flatten(prop)
+    matches = [path for path, value in leaves.items() if value == text.strip()]
+    if len(matches) == 1:
+        return bound | {"text": {"$prop": matches[0]}}
+    if matches:
+        return None  # valore ambiguo (es. "1" per camere e bagni): decide il modello
+    # Testo costante (URL del portale, "Ok"...) solo se non contiene dati della proprietà
+    if any(len(value) >= 3 and value in text for value in leaves.values()):
+        return None
+    return bound
+
+
+def resolve_input(bound: dict, prop: dict, email: str, password: str) -> dict:
+    """Ricostruisce l'input dell'azione per la proprietà corrente."""
+    action_input = dict(bound)
+    text = bound.get("text")
+    if isinstance(text, dict):
+        if "$cred" in text:
+            action_input["text"] = password if text["$cred"] == "password" else email
+        else:
+            action_input["text"] = str(lookup(prop, text["$prop"]))
+    return action_input
+
+
+def _path(key: str, shape: str) -> Path:
+    safe = re.sub(r"[^\w.-]+", "_", key)
+    return TRAJECTORY_DIR / f"{safe}_{shape}.json"
+
+
+def load(key: str, shape: str) -> list[dict]:
+    path = _path(key, shape)
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as fh:
+        entries = json.load(fh).get("entries", [])
+    for entry in entries:
+        # Registrazioni vecchie: un click_element punta a un data-cu-id che nel
+        # replay non esiste (nessuno snapshot), quindi decide il modello
+        if (entry.get("input") or {}).get("action") == "click_element":
+            entry["input"] = None
+    return entries
+
+
+def save(key: str, shape: str, entries: list[dict]) -> Path:
+    TRAJECTORY_DIR.mkdir(exist_ok=True)
+    path = _path(key, shape)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({
+            "key": key,
+            "shape": shape,
+            "saved_at": datetime.now().isoformat(timespec="seconds"),
+            "entries": entries,
+        }, fh, indent=2, ensure_ascii=False)
+    return path
+
+
+def new_entry(fp: str, turn: int, bound: dict | None, prev_fp: str | None) -> dict:
+    """Voce di traiettoria. `entry` marca la prima azione su una nuova schermata:
+    sono i punti da cui il replay può riagganciarsi dopo una divergenza."""
+    return {"fp": fp, "turn": turn, "input": bound, "entry": fp != prev_fp}
+
+
+def skip_action(action_input: dict) -> bool:
+    return action_input.get("action") in _SKIP_ACTIONS
@@ -16,6 +16,8 @@ import os
 
 from playwright.sync_api import sync_playwright
 
+import session_vault
+
 EMAIL = os.environ["CASEVACANZA_EMAIL"]
 PASSWORD = os.environ["CASEVACANZA_PASSWORD"]
 
@@ -90,6 +92,9 @@ def _dismiss_cookie_popup(page):
 
 def login(page):
     print("Login CaseVacanza.it...")
+    if session_vault.restore_session(page, EMAIL):
+        screenshot(page, "dopo_login")
+        return
     page.goto("https://my.casevacanza.it", timeout=60_000)
     wait(page, 5000)
     screenshot(page, "login_page")
@@ -180,6 +185,7 @@ def login(page):
     wait(page, 8000)
     screenshot(page, "dopo_login")
     print(f"  URL dopo login: {page.url}")
+    session_vault.save(page.context, EMAIL)
     print("Login OK.")
 
 
@@ -517,7 +523,8 @@ def main():
 
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
-        page = browser.new_page(user_agent=USER_AGENT)
+        context = session_vault.new_context(browser, EMAIL, user_agent=USER_AGENT)
+        page = context.new_page()
 
         try:
             # --- Login e navigazione ---
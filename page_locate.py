@@ -0,0 +1,299 @@
+"""Risoluzione di un campo/bottone tra più candidati in un solo round trip.
+
+Gli uploader cercano lo stesso elemento con liste di etichette, placeholder e
+selettori ("Prezzo per notte", "Prezzo", "notte"…): con un `count()` per
+candidato un campo trovato al quarto tentativo costa quattro chiamate CDP
+prima ancora di compilarlo. `resolve()` manda l'intera lista, in ordine di
+priorità, in un solo `page.evaluate`: il primo candidato con un elemento
+visibile vince, l'elemento viene marcato con `data-pl-id` (come `data-cu-id`
+in cu_dom) e torna come Locator pronto per fill/click.
+
+Candidati: tuple `(strategia, valore)` o `(strategia, valore, exact)` con
+strategia tra
+- "label": campo con quell'etichetta (label[for], label che lo contiene,
+  aria-label, aria-labelledby), come `get_by_label`;
+- "placeholder": come `get_by_placeholder`;
+- "text": l'elemento più interno con quel testo, come `get_by_text`;
+- "button": bottone con quel nome accessibile, come `get_by_role("button")`;
+- "css": selettore CSS standard (niente pseudo-classi Playwright).
+Senza `exact` il confronto è per sottostringa e ignora maiuscole, come in
+Playwright.
+
+`stats` conta per step i round trip fatti e quelli che avrebbero fatto i
+vecchi loop (un `count()` per candidato provato fino a quello vincente).
+
+Con `field` il candidato vincente viene ricordato in CV_SELECTOR_CACHE
+(default selector_cache.json) per (portale, step, campo), insieme a tag e
+type dell'elemento trovato. Al run successivo il preferito viene provato per
+primo e, se trova un elemento dello stesso tag/type, vince subito: gli altri
+candidati (le ricerche per testo scorrono tutto il DOM) non vengono nemmeno
+valutati. Se non trova nulla o trova un elemento di altro tipo (il portale ha
+cambiato HTML) viene scartato e si riparte dall'ordine scritto nel codice; il
+nuovo vincitore diventa il preferito. Un selettore generico ("textarea",
+"input[type='text']") combacia con qualunque campo del suo tipo e non diventa
+mai preferito. Esiti contati nel file e nel riassunto finale.
+"""
+
+from __future__ import annotations
+
+import atexit
+import itertools
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+# Step corrente (lo impostano i try_step degli uploader) per le statistiche
+current_step = "-"
+
+# step -> {"resolve": round trip del resolver, "legacy": stima dei vecchi loop}
+stats: dict[str, dict[str, int]] = {}
+
+_ids = itertools.count(1)
+
+CACHE_FILE = Path(os.environ.get("CV_SELECTOR_CACHE", "selector_cache.json"))
+# Un selettore CSS fatto solo di tag e [type=...] (vedi _generic)
+_GENERIC_CSS = re.compile(r"""^\s*[a-z]+(\[type=['"]?[\w-]+['"]?\]|:not\(\[type\]\))*\s*$""")
+
+# "portale|step|campo" -> {"favourite": candidato o None, "tag", "type" (del suo
+# elemento), "hits", "misses" (preferito scartato), "unmatched" (nessun
+# candidato trovato), "updated"}
+_cache: dict[str, dict] | None = None
+_cache_dirty = False
+# Esito del preferito in questo run; skipped = candidati non valutati perché
+# il preferito ha vinto prima del suo turno nell'ordine del codice
+cache_stats = {"hits": 0, "misses": 0, "unmatched": 0, "learned": 0, "skipped": 0}
+
+_RESOLVE_JS = """([candidates, order, favourite, expect, last, visibleOnly, markId]) => {
+    const norm = (s) => (s || '').replace(/\\s+/g, ' ').trim();
+    const matches = (text, value, exact) => exact
+        ? norm(text) === value
+        : norm(text).toLowerCase().includes(value.toLowerCase());
+    const visible = (el) => {
+        const r = el.getBoundingClientRect();
+        return r.width > 0 && r.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+    };
+    const labelsOf = (el) => {
+        const out = [el.getAttribute('aria-label') || ''];
+        const by = el.getAttribute('aria-labelledby');
+        if (by) out.push(by.split(' ').map(id => (document.getElementById(id) || {}).textContent || '').join(' '));
+        for (const l of (el.labels || [])) out.push(l.textContent);
+        return out;
+    };
+    const FIELDS = 'input, textarea, select, [contenteditable="true"], [role="textbox"], ' +
+                   '[role="combobox"], [role="checkbox"], [role="radio"], [role="spinbutton"]';
+    const BUTTONS = 'button, [role="button"], input[type="button"], input[type="submit"]';
+    const find = (by, value, exact) => {
+        if (by === 'label')
+            return Array.from(document.querySelectorAll(FIELDS))
+                .filter(el => labelsOf(el).some(t => t && matches(t, value, exact)));
+        if (by === 'placeholder')
+            return Array.from(document.querySelectorAll('[placeholder]'))
+                .filter(el => matches(el.getAttribute('placeholder'), value, exact));
+        if (by === 'button')
+            return Array.from(document.querySelectorAll(BUTTONS))
+                .filter(el => matches(el.getAttribute('aria-label') || el.textContent || el.value, value, exact));
+        if (by === 'text') {
+            const hit = new Set(Array.from(document.body.querySelectorAll('*'))
+                .filter(el => !['SCRIPT', 'STYLE', 'NOSCRIPT'].includes(el.tagName)
+                              && matches(el.textContent, value, exact)));
+            // Solo il più interno: se un figlio contiene già il testo vince lui
+            return Array.from(hit).filter(el => !Array.from(el.children).some(c => hit.has(c)));
+        }
+        try {
+            return Array.from(document.querySelectorAll(value));
+        } catch (e) {
+            return [];  // selettore non valido in CSS standard
+        }
+    };
+    const pick = (i) => {
+        const [by, value, exact] = candidates[i];
+        let found = find(by, value, !!exact);
+        if (visibleOnly) found = found.filter(visible);
+        if (!found.length) return null;
+        return last ? found[found.length - 1] : found[0];
+    };
+    // Il preferito per primo: vince se trova un elemento del tipo atteso,
+    // altrimenti è scartato e si prosegue nell'ordine del codice
+    let tried = 0, rejected = null;
+    for (const i of order) {
+        tried++;
+        const el = pick(i);
+        if (!el) {
+            if (i === favourite) rejected = 'missing';
+            continue;
+        }
+        if (i === favourite && expect && (el.tagName !== expect[0] || (el.type || '') !== expect[1])) {
+            rejected = 'type';
+            continue;
+        }
+        el.setAttribute('data-pl-id', String(markId));
+        return {index: i, tried, rejected, tag: el.tagName, type: el.type || ''};
+    }
+    return {index: -1, tried, rejected};
+}"""
+
+
+def _load_cache() -> dict[str, dict]:
+    global _cache
+    if _cache is None:
+        _cache = {}
+        if CACHE_FILE.exists():
+            try:
+                with open(CACHE_FILE, encoding="utf-8") as fh:
+                    _cache = json.load(fh)
+            except (OSError, ValueError) as e:
+                print(f"  [WARN] Cache selettori illeggibile, riparto da zero: {e}")
+        atexit.register(save_cache)
+    return _cache
+
+
+def save_cache() -> None:
+    """Scrive la cache se in questo run è cambiata (registrata con atexit)."""
+    global _cache_dirty
+    if not _cache_dirty or _cache is None:
+        return
+    try:
+        with open(CACHE_FILE, "w", encoding="utf-8") as fh:
+            json.dump(_cache, fh, indent=2, ensure_ascii=False, sort_keys=True)
+        _cache_dirty = False
+    except OSError as e:
+        print(f"  [WARN] Salvataggio cache selettori fallito: {e}")
+
+
+def _candidate_key(candidate: tuple) -> str:
+    return ":".join(str(part) for part in candidate)
+
+
+def _cache_key(page, field: str) -> str:
+    return f"{urlparse(page.url).hostname or '-'}|{current_step}|{field}"
+
+
+def _generic(candidate: tuple) -> bool:
+    """Selettore CSS che descrive solo il tipo di campo ("textarea",
+    "input[type='text']"): combacia con qualunque campo di quel tipo."""
+    return candidate[0] == "css" and all(_GENERIC_CSS.match(part) for part in candidate[1].split(","))
+
+
+def _favourite(entry: dict | None, candidates: list[tuple]) -> int:
+    """Indice del preferito tra i candidati, -1 se non c'è (o non è più nella lista)."""
+    if not entry or not entry.get("favourite"):
+        return -1
+    for i, c in enumerate(candidates):
+        if _candidate_key(c) == entry["favourite"] and not _generic(c):
+            return i
+    return -1
+
+
+def _learned_order(entry: dict | None, candidates: list[tuple]) -> list[int]:
+    """Indici dei candidati nell'ordine in cui la pagina li prova: il
+    preferito per primo, poi gli altri nell'ordine scritto nel codice."""
+    favourite = _favourite(entry, candidates)
+    order = [i for i in range(len(candidates)) if i != favourite]
+    return [favourite] + order if favourite >= 0 else order
+
+
+def _learn(key: str, entry: dict | None, field: str, candidates: list[tuple], hit: dict) -> None:
+    """Aggiorna il preferito dopo una ricerca: confermato se ha vinto,
+    scartato se non ha trovato nulla o un elemento di altro tipo; il nuovo
+    vincitore (se non generico) prende il suo posto."""
+    global _cache_dirty
+    cache = _load_cache()
+    favourite = _favourite(entry, candidates)
+    index = hit["index"]
+    now = datetime.now().isoformat(timespec="seconds")
+    if favourite >= 0 and index == favourite:
+        entry["hits"] += 1
+        entry["updated"] = now
+        cache_stats["hits"] += 1
+        cache_stats["skipped"] += favourite  # i candidati prima di lui nel codice
+        _cache_dirty = True
+        return
+    if favourite >= 0:
+        entry["misses"] += 1
+        cache_stats["misses"] += 1
+        reason = "elemento di altro tipo" if hit.get("rejected") == "type" else "non trovato"
+        print(f"  [cache] {field}: preferito {entry['favourite']} scartato ({reason})")
+        entry.update(favourite=None, tag="", type="", updated=now)
+        _cache_dirty = True
+    if index < 0:
+        if entry is not None:
+            entry["unmatched"] = entry.get("unmatched", 0) + 1
+            entry["updated"] = now
+            cache_stats["unmatched"] += 1
+            _cache_dirty = True
+        return
+    winner = candidates[index]
+    if _generic(winner):
+        return  # combacia con qualunque campo del suo tipo: mai preferito
+    if entry is None:
+        entry = cache[key] = {"hits": 0, "misses": 0, "unmatched": 0}
+        cache_stats["learned"] += 1
+    entry.update(favourite=_candidate_key(winner), tag=hit["tag"], type=hit["type"], updated=now)
+    entry.pop("order", None)  # formato vecchio (classifica)
+    _cache_dirty = True
+
+
+def _record(tried: int) -> None:
+    entry = stats.setdefault(current_step, {"resolve": 0, "legacy": 0})
+    entry["resolve"] += 1
+    entry["legacy"] += tried
+
+
+def resolve(page, candidates, last: bool = False, visible: bool = True, field: str | None = None):
+    """Primo candidato con un elemento (visibile) nella pagina, in un solo
+    evaluate. Ritorna `(locator, candidato, info)` con info = {"tag", "type"}
+    dell'elemento, oppure None. `last` prende l'ultimo elemento del candidato
+    vincente invece del primo (es. il campo del form appena aperto). Con
+    `field` l'ordine dei candidati viene dalla cache selettori. `page` può
+    essere anche un Frame (es. il form di login in iframe)."""
+    candidates = [tuple(c) for c in candidates]
+    entry = None
+    if field:
+        key = _cache_key(page, field)
+        entry = _load_cache().get(key)
+    order = _learned_order(entry, candidates)
+    favourite = _favourite(entry, candidates)
+    expect = [entry.get("tag", ""), entry.get("type", "")] if favourite >= 0 else None
+    mark = next(_ids)
+    try:
+        hit = page.evaluate(_RESOLVE_JS, [[list(c) for c in candidates], order, favourite, expect,
+                                          last, visible, mark])
+    except Exception as e:
+        print(f"  [WARN] Ricerca candidati fallita: {e}")
+        hit = None
+    # Stima dei vecchi loop: sempre nell'ordine scritto nel codice
+    _record(hit["index"] + 1 if hit and hit["index"] >= 0 else len(candidates))
+    if field and hit is not None:
+        _learn(key, entry, field, candidates, hit)
+    if not hit or hit["index"] < 0:
+        return None
+    locator = page.locator(f"[data-pl-id='{mark}']")
+    return locator, candidates[hit["index"]], {"tag": hit["tag"], "type": hit["type"]}
+
+
+def locate(page, candidates, last: bool = False, visible: bool = True, field: str | None = None):
+    """Come resolve() ma ritorna solo il Locator (o None)."""
+    hit = resolve(page, candidates, last=last, visible=visible, field=field)
+    return hit[0] if hit else None
+
+
+def summary() -> str | None:
+    """Righe di riassunto per i log finali (None se il resolver non è stato usato)."""
+    if not stats:
+        return None
+    total = sum(s["resolve"] for s in stats.values())
+    legacy = sum(s["legacy"] for s in stats.values())
+    lines = [f"Ricerca elementi: {total} round trip (con i loop per candidato sarebbero stati almeno {legacy})"]
+    for step, s in stats.items():
+        lines.append(f"  - {step}: {s['resolve']} (prima ≥{s['legacy']})")
+    known = cache_stats["hits"] + cache_stats["misses"]
+    if known or cache_stats["learned"] or cache_stats["unmatched"]:
+        rate = f"{cache_stats['hits'] / known:.0%}" if known else "-"
+        unmatched = f", {cache_stats['unmatched']} senza match" if cache_stats["unmatched"] else ""
+        lines.append(f"Cache selettori: preferito confermato {cache_stats['hits']}/{known} ({rate}), "
+                     f"{cache_stats['misses']} scartati{unmatched}, {cache_stats['learned']} campi nuovi, "
+                     f"{cache_stats['skipped']} candidati non valutati")
+    return "\n".join(lines)
@@ -0,0 +1,275 @@
+"""Attese guidate da eventi per gli uploader Playwright.
+
+Le pause fisse (`page.wait_for_timeout`) costano sempre il caso peggiore e
+comunque perdono la corsa con un render React più lento del solito. Qui ogni
+attesa finisce appena succede la cosa che serviva:
+
+- `until_quiet`: nessuna mutazione del DOM per `quiet_ms` (un solo evaluate
+  con un MutationObserver, niente polling da Python);
+- `until_idle`: nessuna richiesta XHR/fetch recente in corso, poi DOM
+  quieto (upload foto, salvataggi di form). Le richieste aperte da più di
+  NETWORK_WINDOW_MS (long polling, analytics) non contano: altrimenti su
+  queste pagine ogni attesa arriverebbe al tetto;
+- `until_counter`: il valore di un contatore +/- è quello atteso;
+- `until_changed`: il wizard ha cambiato URL o titolo dello step;
+- `until_visible` / `until_hidden`: un elemento è comparso / sparito (campi
+  di un form appena aperto, banner cookie).
+
+`max_ms` è il tetto oltre cui si prosegue comunque, come faceva la pausa
+fissa. Ogni primitiva registra il tempo effettivo accanto al tetto:
+`summary()` dice quanto tempo morto si è risparmiato e quante attese sono
+finite senza l'evento atteso (indizio di un selettore o di un evento che
+non arriva mai).
+"""
+
+from __future__ import annotations
+
+import os
+import time
+
+# Richieste che tengono occupata la pagina: script, stili e immagini no
+NETWORK_TYPES = ("xhr", "fetch")
+# Oltre quest'età una richiesta ancora aperta è long polling o analytics
+NETWORK_WINDOW_MS = int(os.environ.get("CV_NETWORK_WINDOW_MS", "1500"))
+
+# Titolo dello step corrente: lo stesso usato da current_heading()
+HEADING_SELECTOR = 'h1, h2, h3, [data-test*="title"], [class*="heading"]'
+
+# nome primitiva -> {"calls", "ms" (effettivi), "max_ms" (tetti), "timeouts"}
+stats: dict[str, dict[str, int]] = {}
+
+# Solo i cambi che contano per un render: niente `style`, che le animazioni
+# CSS toccano di continuo
+_ATTRIBUTES = ["class", "disabled", "hidden", "value", "checked",
+               "aria-expanded", "aria-checked", "aria-selected", "aria-hidden"]
+
+_QUIET_JS = """([quietMs, maxMs, attributes]) => new Promise(resolve => {
+    let timer = null, cap = null;
+    const done = (ok) => { obs.disconnect(); clearTimeout(timer); clearTimeout(cap); resolve(ok); };
+    const obs = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(() => done(true), quietMs);
+    });
+    obs.observe(document.documentElement, {childList: true, subtree: true, characterData: true,
+                                           attributes: true, attributeFilter: attributes});
+    timer = setTimeout(() => done(true), quietMs);
+    cap = setTimeout(() => done(false), maxMs);
+})"""
+
+# Valore del contatore che contiene il bottone `btn` (il "+"): la prima riga
+# risalendo dal bottone con almeno due button, come in locate_letto_counter.
+# Con `expected` null ritorna subito il valore, altrimenti aspetta che lo
+# raggiunga (o lo superi) fino a `maxMs`.
+_COUNTER_JS = """(btn, [expected, maxMs]) => new Promise(resolve => {
+    const read = () => {
+        for (let row = btn, d = 0; row && d < 10; row = row.parentElement, d++) {
+            if (row.querySelectorAll('button').length < 2) continue;
+            const input = row.querySelector('input');
+            if (input && /^\\d+$/.test(input.value)) return parseInt(input.value, 10);
+            for (const el of row.querySelectorAll('span, div, p')) {
+                const t = (el.textContent || '').trim();
+                if (/^\\d+$/.test(t) && t.length < 3) return parseInt(t, 10);
+            }
+            return null;
+        }
+        return null;
+    };
+    const ok = (v) => expected === null || v === null || v >= expected;
+    if (!btn || ok(read())) { resolve(btn ? read() : null); return; }
+    let cap = null;
+    const obs = new MutationObserver(() => {
+        const v = read();
+        if (ok(v)) { obs.disconnect(); clearTimeout(cap); resolve(v); }
+    });
+    obs.observe(document.documentElement, {childList: true, subtree: true, characterData: true,
+                                           attributes: true, attributeFilter: ['value']});
+    cap = setTimeout(() => { obs.disconnect(); resolve(read()); }, maxMs);
+})"""
+
+_COUNTER_AT_JS = f"""([x, y, expected, maxMs]) => {{
+    const el = document.elementFromPoint(x, y);
+    return ({_COUNTER_JS})(el && (el.closest('button') || el), [expected, maxMs]);
+}}"""
+
+_CHANGED_JS = """([selector, urlBefore, headingBefore]) => {
+    if (location.href !== urlBefore) return true;
+    if (headingBefore === null) return false;
+    const h = document.querySelector(selector);
+    return (h ? h.textContent.trim() : '') !== headingBefore;
+}"""
+
+
+def network_busy(pending: dict, window_ms: int) -> bool:
+    """True se tra le richieste in corso (`pending`: richiesta -> monotonic di
+    partenza) ce n'è una partita da meno di `window_ms`. Usata anche dal
+    settle dell'agente Computer Use, così i due controlli restano uguali."""
+    horizon = time.monotonic() - window_ms / 1000
+    return any(started > horizon for started in pending.values())
+
+
+class _Inflight:
+    """Richieste XHR/fetch in corso su una pagina (eventi Playwright)."""
+
+    def __init__(self, page):
+        self.page = page
+        self.pending: dict = {}  # richiesta -> monotonic di partenza
+        page.on("request", self._start)
+        page.on("requestfinished", self._end)
+        page.on("requestfailed", self._end)
+
+    def _start(self, request) -> None:
+        if request.resource_type in NETWORK_TYPES:
+            self.pending[request] = time.monotonic()
+
+    def _end(self, request) -> None:
+        self.pending.pop(request, None)
+
+    def busy(self) -> bool:
+        return network_busy(self.pending, NETWORK_WINDOW_MS)
+
+
+_trackers: dict[int, _Inflight] = {}
+
+
+def track(page) -> None:
+    """Inizia a contare le richieste in corso della pagina. Le primitive lo
+    fanno da sole alla prima chiamata, ma una richiesta partita prima sfugge:
+    conviene chiamarlo subito dopo `new_page()`."""
+    tracker = _trackers.get(id(page))
+    if tracker is None or tracker.page is not page:
+        _trackers[id(page)] = _Inflight(page)
+
+
+def _record(name: str, t0: float, max_ms: int, ok: bool) -> bool:
+    entry = stats.setdefault(name, {"calls": 0, "ms": 0, "max_ms": 0, "timeouts": 0})
+    entry["calls"] += 1
+    entry["ms"] += int((time.monotonic() - t0) * 1000)
+    entry["max_ms"] += max_ms
+    entry["timeouts"] += 0 if ok else 1
+    return ok
+
+
+def _remaining(t0: float, max_ms: int) -> int:
+    return max(0, max_ms - int((time.monotonic() - t0) * 1000))
+
+
+def _quiet(page, quiet_ms: int, max_ms: int) -> bool:
+    """Corpo di until_quiet senza statistiche (riusato da until_idle)."""
+    track(page)
+    try:
+        return bool(page.evaluate(_QUIET_JS, [quiet_ms, max(max_ms, quiet_ms), _ATTRIBUTES]))
+    except Exception:
+        # Contesto distrutto da una navigazione: aspettiamo la pagina nuova
+        try:
+            page.wait_for_load_state("domcontentloaded", timeout=max(max_ms, 1))
+            return True
+        except Exception:
+            return False
+
+
+def until_quiet(page, quiet_ms: int = 100, max_ms: int = 2000) -> bool:
+    """Aspetta che il DOM resti fermo per `quiet_ms` (al massimo `max_ms`)."""
+    t0 = time.monotonic()
+    return _record("quiet", t0, max_ms, _quiet(page, quiet_ms, max_ms))
+
+
+def until_idle(page, quiet_ms: int = 300, max_ms: int = 10_000) -> bool:
+    """Aspetta che finiscano le richieste XHR/fetch in corso e poi che il DOM
+    resti fermo per `quiet_ms`. Se nel frattempo parte un'altra richiesta
+    (es. il salvataggio dopo l'upload) si ricomincia, entro `max_ms`. Una
+    richiesta aperta da più di NETWORK_WINDOW_MS non trattiene l'attesa."""
+    track(page)
+    tracker = _trackers[id(page)]
+    t0 = time.monotonic()
+    ok = False
+    while _remaining(t0, max_ms) > 0:
+        page.wait_for_timeout(1)  # smaltisce gli eventi request già arrivati
+        if tracker.busy():
+            page.wait_for_timeout(25)
+            continue
+        if _quiet(page, quiet_ms, _remaining(t0, max_ms)) and not tracker.busy():
+            ok = True
+            break
+    return _record("idle", t0, max_ms, ok)
+
+
+def counter_value(page, plus) -> int | None:
+    """Valore attuale del contatore del bottone "+" `plus` (Locator o punto (x, y))."""
+    try:
+        if isinstance(plus, tuple):
+            return page.evaluate(_COUNTER_AT_JS, [plus[0], plus[1], None, 0])
+        return plus.evaluate(_COUNTER_JS, [None, 0])
+    except Exception:
+        return None
+
+
+def until_counter(page, plus, expected: int | None, max_ms: int = 2000) -> bool:
+    """Aspetta che il contatore del "+" `plus` valga `expected`. Se il valore
+    non è leggibile (`expected` None) ripiega su until_quiet."""
+    if expected is None:
+        return until_quiet(page, max_ms=max_ms)
+    t0 = time.monotonic()
+    try:
+        if isinstance(plus, tuple):
+            value = page.evaluate(_COUNTER_AT_JS, [plus[0], plus[1], expected, max_ms])
+        else:
+            value = plus.evaluate(_COUNTER_JS, [expected, max_ms])
+    except Exception:
+        value = None
+    if value is None:
+        # Contatore sparito o illeggibile dopo il click: almeno il render
+        _quiet(page, 100, _remaining(t0, max_ms))
+    return _record("counter", t0, max_ms, value is not None and value >= expected)
+
+
+def until_changed(page, url_before: str, heading_before: str | None = None,
+                  max_ms: int = 8000) -> bool:
+    """Aspetta che la pagina lasci `url_before` o che il titolo dello step non
+    sia più `heading_before` (None = solo URL, es. dopo il login)."""
+    t0 = time.monotonic()
+    try:
+        page.wait_for_function(_CHANGED_JS, arg=[HEADING_SELECTOR, url_before, heading_before],
+                               timeout=max_ms)
+        ok = True
+    except Exception:
+        # Timeout, oppure contesto distrutto perché la navigazione è partita
+        ok = page.url != url_before
+    if ok:
+        try:
+            page.wait_for_load_state("domcontentloaded", timeout=max(_remaining(t0, max_ms), 1))
+        except Exception:
+            pass
+    return _record("changed", t0, max_ms, ok)
+
+
+def _until_state(locator, state: str, max_ms: int) -> bool:
+    t0 = time.monotonic()
+    try:
+        locator.wait_for(state=state, timeout=max_ms)
+        ok = True
+    except Exception:
+        ok = False
+    return _record(state, t0, max_ms, ok)
+
+
+def until_visible(locator, max_ms: int = 5000) -> bool:
+    """Aspetta che `locator` compaia (es. il campo di un form appena aperto)."""
+    return _until_state(locator, "visible", max_ms)
+
+
+def until_hidden(locator, max_ms: int = 2000) -> bool:
+    """Aspetta che `locator` sparisca (o si stacchi dal DOM)."""
+    return _until_state(locator, "hidden", max_ms)
+
+
+def summary() -> str | None:
+    """Righe di riassunto per i log finali (None se non c'è stata nessuna attesa)."""
+    if not stats:
+        return None
+    total = sum(s["ms"] for s in stats.values())
+    worst = sum(s["max_ms"] for s in stats.values())
+    lines = [f"Attese: {total / 1000:.1f}s effettive su {worst / 1000:.1f}s di caso peggiore"]
+    for name, s in sorted(stats.items()):
+        timeouts = f", {s['timeouts']} senza evento" if s["timeouts"] else ""
+        lines.append(f"  - {name}: {s['calls']}x, {s['ms'] / 1000:.1f}s su {s['max_ms'] / 1000:.1f}s{timeouts}")
+    return "\n".join(lines)
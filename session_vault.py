@@ -0,0 +1,215 @@
+"""Vault delle sessioni CaseVacanza (storage_state Playwright cifrato).
+
+Dopo un login riuscito salva cookie e localStorage del context (incluso il
+cookie SSO Keycloak di id.casevacanza.it) in .sessions/<account>.state, cifrati
+con Fernet. Al run successivo il context parte già autenticato: se la sessione
+è ancora valida il login SSO viene saltato, altrimenti il file viene scartato e
+si rifà il login completo.
+
+Una sola sessione per account (vedi BOT_MEMORY.md): riusare la stessa sessione
+tra run sequenziali non ne apre di nuove; due processi in parallelo sullo
+stesso account vengono invece bloccati da un lock file (con il PID del
+proprietario: se quel processo non esiste più il lock viene rimosso), come fa
+il concurrency group `casevacanza-global` su Actions. Col vault spento non si
+prende nessun lock: niente sessione condivisa su disco, niente da proteggere.
+
+Su Actions i workflow CaseVacanza installano `cryptography`, passano il secret
+CV_SESSION_KEY e conservano i soli `.sessions/*.state` con actions/cache.
+
+Env vars:
+    CV_SESSION_KEY          — passphrase di cifratura (senza, il vault è spento)
+    CV_SESSION_DIR          — cartella del vault (default .sessions)
+    CV_SESSION_MAX_AGE_H    — età massima di una sessione salvata (default 12)
+
+Richiede il pacchetto `cryptography`: senza, il vault è spento e ogni run fa il
+login completo (mai sessioni in chiaro su disco).
+"""
+
+from __future__ import annotations
+
+import atexit
+import base64
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = Exception
+
+HOME_URL = "https://my.casevacanza.it"
+VAULT_DIR = Path(os.environ.get("CV_SESSION_DIR", ".sessions"))
+MAX_AGE_S = float(os.environ.get("CV_SESSION_MAX_AGE_H", "12")) * 3600
+LOCK_STALE_S = 2 * 3600  # un run non dura mai così tanto: lock orfano
+
+_SECRET = os.environ.get("CV_SESSION_KEY", "")
+
+# Context creati da new_context() con una sessione ripristinata
+_restored: set[int] = set()
+_locks: list[Path] = []
+
+
+def enabled() -> bool:
+    return bool(_SECRET) and Fernet is not None
+
+
+def _account_id(email: str) -> str:
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()[:16]
+
+
+def _fernet(email: str):
+    # Chiave derivata dalla passphrase, con l'account come salt
+    raw = hashlib.pbkdf2_hmac("sha256", _SECRET.encode("utf-8"),
+                              _account_id(email).encode("utf-8"), 200_000)
+    return Fernet(base64.urlsafe_b64encode(raw))
+
+
+def _state_path(email: str) -> Path:
+    return VAULT_DIR / f"{_account_id(email)}.state"
+
+
+def _release_locks() -> None:
+    for lock in _locks:
+        lock.unlink(missing_ok=True)
+    _locks.clear()
+
+
+def _lock_owner_alive(lock: Path) -> bool:
+    """True se il processo che ha scritto il lock è ancora vivo (o non si sa)."""
+    try:
+        pid = int(lock.read_text().strip())
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        return True  # lock appena creato, PID non ancora scritto
+    if os.name == "nt":
+        return True  # su Windows os.kill(pid, 0) termina il processo: decide l'età del lock
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # esiste, ma è di un altro utente
+    return True
+
+
+def acquire_lock(email: str) -> None:
+    """Un solo processo alla volta per account: sessioni SSO concorrenti
+    invalidano i draft (incidente del 03/05/2026)."""
+    VAULT_DIR.mkdir(exist_ok=True)
+    lock = VAULT_DIR / f"{_account_id(email)}.lock"
+    try:
+        age = time.time() - lock.stat().st_mtime
+        if age > LOCK_STALE_S or not _lock_owner_alive(lock):
+            print(f"  [vault] Lock orfano rimosso ({lock})")
+            lock.unlink(missing_ok=True)
+    except FileNotFoundError:
+        pass
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise RuntimeError(
+            f"Un altro run sta già usando l'account CaseVacanza (lock {lock}): "
+            f"una sola sessione per account."
+        )
+    with os.fdopen(fd, "w") as fh:
+        fh.write(str(os.getpid()))
+    _locks.append(lock)
+    if len(_locks) == 1:
+        atexit.register(_release_locks)
+
+
+def load(email: str) -> dict | None:
+    """storage_state salvato per `email`, oppure None (assente, scaduto, illeggibile)."""
+    if not enabled():
+        return None
+    path = _state_path(email)
+    if not path.exists():
+        return None
+    try:
+        payload = json.loads(_fernet(email).decrypt(path.read_bytes()))
+    except (InvalidToken, ValueError) as e:
+        print(f"  [vault] Sessione illeggibile, la scarto: {type(e).__name__}")
+        discard(email)
+        return None
+    if time.time() - payload.get("saved_at", 0) > MAX_AGE_S:
+        print("  [vault] Sessione salvata troppo vecchia, rifaccio il login")
+        discard(email)
+        return None
+    return payload["state"]
+
+
+def save(context, email: str) -> None:
+    """Salva lo storage_state del context (da chiamare a login riuscito)."""
+    if not enabled():
+        return
+    VAULT_DIR.mkdir(exist_ok=True)
+    payload = {"saved_at": time.time(), "state": context.storage_state()}
+    token = _fernet(email).encrypt(json.dumps(payload).encode("utf-8"))
+    path = _state_path(email)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(token)
+    os.replace(tmp, path)
+    print(f"  [vault] Sessione salvata ({path})")
+
+
+def discard(email: str) -> None:
+    _state_path(email).unlink(missing_ok=True)
+
+
+def new_context(browser, email: str, **kwargs):
+    """browser.new_context(**kwargs) con la sessione salvata, se c'è.
+    Col vault attivo prende anche il lock dell'account."""
+    if enabled():
+        acquire_lock(email)
+    state = load(email)
+    if state is None:
+        if not enabled():
+            print("  [vault] Disattivato (manca CV_SESSION_KEY o il pacchetto cryptography)")
+        return browser.new_context(**kwargs)
+    context = browser.new_context(storage_state=state, **kwargs)
+    _restored.add(id(context))
+    print("  [vault] Sessione salvata caricata")
+    return context
+
+
+def restore_session(page, email: str) -> bool:
+    """Apre la home del portale e verifica la sessione ripristinata.
+
+    True se siamo già dentro (login da saltare). Con una sessione scaduta il
+    portale rimanda al form Keycloak: il file viene scartato e la pagina resta
+    lì, pronta per il login completo. Senza sessione ripristinata non fa nulla.
+    """
+    if id(page.context) not in _restored:
+        return False
+    _restored.discard(id(page.context))
+    page.goto(HOME_URL, timeout=60_000)
+    page.wait_for_load_state("domcontentloaded")
+    try:
+        # La SPA reindirizza a Keycloak via JS: aspettiamo che la rete si calmi
+        page.wait_for_load_state("networkidle", timeout=10_000)
+    except Exception:
+        pass
+    if on_login_form(page):
+        print("  [vault] Sessione scaduta, login completo")
+        discard(email)
+        return False
+    print(f"  [vault] Sessione valida, login saltato ({page.url})")
+    return True
+
+
+def on_login_form(page) -> bool:
+    """True se la pagina mostra il login SSO (sessione assente o scaduta)."""
+    if page.url.startswith("https://id.") or "/login" in page.url:
+        return True
+    for frame in page.frames:
+        try:
+            if frame.locator("input[type='password']").count() > 0:
+                return True
+        except Exception:
+            pass
+    return False
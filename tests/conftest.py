@@ -0,0 +1,6 @@
+"""I moduli del repo sono script nella root, non un pacchetto installato."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,128 @@
+"""Cache selettori di page_locate: il preferito imparato cambia davvero quale
+candidato viene provato per primo e quale vince."""
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import page_locate
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_locate, "CACHE_FILE", tmp_path / "selector_cache.json")
+    monkeypatch.setattr(page_locate, "_cache", {})
+    monkeypatch.setattr(page_locate, "_cache_dirty", False)
+    monkeypatch.setattr(page_locate, "cache_stats", dict.fromkeys(page_locate.cache_stats, 0))
+    monkeypatch.setattr(page_locate, "stats", {})
+
+
+class FakePage:
+    """Registra gli argomenti passati a _RESOLVE_JS e risponde con `results`."""
+
+    url = "https://my.casevacanza.it/wizard"
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def evaluate(self, _js, args):
+        self.calls.append(args)
+        return self.results.pop(0)
+
+    def locator(self, selector):
+        return selector
+
+
+PRICE = [("label", "Prezzo per notte"), ("placeholder", "Prezzo"), ("css", "input[name='price']")]
+
+
+def test_learned_favourite_is_tried_first():
+    page = FakePage({"index": 2, "tried": 3, "rejected": None, "tag": "INPUT", "type": "number"},
+                    {"index": 2, "tried": 1, "rejected": None, "tag": "INPUT", "type": "number"})
+    page_locate.resolve(page, PRICE, field="prezzo")
+    page_locate.resolve(page, PRICE, field="prezzo")
+
+    first, second = page.calls
+    assert first[1] == [0, 1, 2] and first[2] == -1
+    # Al secondo giro il vincitore del primo va in testa, con tag/type attesi
+    assert second[1] == [2, 0, 1]
+    assert second[2] == 2 and second[3] == ["INPUT", "number"]
+    assert page_locate.cache_stats["hits"] == 1
+    assert page_locate.cache_stats["skipped"] == 2
+
+
+def test_generic_css_never_becomes_favourite():
+    candidates = [("label", "Descrizione"), ("css", "textarea")]
+    page = FakePage({"index": 1, "tried": 2, "rejected": None, "tag": "TEXTAREA", "type": "textarea"},
+                    {"index": 1, "tried": 2, "rejected": None, "tag": "TEXTAREA", "type": "textarea"})
+    page_locate.resolve(page, candidates, field="descrizione")
+    page_locate.resolve(page, candidates, field="descrizione")
+
+    assert page.calls[1][1] == [0, 1] and page.calls[1][2] == -1
+    assert page_locate.cache_stats["learned"] == 0
+
+
+def test_rejected_favourite_is_dropped_and_replaced():
+    page = FakePage({"index": 2, "tried": 3, "rejected": None, "tag": "INPUT", "type": "number"},
+                    {"index": 0, "tried": 2, "rejected": "type", "tag": "INPUT", "type": "text"},
+                    {"index": 0, "tried": 1, "rejected": None, "tag": "INPUT", "type": "text"})
+    for _ in range(3):
+        page_locate.resolve(page, PRICE, field="prezzo")
+
+    assert page.calls[2][1] == [0, 1, 2]
+    assert page_locate.cache_stats["misses"] == 1
+    entry = next(iter(page_locate._cache.values()))
+    assert entry["favourite"] == "label:Prezzo per notte"
+
+
+def test_unmatched_drops_favourite_without_learning():
+    page = FakePage({"index": 2, "tried": 3, "rejected": None, "tag": "INPUT", "type": "number"},
+                    {"index": -1, "tried": 3, "rejected": "missing"})
+    assert page_locate.resolve(page, PRICE, field="prezzo") is not None
+    assert page_locate.resolve(page, PRICE, field="prezzo") is None
+
+    entry = next(iter(page_locate._cache.values()))
+    assert entry["favourite"] is None
+    assert page_locate.cache_stats["unmatched"] == 1
+
+
+# _RESOLVE_JS eseguito davvero, su un DOM minimo: solo candidati "css"
+_NODE_HARNESS = """
+const [js, elements, args] = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const make = ([id, tag, type]) => ({id, tagName: tag, type, attrs: {},
+    getBoundingClientRect: () => ({width: 10, height: 10}),
+    setAttribute(k, v) { this.attrs[k] = v; }});
+const nodes = elements.map(make);
+globalThis.getComputedStyle = () => ({visibility: 'visible'});
+globalThis.document = {querySelectorAll: (sel) => nodes.filter(n => '#' + n.id === sel)};
+const out = eval(js)(args);
+process.stdout.write(JSON.stringify(out));
+"""
+
+
+def _run_js(elements, candidates, order, favourite, expect):
+    args = [candidates, order, favourite, expect, False, True, 1]
+    done = subprocess.run(["node", "-e", _NODE_HARNESS], capture_output=True, text=True, check=True,
+                          input=json.dumps([page_locate._RESOLVE_JS, elements, args]))
+    return json.loads(done.stdout)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="serve node per eseguire _RESOLVE_JS")
+def test_resolve_js_favourite_wins_outright():
+    elements = [["a", "INPUT", "text"], ["b", "INPUT", "number"]]
+    candidates = [["css", "#a"], ["css", "#b"]]
+
+    code_order = _run_js(elements, candidates, [0, 1], -1, None)
+    assert code_order["index"] == 0 and code_order["tried"] == 1
+
+    learned = _run_js(elements, candidates, [1, 0], 1, ["INPUT", "number"])
+    assert learned["index"] == 1 and learned["tried"] == 1 and learned["rejected"] is None
+
+    wrong_type = _run_js(elements, candidates, [1, 0], 1, ["TEXTAREA", "textarea"])
+    assert wrong_type["index"] == 0 and wrong_type["rejected"] == "type"
+
+    gone = _run_js(elements[:1], candidates, [1, 0], 1, ["INPUT", "number"])
+    assert gone["index"] == 0 and gone["rejected"] == "missing"
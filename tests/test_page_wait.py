@@ -0,0 +1,87 @@
+"""until_idle con richieste che non finiscono mai (long polling, analytics)."""
+
+import time
+
+import page_wait
+
+
+class FakeRequest:
+    def __init__(self, resource_type="xhr"):
+        self.resource_type = resource_type
+
+
+class FakePage:
+    """Pagina con i soli eventi e attese usati da until_idle. Le richieste
+    programmate con `finish_after` terminano durante wait_for_timeout, come
+    gli eventi Playwright smaltiti dal loop."""
+
+    def __init__(self):
+        self.handlers = {}
+        self.scheduled = []
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def fire(self, event, request):
+        for handler in self.handlers.get(event, []):
+            handler(request)
+
+    def finish_after(self, request, ms):
+        self.scheduled.append((time.monotonic() + ms / 1000, request))
+
+    def wait_for_timeout(self, ms):
+        time.sleep(ms / 1000)
+        now = time.monotonic()
+        for due, request in [item for item in self.scheduled if item[0] <= now]:
+            self.scheduled.remove((due, request))
+            self.fire("requestfinished", request)
+
+    def evaluate(self, _js, args):
+        # _QUIET_JS: DOM già fermo, torna dopo quiet_ms
+        time.sleep(args[0] / 1000)
+        return True
+
+
+def test_never_ending_request_does_not_hold_until_cap():
+    page = FakePage()
+    page_wait.track(page)
+    page.fire("request", FakeRequest("xhr"))  # long polling: nessun requestfinished
+
+    t0 = time.monotonic()
+    ok = page_wait.until_idle(page, quiet_ms=50, max_ms=10_000)
+    elapsed_ms = (time.monotonic() - t0) * 1000
+
+    assert ok
+    assert page_wait.NETWORK_WINDOW_MS <= elapsed_ms < page_wait.NETWORK_WINDOW_MS + 1000
+
+
+def test_recent_request_still_holds_the_wait():
+    page = FakePage()
+    page_wait.track(page)
+    request = FakeRequest("fetch")
+    page.fire("request", request)
+    page.finish_after(request, 300)
+
+    t0 = time.monotonic()
+    ok = page_wait.until_idle(page, quiet_ms=50, max_ms=5000)
+    elapsed_ms = (time.monotonic() - t0) * 1000
+
+    assert ok
+    assert 300 <= elapsed_ms < page_wait.NETWORK_WINDOW_MS
+
+
+def test_other_resource_types_are_ignored():
+    page = FakePage()
+    page_wait.track(page)
+    page.fire("request", FakeRequest("image"))
+
+    t0 = time.monotonic()
+    assert page_wait.until_idle(page, quiet_ms=50, max_ms=5000)
+    assert (time.monotonic() - t0) * 1000 < 300
+
+
+def test_network_busy_window():
+    now = time.monotonic()
+    assert page_wait.network_busy({"recent": now - 0.1}, 1500)
+    assert not page_wait.network_busy({"old": now - 5}, 1500)
+    assert not page_wait.network_busy({}, 1500)